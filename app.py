@@ -1,15 +1,27 @@
 import os
+import atexit
 import logging
+import signal
+import time
 import sys
 import uuid
 import asyncio
-from flask import Flask, jsonify, request, render_template, session
+import threading
+import queue
+from flask import Flask, Response, jsonify, request, render_template, session
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from orchestrator import Orchestrator
-from config.config import Config
-from dotenv import load_dotenv
+from config.config import Config, load_environment, start_settings_watcher
+from services.clients import get_client_registry
+from services.metrics import get_metrics
+from services.azopenai import balancer_stats
+from services.resilience import resilience_stats
+from services.batch import BatchRunner
+from services.serialization import get_json_codec
+from services.streaming import format_sse
 
-load_dotenv()
+load_environment()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,16 +32,108 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
 
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider on the configured JSON backend (orjson when installed)."""
+
+    def dumps(self, obj, **kwargs):
+        return get_json_codec().dumps(obj, kwargs.get("sort_keys", self.sort_keys), bool(kwargs.get("indent")), self.default)
+
+    def loads(self, s, **kwargs):
+        return get_json_codec().loads(s)
+
+app.json = JSONProvider(app)
+
 CORS(app)
 
 # Initialize handler
 config = Config().config
 orchestrator = Orchestrator()
+orchestrator.warmup()
+batch_runner = BatchRunner(orchestrator)
+settings_watcher = start_settings_watcher()
+
+# Long-lived event loop shared by every request; the async service clients are bound to it
+loop = asyncio.new_event_loop()
+threading.Thread(target=loop.run_forever, name="orchestrator-loop", daemon=True).start()
+asyncio.run_coroutine_threadsafe(orchestrator.warmup_async(), loop).result()
+
+# Reported by /readyz: ready once the service connections are warm, draining once shutdown starts
+serving = {"ready": False, "draining": False, "in_flight": 0, "warmup": {}}
+serving_lock = threading.Lock()
+
+serving["warmup"] = asyncio.run_coroutine_threadsafe(orchestrator.warmup_connections_async(config["flask"].get("warmup_timeout_seconds", 30)), loop).result()
+serving["ready"] = True
+
+def shutdown():
+    """Flushes pending writes and closes the async service clients bound to the shared event loop."""
+    serving["draining"] = True
+    asyncio.run_coroutine_threadsafe(orchestrator.close_async(), loop).result()
+
+# Flush the write-behind queue before the process exits
+atexit.register(shutdown)
+
+def count_in_flight(change):
+    with serving_lock:
+        serving["in_flight"] += change
+
+@app.before_request
+def start_in_flight():
+    """Counts the chat requests being answered, including streams until their last event."""
+    if request.path.startswith("/chat"):
+        count_in_flight(1)
+
+@app.after_request
+def finish_in_flight(response):
+    if request.path.startswith("/chat"):
+        response.call_on_close(lambda: count_in_flight(-1))
+    return response
 
 @app.route("/")
 def index():
     return render_template('index.html')
 
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness probe."""
+    return jsonify({"status": "alive"}), 200
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness probe: 200 once warmup finished, 503 before that and while draining."""
+    ready = serving["ready"] and not serving["draining"]
+    payload = {"ready": ready, "draining": serving["draining"], "in_flight": serving["in_flight"], "warmup": serving["warmup"]}
+    return jsonify(payload), 200 if ready else 503
+
+@app.route("/clients", methods=["GET"])
+def clients():
+    """Endpoint exposing how often the pooled service clients were created and reused."""
+    return jsonify(get_client_registry().stats()), 200
+
+@app.route("/persistence", methods=["GET"])
+def persistence():
+    """Endpoint exposing the depth and flush latency of the write-behind persistence queue."""
+    return jsonify(orchestrator.persistence.stats()), 200
+
+@app.route("/retrieval", methods=["GET"])
+def retrieval():
+    """Endpoint exposing the retrieval and query embedding caches, with search and embedding latency."""
+    return jsonify(orchestrator.retrieval_stats()), 200
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Endpoint exposing latency, token and cost metrics in the Prometheus text format."""
+    return Response(get_metrics().render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/resilience", methods=["GET"])
+def resilience():
+    """Endpoint exposing circuit breaker states and retry counts per dependency."""
+    return jsonify(resilience_stats()), 200
+
+@app.route("/deployments", methods=["GET"])
+def deployments():
+    """Endpoint exposing the outstanding load, drains and throughput of each Azure OpenAI backend."""
+    return jsonify(balancer_stats()), 200
+
 @app.route("/chat", methods=["POST"])
 def chat():
     """Endpoint for handling chat requests."""
@@ -54,8 +158,12 @@ def chat():
             logger.error("Missing 'query' in the request.")
             return jsonify({"error": "Missing 'query' in the request."}), 400
 
-        response = asyncio.run(orchestrator.run(session_id, query))
-        return response
+        # Retries carrying the key of an earlier request get its answer instead of a new turn
+        idempotency_key = request.headers.get("Idempotency-Key")
+        payload, status = asyncio.run_coroutine_threadsafe(orchestrator.answer(session_id, query, idempotency_key=idempotency_key), loop).result()
+        if "retry_after" in payload:
+            return jsonify(payload), status, {"Retry-After": str(payload["retry_after"])}
+        return jsonify(payload), status
     except KeyError as e:
         logger.error(f"Missing key in JSON data: {e}")
         return jsonify({"error": f"Missing key in JSON data: {e}"}), 400
@@ -63,9 +171,97 @@ def chat():
         logger.error(f"Error during chat processing: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """Endpoint answering a list of independent queries; larger jobs go through scripts/batch_answer.py."""
+    try:
+        logger.info("Processing batch chat request...")
+
+        data = request.get_json(force=True)
+        queries = data.get("queries") if isinstance(data, dict) else None
+        if not isinstance(queries, list) or not queries:
+            logger.error("Missing 'queries' in the request.")
+            return jsonify({"error": "Missing 'queries' in the request."}), 400
+        if len(queries) > batch_runner.max_request_items:
+            return jsonify({"error": f"At most {batch_runner.max_request_items} queries per request."}), 413
+
+        items = batch_runner.parse_items(queries)
+        results, costs, summary = asyncio.run_coroutine_threadsafe(batch_runner.run(items), loop).result()
+        return jsonify({"results": results, "costs": costs, "summary": summary}), 200
+    except ValueError as e:
+        logger.error(f"Invalid batch chat request: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error during batch chat processing: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Endpoint streaming the answer to a chat request as Server-Sent Events."""
+    try:
+        logger.info("Processing streamed chat request...")
+
+        data = request.get_json(force=True)
+        if not data:
+            logger.error("No se recibió JSON en la solicitud.")
+            return jsonify({"error": "No se recibió JSON en la solicitud."}), 400
+
+        logger.info(f"Received data: {data}")
+
+        session_id = data.get('sessionID') or session.get('sessionID')
+
+        if not session_id:
+            session_id = str(uuid.uuid4())
+            session['session_id'] = session_id
+
+        query = data.get('query')
+        if not query:
+            logger.error("Missing 'query' in the request.")
+            return jsonify({"error": "Missing 'query' in the request."}), 400
+
+        idempotency_key = request.headers.get("Idempotency-Key")
+        events = queue.Queue()
+
+        async def produce():
+            try:
+                async for event, payload in orchestrator.answer_stream(session_id, query, idempotency_key):
+                    events.put(format_sse(event, payload))
+            finally:
+                events.put(None)
+
+        # The answer is produced on the shared event loop and relayed from this worker thread
+        asyncio.run_coroutine_threadsafe(produce(), loop)
+
+        def relay():
+            while (message := events.get()) is not None:
+                yield message
+
+        return Response(relay(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    except Exception as e:
+        logger.error(f"Error during streamed chat processing: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def drain(signum, frame):
+    """Reports draining on /readyz and stops the server once the chats in flight finished or the graceful timeout ran out."""
+    if serving["draining"]:
+        return
+    serving["draining"] = True
+    logger.info(f"Received signal {signum}; draining {serving['in_flight']} chats in flight.")
+
+    def stop():
+        deadline = time.monotonic() + config["flask"].get("graceful_timeout_seconds", 30)
+        while serving["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.1)
+        # Interrupts the development server in the main thread; the atexit handler then flushes pending writes
+        os.kill(os.getpid(), signal.SIGINT)
+
+    threading.Thread(target=stop, name="drain", daemon=True).start()
+
 def start_app():
-    """Starts the Flask application."""
-    app.run(host=config["flask"]["host"], port=config["flask"]["port"], debug=True)
+    """Starts the Flask application; debug mode (reloader and debugger) only with `flask.debug` or FLASK_DEBUG=1."""
+    debug = os.getenv("FLASK_DEBUG", str(config["flask"].get("debug", False))).lower() in ("1", "true")
+    signal.signal(signal.SIGTERM, drain)
+    app.run(host=config["flask"]["host"], port=config["flask"]["port"], debug=debug)
 
 if __name__ == "__main__":
     start_app()
\ No newline at end of file
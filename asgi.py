@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse as StarletteJSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+from orchestrator import Orchestrator
+from config.config import Config, load_environment, start_settings_watcher
+from services.clients import get_client_registry
+from services.metrics import get_metrics
+from services.azopenai import balancer_stats
+from services.resilience import resilience_stats
+from services.batch import BatchRunner
+from services.serialization import get_json_codec
+from services.streaming import format_sse
+
+load_environment()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Initialize handler
+config = Config().config
+orchestrator = Orchestrator()
+batch_runner = BatchRunner(orchestrator)
+
+# Size of the pool running sync pipeline stages and blocking SDK calls; serve.py may override it
+executor_threads = config["flask"].get("threads")
+
+# Reported by /readyz: ready once the service connections are warm, draining once shutdown starts
+serving = {"ready": False, "draining": False, "in_flight": 0, "warmup": {}}
+
+class InFlightMiddleware:
+    """Counts the chat requests being answered, including streams until their last event."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/chat"):
+            return await self.app(scope, receive, send)
+        serving["in_flight"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            serving["in_flight"] -= 1
+
+class JSONResponse(StarletteJSONResponse):
+    """JSON response rendered with the configured JSON backend (orjson when installed)."""
+
+    def render(self, content):
+        return get_json_codec().dumps_bytes(content)
+
+templates = Jinja2Templates(directory="templates")
+# Keep the Flask-style url_for('static', filename=...) used by the templates working
+templates.env.globals["url_for"] = lambda endpoint, filename="": f"/{endpoint}/{filename}"
+
+async def index(request: Request):
+    return templates.TemplateResponse(request, "index.html")
+
+async def clients(request: Request):
+    """Endpoint exposing how often the pooled service clients were created and reused."""
+    return JSONResponse(get_client_registry().stats())
+
+async def persistence(request: Request):
+    """Endpoint exposing the depth and flush latency of the write-behind persistence queue."""
+    return JSONResponse(orchestrator.persistence.stats())
+
+async def retrieval(request: Request):
+    """Endpoint exposing the retrieval and query embedding caches, with search and embedding latency."""
+    return JSONResponse(orchestrator.retrieval_stats())
+
+async def metrics(request: Request):
+    """Endpoint exposing latency, token and cost metrics in the Prometheus text format."""
+    return PlainTextResponse(get_metrics().render(), media_type="text/plain; version=0.0.4")
+
+async def resilience(request: Request):
+    """Endpoint exposing circuit breaker states and retry counts per dependency."""
+    return JSONResponse(resilience_stats())
+
+async def deployments(request: Request):
+    """Endpoint exposing the outstanding load, drains and throughput of each Azure OpenAI backend."""
+    return JSONResponse(balancer_stats())
+
+async def healthz(request: Request):
+    """Liveness probe: the worker's event loop is responding."""
+    return JSONResponse({"status": "alive"})
+
+async def readyz(request: Request):
+    """Readiness probe: 200 once warmup finished, 503 before that and while draining."""
+    ready = serving["ready"] and not serving["draining"]
+    payload = {"ready": ready, "draining": serving["draining"], "in_flight": serving["in_flight"], "warmup": serving["warmup"]}
+    return JSONResponse(payload, status_code=200 if ready else 503)
+
+async def chat(request: Request):
+    """Endpoint for handling chat requests without blocking the event loop."""
+    try:
+        logger.info("Processing chat request...")
+
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            logger.error("No JSON received in the request.")
+            return JSONResponse({"error": "No JSON received in the request."}, status_code=400)
+
+        logger.info(f"Received data: {data}")
+
+        session_id = data.get('sessionID') or str(uuid.uuid4())
+
+        query = data.get('query')
+        if not query:
+            logger.error("Missing 'query' in the request.")
+            return JSONResponse({"error": "Missing 'query' in the request."}, status_code=400)
+
+        # Retries carrying the key of an earlier request get its answer instead of a new turn
+        idempotency_key = request.headers.get("Idempotency-Key")
+        payload, status = await orchestrator.answer(session_id, query, idempotency_key=idempotency_key)
+        headers = {"Retry-After": str(payload["retry_after"])} if "retry_after" in payload else None
+        return JSONResponse(payload, status_code=status, headers=headers)
+    except Exception as e:
+        logger.error(f"Error during chat processing: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def chat_batch(request: Request):
+    """Endpoint answering a list of independent queries; larger jobs go through scripts/batch_answer.py."""
+    try:
+        logger.info("Processing batch chat request...")
+
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        queries = data.get("queries") if isinstance(data, dict) else None
+        if not isinstance(queries, list) or not queries:
+            logger.error("Missing 'queries' in the request.")
+            return JSONResponse({"error": "Missing 'queries' in the request."}, status_code=400)
+        if len(queries) > batch_runner.max_request_items:
+            return JSONResponse({"error": f"At most {batch_runner.max_request_items} queries per request."}, status_code=413)
+
+        items = batch_runner.parse_items(queries)
+        results, costs, summary = await batch_runner.run(items)
+        return JSONResponse({"results": results, "costs": costs, "summary": summary})
+    except ValueError as e:
+        logger.error(f"Invalid batch chat request: {e}")
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error during batch chat processing: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def chat_stream(request: Request):
+    """Endpoint streaming the answer to a chat request as Server-Sent Events."""
+    try:
+        logger.info("Processing streamed chat request...")
+
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            logger.error("No JSON received in the request.")
+            return JSONResponse({"error": "No JSON received in the request."}, status_code=400)
+
+        logger.info(f"Received data: {data}")
+
+        session_id = data.get('sessionID') or str(uuid.uuid4())
+
+        query = data.get('query')
+        if not query:
+            logger.error("Missing 'query' in the request.")
+            return JSONResponse({"error": "Missing 'query' in the request."}, status_code=400)
+
+        idempotency_key = request.headers.get("Idempotency-Key")
+
+        async def events():
+            async for event, payload in orchestrator.answer_stream(session_id, query, idempotency_key):
+                yield format_sse(event, payload)
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    except Exception as e:
+        logger.error(f"Error during streamed chat processing: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def startup():
+    """Opens the async service clients and their connections on the server event loop."""
+    flask_config = config["flask"]
+    if executor_threads:
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(executor_threads, thread_name_prefix="orchestrator"))
+    await orchestrator.warmup_async()
+    if flask_config.get("warmup_connections", True):
+        serving["warmup"] = await orchestrator.warmup_connections_async(flask_config.get("warmup_timeout_seconds", 30))
+    start_settings_watcher()
+    serving["ready"] = True
+
+async def shutdown():
+    """Flushes pending writes and closes the async service clients bound to the server event loop."""
+    serving["draining"] = True
+    await orchestrator.close_async()
+
+app = Starlette(
+    routes=[
+        Route("/", index),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/readyz", readyz, methods=["GET"]),
+        Route("/clients", clients, methods=["GET"]),
+        Route("/persistence", persistence, methods=["GET"]),
+        Route("/retrieval", retrieval, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/resilience", resilience, methods=["GET"]),
+        Route("/deployments", deployments, methods=["GET"]),
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/batch", chat_batch, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Mount("/static", app=StaticFiles(directory="static"), name="static"),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(InFlightMiddleware),
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
+
+def start_app():
+    """Starts the ASGI application with uvicorn."""
+    uvicorn.run("asgi:app", host=config["flask"]["host"], port=config["flask"]["port"])
+
+if __name__ == "__main__":
+    start_app()
@@ -0,0 +1,102 @@
+"""Aggregate throughput of one logical model spread over 1..N Azure OpenAI backends.
+
+Each backend is a fault server with its own requests-per-minute quota (429 with
+retry-after-ms beyond it). Concurrent chat completions go through the deployment
+balancer and the resilience policy with the real async SDK client for a fixed time;
+the report shows completed calls per second, the share served by each backend and the
+429s drawn. Throughput should grow with the number of backends until the offered load
+is served, and an --outage backend should be drained and failed over.
+
+Usage:
+    python -m benchmarks.balancer --backends 1 2 3 --rpm 600 --duration 5 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from benchmarks.fault_server import start_fault_server
+from benchmarks.stubs import STUB_ENV_VARS
+from services.azopenai import AzureOpenAIClient, DeploymentBalancer
+from services.resilience import get_resilience
+
+MESSAGES = [{"role": "user", "content": "How do I reset my password?"}]
+
+async def drive(azureopenai, balancer, duration, concurrency):
+    policy = get_resilience("openai")
+    completed = 0
+    failed = 0
+    deadline = time.perf_counter() + duration
+
+    async def send(backend, timeout):
+        client = await azureopenai.get_async_client(backend)
+        return await client.chat.completions.create(model=backend.deployment, messages=MESSAGES, max_tokens=50, **azureopenai.timeout_kwargs(timeout))
+
+    async def worker():
+        nonlocal completed, failed
+        while time.perf_counter() < deadline:
+            try:
+                await policy.call_async(lambda timeout: balancer.call_async(lambda backend: send(backend, timeout), 100))
+                completed += 1
+            except Exception:
+                failed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await azureopenai_close()
+    return completed, failed, elapsed
+
+async def azureopenai_close():
+    from services.clients import get_client_registry
+    await get_client_registry().close_async()
+
+def run(count, args):
+    servers = []
+    specs = []
+    for position in range(count):
+        server, state, url = start_fault_server(seed=position)
+        state.update("openai", rpm_limit=args.rpm, latency_seconds=args.latency)
+        if args.outage and position == 0:
+            state.update("openai", rate_503=1.0)
+        os.environ[f"BALANCER_ENDPOINT_{position}"] = url
+        servers.append((server, state))
+        specs.append({"name": f"region-{position}", "endpoint_env": f"BALANCER_ENDPOINT_{position}", "tpm": args.rpm * 100})
+    balancer = DeploymentBalancer("gpt-4o", specs)
+    completed, failed, elapsed = asyncio.run(drive(AzureOpenAIClient(), balancer, args.duration, args.concurrency))
+    responses = {}
+    for server, state in servers:
+        for key, value in state.snapshot()["responses"].items():
+            responses[key] = responses.get(key, 0) + value
+        server.shutdown()
+    return {
+        "backends": count,
+        "completed": completed,
+        "failed": failed,
+        "calls_per_s": round(completed / elapsed, 2),
+        "quota_calls_per_s": round((count - (1 if args.outage else 0)) * args.rpm / 60, 2),
+        "served_by": {name: stats["requests"] for name, stats in balancer.stats().items()},
+        "upstream_responses": responses,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--rpm", type=int, default=600, help="Requests per minute quota of each backend.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Response latency of each backend in seconds.")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--outage", action="store_true", help="Make the first backend answer every call with 503.")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    for name, value in STUB_ENV_VARS.items():
+        os.environ.setdefault(name, value)
+    # The quota is enforced by the fault servers; the local rate limiter would hide it
+    get_resilience("openai").limiters = {}
+    results = [run(count, args) for count in args.backends]
+    print(json.dumps({"config": vars(args), "runs": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Checks and measures the paged Cosmos DB session layout against the legacy single-document one.
+
+Runs on the in-memory fake containers: concurrent appends to one session, migration of legacy
+documents, recent-turn reads, and bytes moved per turn as sessions grow.
+
+Usage:
+    python -m benchmarks.cosmos_layout --turns 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+from azure.cosmos import exceptions
+from benchmarks.stubs import install_stubs
+
+def turn_messages(index):
+    return [{"role": "user", "content": f"Question {index}?"}, {"role": "assistant", "content": f"'''Answer {index}.'''"}]
+
+async def legacy_append(container, session_id, items, field):
+    """Replays the previous write path: read the whole document, extend it and upsert it back."""
+    try:
+        item = await container.read_item(item=session_id, partition_key=session_id)
+        item.setdefault(field, []).extend(items)
+    except exceptions.CosmosResourceNotFoundError:
+        item = {"id": session_id, field: items}
+    await container.upsert_item(item)
+
+def traffic(container):
+    return {"calls": sum(container.calls.values()), "bytes": container.bytes_sent + container.bytes_received}
+
+def reset(container):
+    container.calls.clear()
+    container.bytes_sent = 0
+    container.bytes_received = 0
+
+async def check_concurrent_appends(cosmos, container, concurrency):
+    await asyncio.gather(*(
+        cosmos.append_async(cosmos.container_history, "concurrent", turn_messages(index), "chat_history")
+        for index in range(concurrency)
+    ))
+    head, entries = await cosmos.read_recent_async(cosmos.container_history, "concurrent", "chat_history")
+    assert head["turns"] == concurrency, head
+    assert [entry["turn"] for entry in entries] == list(range(1, concurrency + 1)), entries
+
+    await asyncio.gather(*(
+        legacy_append(container, "concurrent-legacy", turn_messages(index), "chat_history")
+        for index in range(concurrency)
+    ))
+    legacy = await container.read_item(item="concurrent-legacy", partition_key="concurrent-legacy")
+    return {"turns_written": concurrency, "paged_turns_kept": len(entries), "legacy_turns_kept": len(legacy["chat_history"]) // 2}
+
+async def check_migration(cosmos, container, turns, recent):
+    legacy = [message for index in range(turns) for message in turn_messages(index)]
+    await container.upsert_item({"id": "legacy", "chat_history": legacy, "summary": {"text": "Earlier turns.", "turns": 3}})
+
+    session = await cosmos.get_session_async("legacy", recent)
+    assert session["chat_history"] == legacy[-2 * recent:] and session["offset"] == turns - recent, session
+
+    await cosmos.append_async(cosmos.container_history, "legacy", turn_messages(turns), "chat_history")
+    head = await container.read_item(item="legacy", partition_key="legacy")
+    assert head["layout"] == 2 and head["turns"] == turns + 1 and "chat_history" not in head, head
+    assert head["summary"]["turns"] == 3, head
+
+    session = await cosmos.get_session_async("legacy", recent)
+    assert session["chat_history"] == (legacy + turn_messages(turns))[-2 * recent:], session
+    full = await cosmos.get_chat_history_async("legacy")
+    assert full == legacy + turn_messages(turns)
+
+    for index in range(3):
+        await container.upsert_item({"id": f"bulk-{index}", "chat_history": turn_messages(index)})
+    migrated = await cosmos.migrate_container_async(cosmos.container_history, "chat_history")
+    # The bulk documents plus the session written by the legacy path in the concurrency check
+    assert migrated == 4, migrated
+    assert await cosmos.migrate_container_async(cosmos.container_history, "chat_history") == 0
+    return {"legacy_turns": turns, "bulk_migrated": migrated}
+
+async def measure(cosmos, container, turns, recent):
+    """Bytes and calls to write one turn and read the history back, at several session lengths."""
+    checkpoints = {length for length in (10, 50, 100, turns) if length <= turns}
+    rows = []
+    for index in range(turns):
+        reset(container)
+        await legacy_append(container, "measure-legacy", turn_messages(index), "chat_history")
+        await container.read_item(item="measure-legacy", partition_key="measure-legacy")
+        legacy = traffic(container)
+
+        reset(container)
+        await cosmos.append_async(cosmos.container_history, "measure-paged", turn_messages(index), "chat_history")
+        await cosmos.get_session_async("measure-paged", recent)
+        paged = traffic(container)
+        if index + 1 in checkpoints:
+            rows.append({"session_turns": index + 1, "legacy": legacy, "paged": paged})
+    return rows
+
+async def run(turns, concurrency, recent):
+    install_stubs(cosmos_latency=0.001)
+    from services.cosmosdb import AzureCosmosDBClient
+    cosmos = AzureCosmosDBClient()
+    container = await cosmos.get_async_container(cosmos.container_history)
+    return {
+        "concurrent_appends": await check_concurrent_appends(cosmos, container, concurrency),
+        "migration": await check_migration(cosmos, container, turns, recent),
+        "per_turn_traffic": await measure(cosmos, container, turns, recent),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--recent", type=int, default=10, help="Turns read back for the model.")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    print(json.dumps({"config": vars(args), **asyncio.run(run(args.turns, args.concurrency, args.recent))}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Measures client-side query vectorization with the embedding cache against stub Azure services.
+
+Retrieves a skewed (Zipf) mix of queries, some spelled differently, through
+AzureAISearchClient with the index vectorizer ("service") and with query vectors computed
+here ("client"); the retrieval cache is off so every query reaches the search stub. The
+service mode is charged the embedding latency inside the search, as the index vectorizer
+calls the same deployment. Reports retrieval latency, embedding calls, the embedding cache
+hit rate, and embedding latency apart from search latency. Also checks that concurrent
+requests for a new query share one embedding call, that the answer cache reuses the search
+vector, the int8 storage error and size, and that vectors written to the disk tier are read
+back by a new cache. The exit code is 1 when a check fails.
+
+Usage:
+    python -m benchmarks.embedding_cache [--queries 500] [--embedding-latency 0.02]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.stubs import install_stubs
+from benchmarks.suite import QUERIES, percentile
+
+def query_mix(count, seed):
+    chooser = random.Random(seed)
+    topics = QUERIES + [f"{query.rstrip('?')} for business accounts?" for query in QUERIES]
+    weights = [1 / (rank + 1) for rank in range(len(topics))]
+    mix = []
+    for _ in range(count):
+        query = chooser.choices(topics, weights)[0]
+        if chooser.random() < 0.3:
+            # Differs only in case and punctuation; shares the normalized cache key
+            query = query.upper().rstrip("?") + " ?"
+        mix.append(query)
+    return mix
+
+def fresh_embedder():
+    import services.embeddings as embeddings
+    embeddings._query_embedder = None
+    return embeddings.get_query_embedder()
+
+async def retrieval(mode, queries, args, stubs):
+    """Retrieves the queries one after another; returns the latency and cache statistics."""
+    from services.aisearch import AzureAISearchClient
+    stubs["search_async"].latency = args.search_latency + (args.embedding_latency if mode == "service" else 0.0)
+    embedder = fresh_embedder()
+    search = AzureAISearchClient()
+    search.cache_enabled = False
+    search.vectorization = mode
+    search.query_embedder = embedder if mode == "client" else None
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        await search.run_async(query)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    stats = search.cache_stats()
+    report = {
+        "retrieval_p50_s": percentile(latencies, 0.5),
+        "retrieval_p95_s": percentile(latencies, 0.95),
+        "search_latency_mean_s": stats["search_latency_mean_s"],
+    }
+    if mode == "client":
+        embedding = embedder.stats()
+        report.update(
+            embedding_calls=embedding["embedding_calls"],
+            embedding_cache_hit_rate=round(embedding["hit_rate"], 4),
+            embedding_latency_mean_s=embedding["embedding_latency_mean_s"],
+        )
+    return report
+
+async def shared_calls(args):
+    """Concurrent requests for one new query, then the answer cache and search on another query."""
+    from services.aisearch import AzureAISearchClient
+    from services.answer_cache import AnswerCache
+    embedder = fresh_embedder()
+    await asyncio.gather(*(embedder.embed_async(["A question nobody asked before?"]) for _ in range(args.concurrency)))
+    concurrent_calls = embedder.embedding_calls
+
+    answer_cache = AnswerCache(embedder.embed_async)
+    search = AzureAISearchClient()
+    search.cache_enabled = False
+    search.query_embedder = embedder
+    before = embedder.embedding_calls
+    await answer_cache.lookup("How do I rotate my API keys?")
+    await search.run_async("How do I rotate my API keys?")
+    return {"concurrent_requests": args.concurrency, "concurrent_embedding_calls": concurrent_calls, "answer_cache_and_search_calls": embedder.embedding_calls - before}
+
+def storage(args):
+    """Size of one vector per storage and the cosine error of int8 on random unit vectors."""
+    from services.embeddings import EmbeddingCache
+    generator = np.random.default_rng(args.seed)
+    vectors = generator.standard_normal((200, args.dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    cache = EmbeddingCache(dimensions=args.dimensions)
+    cache.storage = "int8"
+    errors = []
+    for vector in vectors:
+        decoded = np.asarray(cache.decode(cache.encode(vector)), dtype=np.float32)
+        errors.append(1 - float(decoded @ vector / np.linalg.norm(decoded)))
+    return {
+        "python_list_bytes": sys.getsizeof(vectors[0].tolist()) + args.dimensions * sys.getsizeof(0.1),
+        "float32_bytes": args.dimensions * 4,
+        "int8_bytes": args.dimensions + 8,
+        "int8_max_cosine_error": round(max(errors), 8),
+    }
+
+def disk(args):
+    """Writes vectors through one cache and reads them back through another, as a restarted worker would."""
+    from services.embeddings import EmbeddingCache
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "embeddings.sqlite")
+        vectors = {f"text {number}": [float(value) for value in np.random.default_rng(number).standard_normal(args.dimensions)] for number in range(50)}
+        writer = EmbeddingCache(dimensions=args.dimensions)
+        writer.disk_path = path
+        writer.open_disk()
+        writer.put_disk(writer.put({writer.key(text): vector for text, vector in vectors.items()}))
+        reader = EmbeddingCache(dimensions=args.dimensions)
+        reader.disk_path = path
+        reader.open_disk()
+        found = reader.get_disk([reader.key(text) for text in vectors])
+        writer.disk.close()
+        reader.disk.close()
+    return {"written": len(vectors), "read_back": len(found)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="Latency of one embedding call.")
+    parser.add_argument("--search-latency", type=float, default=0.02, help="Latency of a search without vectorization.")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent requests of the shared call check.")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    stubs = install_stubs(0.01, args.search_latency, 0.0, embedding_latency=args.embedding_latency)
+    queries = query_mix(args.queries, args.seed)
+    report = {
+        "config": vars(args),
+        "retrieval": {mode: asyncio.run(retrieval(mode, queries, args, stubs)) for mode in ("service", "client")},
+        "shared_calls": asyncio.run(shared_calls(args)),
+        "storage": storage(args),
+        "disk": disk(args),
+    }
+    failures = []
+    if report["shared_calls"]["concurrent_embedding_calls"] != 1:
+        failures.append("concurrent requests for one query made several embedding calls")
+    if report["shared_calls"]["answer_cache_and_search_calls"] != 1:
+        failures.append("the answer cache and the search embedded the same query twice")
+    if report["storage"]["int8_max_cosine_error"] > 1e-3:
+        failures.append("int8 storage changed the vectors beyond 1e-3 cosine")
+    if report["disk"]["read_back"] != report["disk"]["written"]:
+        failures.append("vectors written to the disk tier were not read back")
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Fault-injecting stand-in for the Azure OpenAI and Azure AI Search REST endpoints.
+
+Answers chat completions (JSON and SSE streams), embeddings and index searches with
+canned payloads that the real SDK clients accept, and injects faults at configurable
+rates per service: 429 with retry-after-ms, 500, 503 and slow responses that trip
+client timeouts. `rpm_limit` emulates a deployment quota: requests beyond it get a 429
+with the retry-after-ms until the quota refills. Faults can be changed while it runs with POST /_faults, and GET
+/_stats returns the responses sent per service and status.
+
+Point the clients at it with AZURE_OPENAI_ENDPOINT and AZURE_AI_SEARCH_ENDPOINT set to
+http://127.0.0.1:<port>, or start it in-process with `start_fault_server()`.
+
+Usage:
+    python -m benchmarks.fault_server --port 8089 --rate-429 0.2 --rate-503 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_FAULTS = {
+    "rate_429": 0.0,
+    "rate_500": 0.0,
+    "rate_503": 0.0,
+    "slow_rate": 0.0,
+    "slow_seconds": 5.0,
+    "retry_after_ms": 500,
+    "latency_seconds": 0.0,
+    "rpm_limit": 0,
+}
+
+_DEPLOYMENT_PATH = re.compile(r"^/openai/deployments/([^/]+)/(chat/completions|embeddings)")
+
+class FaultState:
+    """Fault rates per service ("openai", "search") and the responses sent so far."""
+
+    def __init__(self, seed=None):
+        self._lock = threading.Lock()
+        self.faults = {"openai": dict(DEFAULT_FAULTS), "search": dict(DEFAULT_FAULTS)}
+        self.stats = Counter()
+        self.random = random.Random(seed)
+        self.quota = {"openai": [0.0, None], "search": [0.0, None]}
+
+    def update(self, service, **faults):
+        with self._lock:
+            services = self.faults if service == "all" else {service: self.faults[service]}
+            for settings in services.values():
+                settings.update((key, value) for key, value in faults.items() if key in DEFAULT_FAULTS)
+
+    def throttle(self, service, rpm):
+        """Takes one request from a one-second quota bucket; returns the ms to wait if it is empty."""
+        rate = rpm / 60.0
+        with self._lock:
+            level, updated = self.quota[service]
+            now = time.monotonic()
+            level = rate if updated is None else min(rate, level + (now - updated) * rate)
+            if level >= 1:
+                self.quota[service] = [level - 1, now]
+                return 0
+            self.quota[service] = [level, now]
+            return int((1 - level) / rate * 1000) + 1
+
+    def draw(self, service):
+        """Picks the fault for one request: a status code, "slow" or None."""
+        with self._lock:
+            faults = dict(self.faults[service])
+            roll = self.random.random()
+        if faults["rpm_limit"]:
+            wait_ms = self.throttle(service, faults["rpm_limit"])
+            if wait_ms:
+                return 429, dict(faults, retry_after_ms=wait_ms)
+        for status in (429, 500, 503):
+            rate = faults[f"rate_{status}"]
+            if roll < rate:
+                return status, faults
+            roll -= rate
+        if roll < faults["slow_rate"]:
+            return "slow", faults
+        return None, faults
+
+    def count(self, service, status):
+        with self._lock:
+            self.stats[f"{service}:{status}"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"faults": {service: dict(faults) for service, faults in self.faults.items()}, "responses": dict(self.stats)}
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+def completion_payload(model, answer, prompt_tokens):
+    arguments = json.dumps({"answer": answer})
+    return {
+        "id": "chatcmpl-fault",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": None, "function_call": {"name": "output_structure", "arguments": arguments}},
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+    }
+
+def stream_events(model, answer, prompt_tokens, chunk_size=8):
+    arguments = json.dumps({"answer": answer})
+    base = {"id": "chatcmpl-fault", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+    pieces = [arguments[start:start + chunk_size] for start in range(0, len(arguments), chunk_size)]
+    for position, piece in enumerate(pieces):
+        delta = {"function_call": {"arguments": piece}}
+        if position == 0:
+            delta = {"role": "assistant", "content": None, "function_call": {"name": "output_structure", "arguments": piece}}
+        yield dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+    yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces), "total_tokens": prompt_tokens + len(pieces)}
+    yield dict(base, choices=[], usage=usage)
+
+def embeddings_payload(model, inputs, dimensions):
+    inputs = [inputs] if isinstance(inputs, str) else inputs
+    data = []
+    for index, text in enumerate(inputs):
+        generator = random.Random(text)
+        data.append({"object": "embedding", "index": index, "embedding": [generator.uniform(-1, 1) for _ in range(dimensions)]})
+    tokens = sum(len(text.split()) for text in inputs)
+    return {"object": "list", "model": model, "data": data, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+def search_payload(top):
+    return {"value": [
+        {"@search.score": round(1.0 / (rank + 1), 4), "chunk": f"Fault server chunk {rank} about the product and its policies."}
+        for rank in range(top)
+    ]}
+
+class FaultHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else {}
+
+    def do_GET(self):
+        if self.path.startswith("/_stats"):
+            return self.send_json(200, self.state.snapshot())
+        self.send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path.startswith("/_faults"):
+            self.state.update(body.pop("service", "all"), **body)
+            return self.send_json(200, self.state.snapshot())
+        if self.path.startswith("/_reset"):
+            self.state.reset()
+            return self.send_json(200, self.state.snapshot())
+        match = _DEPLOYMENT_PATH.match(self.path)
+        if match:
+            service = "openai"
+        elif "/docs/search" in self.path:
+            service = "search"
+        else:
+            return self.send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+
+        fault, faults = self.state.draw(service)
+        if faults["latency_seconds"]:
+            time.sleep(faults["latency_seconds"])
+        if fault == "slow":
+            time.sleep(faults["slow_seconds"])
+        elif fault is not None:
+            self.state.count(service, fault)
+            headers = {}
+            if fault == 429:
+                headers = {"retry-after-ms": str(faults["retry_after_ms"]), "retry-after": str(max(1, round(faults["retry_after_ms"] / 1000)))}
+            error = {"code": str(fault), "message": f"Injected fault {fault}."}
+            return self.send_json(fault, {"error": error}, headers)
+        self.state.count(service, "slow" if fault == "slow" else 200)
+
+        if service == "search":
+            return self.send_json(200, search_payload(body.get("top") or 5))
+        model, operation = match.groups()
+        if operation == "embeddings":
+            return self.send_json(200, embeddings_payload(model, body.get("input", []), body.get("dimensions") or 64))
+        prompt_tokens = sum(len(str(message.get("content") or "").split()) for message in body.get("messages", []))
+        answer = "Answer from the fault server."
+        if not body.get("stream"):
+            return self.send_json(200, completion_payload(model, answer, prompt_tokens))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for event in stream_events(model, answer, prompt_tokens):
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+def start_fault_server(host="127.0.0.1", port=0, seed=None):
+    """Starts the server on a daemon thread; returns (server, state, base_url)."""
+    state = FaultState(seed)
+    handler = type("BoundFaultHandler", (FaultHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--service", choices=("all", "openai", "search"), default="all")
+    parser.add_argument("--seed", type=int)
+    for name, default in DEFAULT_FAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=default)
+    args = parser.parse_args()
+
+    server, state, url = start_fault_server(args.host, args.port, args.seed)
+    state.update(args.service, **{name: getattr(args, name) for name in DEFAULT_FAULTS})
+    print(f"Fault server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
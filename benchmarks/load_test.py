@@ -0,0 +1,95 @@
+"""Local load test comparing the blocking and the native async chat paths against stub services.
+
+Usage:
+    python -m benchmarks.load_test --requests 400 --concurrency 200 --threads 8 --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.stubs import install_stubs
+
+async def legacy_turn(orchestrator, session_id, query):
+    """Replays the previous request path: blocking service calls inside a per-request event loop."""
+    context_results = orchestrator.azureaisearch.run(query)
+    context = [item['content'] for item in context_results]
+    user_input = {"CONTEXT": f"'''{context}'''", "QUERY": {query}}
+    message_user = [{"role": "user", "content": f"'''{user_input}'''"}]
+    container = orchestrator.azurecosmos.container_history
+    try:
+        history = await asyncio.to_thread(container.read_item, item=session_id, partition_key=session_id)
+        messages_history = history.get("chat_history", [])
+    except Exception:
+        messages_history = []
+    result = orchestrator.azureopenai.run(
+        orchestrator.gpt4o_name, "", message_user, messages_history, None, None, None, orchestrator.function_call
+    )
+    message_save = [{"role": "user", "content": query}, {"role": "assistant", "content": f"'''{result['response']}'''"}]
+    try:
+        item = container.read_item(item=session_id, partition_key=session_id)
+        item["chat_history"].extend(message_save)
+    except Exception:
+        item = {"id": session_id, "chat_history": message_save}
+    await asyncio.to_thread(container.upsert_item, item)
+    return result
+
+def run_blocking(orchestrator, requests, threads):
+    """Runs `requests` chats through a thread pool, one event loop per request."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [
+            executor.submit(asyncio.run, legacy_turn(orchestrator, f"blocking-{index}", "What is covered?"))
+            for index in range(requests)
+        ]
+        for future in futures:
+            future.result()
+    return time.perf_counter() - start
+
+async def run_async(orchestrator, requests, concurrency):
+    """Runs `requests` chats on a single event loop with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        async with semaphore:
+            payload, status = await orchestrator.answer(f"async-{index}", "What is covered?")
+            if status != 200:
+                raise RuntimeError(payload)
+
+    await orchestrator.warmup_async()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200, help="In-flight chats offered to the worker.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads of the blocking worker.")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--search-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    stubs = install_stubs(args.llm_latency, args.search_latency)
+    from orchestrator import Orchestrator
+    orchestrator = Orchestrator()
+
+    elapsed = run_blocking(orchestrator, args.requests, args.threads)
+    before = {
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 2),
+        "peak_concurrent_llm_calls": stubs["openai"].in_flight.peak,
+    }
+
+    elapsed = asyncio.run(run_async(orchestrator, args.requests, args.concurrency))
+    after = {
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 2),
+        "peak_concurrent_llm_calls": stubs["openai_async"].in_flight.peak,
+    }
+    print(json.dumps({"config": vars(args), "blocking": before, "async": after}, indent=2))
+
+if __name__ == "__main__":
+    main()
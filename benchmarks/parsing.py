@@ -0,0 +1,183 @@
+"""Micro-benchmark of model response parsing, stream decoding and history serialization.
+
+Runs over a corpus of model responses: function-call arguments and message contents
+that are fenced JSON, triple-quoted JSON, bare JSON or prose. Pass a recorded corpus as
+JSONL lines {"kind": "arguments" | "content", "text": ...}; otherwise one is generated
+with long answers, accents, escapes and links. Compares the previous regex-based
+`parse_content` and character-by-character stream decoder with the current ones, on the
+standard json module and on orjson, and checks that both parsers return the same
+values. Also reports the size of a history entry stored as the stringified response
+dict versus the compact answer, in characters and tokens.
+
+Usage:
+    python -m benchmarks.parsing [--corpus responses.jsonl] [--responses 2000] [--repeat 5]
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import time
+import services.serialization as serialization
+from services.azopenai import AzureOpenAIClient
+from services.serialization import JSONCodec
+from services.streaming import AnswerFieldExtractor, _ESCAPES
+from services.tokens import count_tokens
+
+WORDS = (
+    "the plan includes priority support for every account and the invoice is available in settings "
+    "puede cambiar la dirección de facturación desde configuración según la política vigente año "
+    "contact support at <link>https://www.example.com/help</link> if the password reset fails"
+).split()
+
+def legacy_parse_content(response_content):
+    """The previous implementation: five regex passes and a strip per pass."""
+    response_content = re.sub(r'^```json\s*', '', response_content.strip(), flags=re.MULTILINE)
+    response_content = re.sub(r'^```\s*', '', response_content.strip(), flags=re.MULTILINE)
+    response_content = re.sub(r'\s*```$', '', response_content.strip(), flags=re.MULTILINE)
+    response_content = re.sub(r'^\s*\'\'\'|^\s*"""', '', response_content.strip())
+    response_content = re.sub(r'\'\'\'\s*$|"""\s*$', '', response_content.strip())
+    response_content = response_content.strip()
+    try:
+        return json.loads(response_content)
+    except json.JSONDecodeError:
+        return response_content
+
+class LegacyAnswerFieldExtractor:
+    """The previous stream decoder: grows one buffer and decodes it a character at a time."""
+
+    def __init__(self, field="answer"):
+        self.field_start = re.compile(rf'"{re.escape(field)}"\s*:\s*"')
+        self.buffer = ""
+        self.position = 0
+        self.inside = False
+        self.done = False
+
+    def feed(self, fragment):
+        if self.done or not fragment:
+            return ""
+        self.buffer += fragment
+        if not self.inside:
+            match = self.field_start.search(self.buffer)
+            if not match:
+                return ""
+            self.inside = True
+            self.position = match.end()
+        output = []
+        buffer = self.buffer
+        position = self.position
+        length = len(buffer)
+        while position < length:
+            char = buffer[position]
+            if char == '"':
+                self.done = True
+                position += 1
+                break
+            if char != '\\':
+                output.append(char)
+                position += 1
+                continue
+            if position + 1 >= length:
+                break
+            escape = buffer[position + 1]
+            if escape == 'u':
+                if position + 6 > length:
+                    break
+                output.append(chr(int(buffer[position + 2:position + 6], 16)))
+                position += 6
+            else:
+                output.append(_ESCAPES.get(escape, escape))
+                position += 2
+        self.position = position
+        return "".join(output)
+
+def generate_corpus(count, seed):
+    chooser = random.Random(seed)
+    corpus = []
+    for position in range(count):
+        sentences = [" ".join(chooser.choices(WORDS, k=chooser.randint(8, 20))).capitalize() + "." for _ in range(chooser.randint(3, 12))]
+        answer = "\n".join(sentences) + (' Use "Reset" ✓.' if position % 3 == 0 else "")
+        arguments = json.dumps({"answer": answer}, ensure_ascii=position % 2 == 0)
+        kind = position % 5
+        if kind < 2:
+            corpus.append({"kind": "arguments", "text": arguments})
+        elif kind == 2:
+            corpus.append({"kind": "content", "text": f"```json\n{arguments}\n```"})
+        elif kind == 3:
+            corpus.append({"kind": "content", "text": f"'''{arguments}'''"})
+        else:
+            corpus.append({"kind": "content", "text": answer})
+    return corpus
+
+def time_per_item(function, items, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            function(item)
+        best = min(best, time.perf_counter() - started)
+    return round(best / len(items) * 1e6, 2)
+
+def stream(extractor_class, fragments):
+    extractor = extractor_class()
+    return "".join(extractor.feed(fragment) for fragment in fragments)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="Recorded responses as JSONL; generated when omitted.")
+    parser.add_argument("--responses", type=int, default=2000, help="Size of the generated corpus.")
+    parser.add_argument("--fragment-size", type=int, default=12, help="Characters per streamed argument fragment.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as corpus_file:
+            corpus = [json.loads(line) for line in corpus_file if line.strip()]
+    else:
+        corpus = generate_corpus(args.responses, args.seed)
+    contents = [item["text"] for item in corpus if item["kind"] == "content"]
+    arguments = [item["text"] for item in corpus if item["kind"] == "arguments"]
+    streams = [[text[start:start + args.fragment_size] for start in range(0, len(text), args.fragment_size)] for text in arguments]
+
+    codecs = {"json": JSONCodec("json")}
+    try:
+        codecs["orjson"] = JSONCodec("orjson")
+    except ValueError:
+        pass
+
+    report = {"corpus": {"content": len(contents), "arguments": len(arguments)}}
+    report["parse_content_us"] = {"legacy": time_per_item(legacy_parse_content, contents, args.repeat)}
+    report["function_arguments_us"] = {"legacy": time_per_item(json.loads, arguments, args.repeat)}
+    mismatches = 0
+    for name, codec in codecs.items():
+        serialization._codec = codec
+        report["parse_content_us"][name] = time_per_item(AzureOpenAIClient.parse_content, contents, args.repeat)
+        report["function_arguments_us"][name] = time_per_item(codec.loads, arguments, args.repeat)
+        mismatches += sum(1 for text in contents if AzureOpenAIClient.parse_content(text) != legacy_parse_content(text))
+    report["parse_content_mismatches"] = mismatches
+
+    report["stream_decode_us"] = {
+        "legacy": time_per_item(lambda fragments: stream(LegacyAnswerFieldExtractor, fragments), streams, args.repeat),
+        "current": time_per_item(lambda fragments: stream(AnswerFieldExtractor, fragments), streams, args.repeat),
+    }
+    report["stream_decode_mismatches"] = sum(1 for text, fragments in zip(arguments, streams) if stream(AnswerFieldExtractor, fragments) != json.loads(text)["answer"])
+
+    responses = [json.loads(text) for text in arguments]
+    legacy_entries = [f"'''{response}'''" for response in responses]
+    compact_entries = [response["answer"] for response in responses]
+    report["history_entry"] = {
+        "legacy_chars": round(sum(map(len, legacy_entries)) / len(responses), 1),
+        "compact_chars": round(sum(map(len, compact_entries)) / len(responses), 1),
+        "legacy_tokens": round(sum(count_tokens(entry) for entry in legacy_entries) / len(responses), 1),
+        "compact_tokens": round(sum(count_tokens(entry) for entry in compact_entries) / len(responses), 1),
+    }
+    payloads = [{"response": response["answer"]} for response in responses]
+    report["response_dumps_us"] = {"legacy": time_per_item(lambda payload: json.dumps(payload), payloads, args.repeat)}
+    for name, codec in codecs.items():
+        report["response_dumps_us"][name] = time_per_item(codec.dumps, payloads, args.repeat)
+    print(json.dumps({"config": vars(args), **report}, indent=2))
+
+if __name__ == "__main__":
+    main()
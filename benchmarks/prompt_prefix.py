@@ -0,0 +1,154 @@
+"""Checks that the stable-prefix prompt layout keeps the prompt prefix byte-identical across turns.
+
+The check assembles the messages of a long session turn by turn with the history window
+and the real system prompt and function schema, while the retrieved context changes on
+every turn. Every turn is compared with the one before: within a window step, the
+functions, system prompt and history of a turn must be a byte prefix of the next turn's
+prompt; when the window moves, the functions and system prompt must still be unchanged,
+and the window must move at least `history_step_turns` turns. The turns breaking either
+rule are listed. The sliding layout is reported for comparison.
+
+The simulation then runs sessions through the orchestrator with an Azure OpenAI stub that
+reports the cached tokens automatic prompt caching would serve (prefixes of 1024 tokens
+and more), and compares the cached share of input tokens and the cost of both layouts;
+the stable-prefix layout must cache a larger share. The exit code is 1 when a check fails.
+
+Usage:
+    python -m benchmarks.prompt_prefix [--turns 40] [--step 5]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import uuid
+from benchmarks.stubs import install_stubs
+
+LAYOUTS = ("sliding", "stable_prefix")
+
+def configure(window, layout, step):
+    window.layout = layout
+    window.step_turns = step if layout == "stable_prefix" else 1
+
+def serialize(functions, messages):
+    return [json.dumps(functions, sort_keys=True).encode("utf-8")] + [json.dumps(message, sort_keys=True).encode("utf-8") for message in messages]
+
+def is_prefix(previous, current):
+    return len(previous) <= len(current) and current[:len(previous)] == previous
+
+def text(chooser, words):
+    return " ".join(chooser.choice(("plan", "invoice", "support", "password", "account", "billing", "policy", "export")) for _ in range(words))
+
+def check(layout, args):
+    """Assembles the prompts of one session and lists the turns breaking the prefix, and the window moves."""
+    from config.config import get_settings
+    from services.azopenai import AzureOpenAIClient
+    from services.history import ChatHistoryWindow
+    settings = get_settings()
+    files = settings.config["model"]
+    system_prompt = settings.prompt(files["prompt"]["system_prompt"])
+    functions = settings.function_schema(files["parameters"]["functions"]["file"])
+    window = ChatHistoryWindow()
+    configure(window, layout, args.step)
+    chooser = random.Random(args.seed)
+
+    history = []
+    previous = None
+    previous_older = None
+    breaks = []
+    static_breaks = []
+    moves = []
+    for turn in range(args.turns):
+        query = f"Question {turn}: {text(chooser, 12)}?"
+        # Retrieval differs on every turn; the context travels with the current query only
+        context = "\n".join(text(chooser, 40) for _ in range(chooser.randint(3, 6)))
+        _, older_count, _ = window.apply(history)
+        summary = {"text": f"Summary of the first {older_count} turns.", "turns": older_count} if older_count else None
+        messages_history, older_count, _ = window.apply(history, summary)
+        message = [{"role": "user", "content": f"CONTEXT:\n{context}\n\nQUERY: {query}"}]
+        current = serialize(functions, AzureOpenAIClient.build_messages(system_prompt, message, messages_history))
+        if previous is not None:
+            # Functions and system prompt never change, whatever the window does
+            if current[:2] != previous[:2]:
+                static_breaks.append(turn)
+            if older_count != previous_older:
+                moves.append(older_count - previous_older)
+            elif not is_prefix(previous[:-1], current):
+                # The previous query is the last element; in the history it travels without its context
+                breaks.append(turn)
+        previous = current
+        previous_older = older_count
+        history += [{"role": "user", "content": query}, {"role": "assistant", "content": text(chooser, 60)}]
+    return {
+        "turns": args.turns,
+        "step_turns": window.step_turns,
+        "prefix_breaks_within_step": breaks,
+        "static_prefix_breaks": static_breaks,
+        "window_moves": len(moves),
+        "smallest_window_move": min(moves) if moves else 0,
+    }
+
+async def simulate(layout, args, stubs):
+    """Runs sessions through the orchestrator; returns the cached share of input tokens and the cost."""
+    from orchestrator import Orchestrator
+    orchestrator = Orchestrator()
+    configure(orchestrator.history_window, layout, args.step)
+    # Background summaries would also hit the stub; they are left out of the comparison
+    orchestrator.history_window.summary_enabled = False
+    stubs["openai_async"].cached_prefixes.clear()
+    await orchestrator.warmup_async()
+    input_tokens = cached_tokens = 0
+    cost = 0.0
+    chooser = random.Random(args.seed)
+    try:
+        for _ in range(args.sessions):
+            session_id = str(uuid.uuid4())
+            for turn in range(args.turns):
+                payload, status = await orchestrator.answer(session_id, f"Question {turn}: {text(chooser, 12)}?", include_cost=True)
+                if status != 200:
+                    raise RuntimeError(f"Chat failed with status {status}: {payload}")
+                input_tokens += payload["cost"]["input_tokens"]
+                cached_tokens += payload["cost"]["cached_input_tokens"]
+                cost += payload["cost"]["total_tokens_cost"]
+    finally:
+        await orchestrator.close_async()
+    return {
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached_tokens,
+        "cached_share": round(cached_tokens / input_tokens, 4) if input_tokens else 0.0,
+        "total_cost": round(cost, 6),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=40, help="Turns per session.")
+    parser.add_argument("--sessions", type=int, default=3, help="Sessions of the simulation.")
+    parser.add_argument("--step", type=int, default=5, help="history_step_turns of the stable-prefix layout.")
+    parser.add_argument("--answer-words", type=int, default=150, help="Length of the stub answers kept in the history.")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    stubs = install_stubs(0.001, 0.001, 0.0, answer=text(random.Random(args.seed), args.answer_words), prompt_tokens=None, prompt_cache=True)
+    report = {"config": vars(args), "check": {}, "simulation": {}}
+    for layout in LAYOUTS:
+        report["check"][layout] = check(layout, args)
+        report["simulation"][layout] = asyncio.run(simulate(layout, args, stubs))
+    stable = report["check"]["stable_prefix"]
+    failures = []
+    if stable["prefix_breaks_within_step"]:
+        failures.append(f"turns {stable['prefix_breaks_within_step']} changed the prompt prefix within a window step")
+    if stable["static_prefix_breaks"]:
+        failures.append(f"turns {stable['static_prefix_breaks']} changed the functions or the system prompt")
+    if stable["window_moves"] and stable["smallest_window_move"] < stable["step_turns"]:
+        failures.append(f"the window moved by {stable['smallest_window_move']} turns, less than a step")
+    if args.turns > args.step and report["simulation"]["stable_prefix"]["cached_share"] <= report["simulation"]["sliding"]["cached_share"]:
+        failures.append("the stable-prefix layout did not cache a larger share of input tokens than the sliding one")
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
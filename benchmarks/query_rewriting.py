@@ -0,0 +1,127 @@
+"""Measures the latency of query rewriting and multi-query retrieval, and checks its deadline.
+
+Runs follow-up turns through the orchestrator against stub Azure services with query
+rewriting off, rewriting into one standalone query, rewriting into several sub-queries
+searched concurrently, and a rewriting model slower than `timeout_seconds`. Reports the
+follow-up latency, the searches per turn and the rewrite outcomes of each mode, and checks
+reciprocal rank fusion on fixed rankings. The exit code is 1 when the sub-queries are not
+searched concurrently, when a slow rewrite holds the turn beyond its deadline or when the
+fusion check fails.
+
+Usage:
+    python -m benchmarks.query_rewriting [--turns 40] [--timeout 0.2]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import uuid
+from benchmarks.stubs import install_stubs
+
+SUB_QUERIES = ["billing address of the premium plan", "invoices of the premium plan"]
+
+def rewrite_answer(sub_queries):
+    answer = json.dumps({"query": "premium plan billing and invoices", "sub_queries": sub_queries})
+    return lambda params: answer
+
+async def follow_ups(mode, args, stubs):
+    """Runs sessions of two turns; returns the latencies of the second turns and the searches they made."""
+    from orchestrator import Orchestrator
+    from services.metrics import get_metrics
+    openai = stubs["openai_async"]
+    openai.text_answer = None if mode == "off" else rewrite_answer(SUB_QUERIES if mode == "fan_out" else [])
+    openai.text_latency = args.timeout * 3 if mode == "slow" else args.rewrite_latency
+    orchestrator = Orchestrator()
+    orchestrator.query_rewriter.enabled = mode != "off"
+    orchestrator.query_rewriter.timeout_seconds = args.timeout
+    # Summaries would also reach the stub as plain text requests
+    orchestrator.history_window.summary_enabled = False
+    orchestrator.azureaisearch.cache_enabled = False
+    await orchestrator.warmup_async()
+    search = stubs["search_async"].in_flight
+    outcomes_before = dict(get_metrics().counters.get("rag_query_rewrites_total", {}))
+    latencies = []
+    searches = 0
+    try:
+        for turn in range(args.turns):
+            session_id = str(uuid.uuid4())
+            await orchestrator.answer(session_id, f"Which plans include priority support? ({turn})")
+            calls = search.calls
+            started = time.perf_counter()
+            payload, status = await orchestrator.answer(session_id, "And what about the billing address and the invoices of the second one?")
+            if status != 200:
+                raise RuntimeError(f"Chat failed with status {status}: {payload}")
+            latencies.append(time.perf_counter() - started)
+            searches += search.calls - calls
+    finally:
+        await orchestrator.close_async()
+    outcomes = {
+        dict(key).get("outcome"): count - outcomes_before.get(key, 0)
+        for key, count in get_metrics().counters.get("rag_query_rewrites_total", {}).items()
+        if count - outcomes_before.get(key, 0)
+    }
+    latencies.sort()
+    return {
+        "latency_p50_s": round(latencies[len(latencies) // 2], 4),
+        "latency_p95_s": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 4),
+        "searches_per_turn": round(searches / args.turns, 2),
+        "rewrite_outcomes": outcomes,
+    }
+
+async def fusion_check():
+    """Fuses fixed rankings; shared chunks must come first, once, with their best score."""
+    from services.rewriting import QueryRewriter
+    rankings = {
+        "a": [{"score": 0.9, "content": "shared"}, {"score": 0.8, "content": "only a"}],
+        "b": [{"score": 0.7, "content": "only b"}, {"score": 0.95, "content": "shared"}],
+    }
+
+    async def search(query):
+        return rankings[query]
+
+    fused = await QueryRewriter().search_async(search, ["a", "b"])
+    contents = [result["content"] for result in fused]
+    return {
+        "ranking": contents,
+        "passed": contents[0] == "shared" and contents.count("shared") == 1 and fused[0]["score"] == 0.95 and len(fused) == 2,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=40, help="Follow-up turns per mode.")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--rewrite-latency", type=float, default=0.03, help="Latency of the rewriting model.")
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--timeout", type=float, default=0.2, help="Deadline of the rewriting call, in seconds.")
+    parser.add_argument("--slack", type=float, default=0.05, help="Scheduling slack allowed beyond the deadline.")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    stubs = install_stubs(args.llm_latency, args.search_latency, 0.001)
+    modes = {mode: asyncio.run(follow_ups(mode, args, stubs)) for mode in ("off", "rewrite", "fan_out", "slow")}
+    fusion = asyncio.run(fusion_check())
+    baseline = modes["off"]["latency_p50_s"]
+    for mode in modes.values():
+        mode["overhead_p50_s"] = round(mode["latency_p50_s"] - baseline, 4)
+
+    failures = []
+    queries = 1 + len(SUB_QUERIES)
+    if modes["fan_out"]["searches_per_turn"] != queries:
+        failures.append(f"expected {queries} searches per fan-out turn, got {modes['fan_out']['searches_per_turn']}")
+    # Searched one after another, the sub-queries would add a search latency each
+    if modes["fan_out"]["overhead_p50_s"] > modes["rewrite"]["overhead_p50_s"] + args.search_latency:
+        failures.append("the sub-queries were not searched concurrently")
+    if modes["slow"]["overhead_p50_s"] > args.timeout + args.slack:
+        failures.append(f"a slow rewrite held the turn {modes['slow']['overhead_p50_s']}s, beyond the {args.timeout}s deadline")
+    if modes["slow"]["rewrite_outcomes"].get("timeout") != args.turns:
+        failures.append("slow rewrites did not fall back to the raw query")
+    if not fusion["passed"]:
+        failures.append(f"unexpected fused ranking: {fusion['ranking']}")
+    print(json.dumps({"config": vars(args), "modes": modes, "fusion": fusion, "failures": failures}, indent=2))
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Fault-injection runs of the chat path with the resilience layer on and off.
+
+Starts the fault server, points the real Azure OpenAI and Azure AI Search SDK clients
+at it (Cosmos DB stays stubbed) and sends concurrent chats through each scenario: a
+healthy service, throttling (429 with retry-after), flaky 5xx errors, a full outage and
+slow responses. "off" is the previous behaviour, the SDKs' own retries and timeouts;
+"on" is the configured policy with the SDK retries disabled. Reports successes, the
+errors returned, retries, breaker openings, upstream calls and latency. The fault
+server has no quota, so the local rate limits are only applied with --rate-limits.
+
+Usage:
+    python -m benchmarks.resilience --requests 60 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from benchmarks.fault_server import DEFAULT_FAULTS, start_fault_server
+from services.resilience import CircuitBreaker, get_resilience
+
+SCENARIOS = {
+    "healthy": {},
+    "throttled": {"openai": {"rate_429": 0.3, "retry_after_ms": 200}},
+    "flaky": {"openai": {"rate_500": 0.05, "rate_503": 0.1}, "search": {"rate_503": 0.1}},
+    "outage": {"openai": {"rate_503": 1.0}},
+    "slow": {"openai": {"slow_rate": 0.1, "slow_seconds": 3.0}},
+}
+
+def configure(enabled, timeout, deadline, limiters):
+    """Enables or disables the policies and starts every breaker closed."""
+    for dependency in ("openai", "search"):
+        policy = get_resilience(dependency)
+        policy.enabled = enabled
+        policy.limiters = limiters[dependency]
+        policy.timeout = timeout
+        policy.deadline = deadline
+        policy.retries = 0
+        policy.breaker = CircuitBreaker(policy.breaker.failure_threshold, policy.breaker.reset_timeout)
+
+def percentile(values, share):
+    return round(values[min(int(len(values) * share), len(values) - 1)], 3) if values else 0.0
+
+async def run_scenario(orchestrator, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(position):
+        async with semaphore:
+            started = time.perf_counter()
+            payload, status = await orchestrator.answer(str(uuid.uuid4()), f"Question {position} {uuid.uuid4().hex[:8]}: how do I reset my password?")
+            return status, time.perf_counter() - started, "retry_after" in payload
+
+    results = await asyncio.gather(*(one(position) for position in range(requests)))
+    await orchestrator.close_async()
+    return results
+
+def summarize(results, state, elapsed):
+    latencies = sorted(latency for _, latency, _ in results)
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "ok": statuses.get("200", 0),
+        "statuses": statuses,
+        "with_retry_after": sum(1 for _, _, hint in results if hint),
+        "retries": {dependency: get_resilience(dependency).retries for dependency in ("openai", "search")},
+        "breaker_opened": {dependency: get_resilience(dependency).breaker.opened for dependency in ("openai", "search")},
+        "upstream_responses": state.snapshot()["responses"],
+        "latency_p50_s": percentile(latencies, 0.5),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "elapsed_s": round(elapsed, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--timeout", type=float, default=1.0, help="Per-attempt timeout of the resilience policy.")
+    parser.add_argument("--deadline", type=float, default=8.0, help="Overall deadline of the resilience policy.")
+    parser.add_argument("--rate-limits", action="store_true", help="Also queue calls in the configured rate limiters.")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    server, state, url = start_fault_server(seed=args.seed)
+    os.environ["AZURE_OPENAI_ENDPOINT"] = url
+    os.environ["AZURE_AI_SEARCH_ENDPOINT"] = url
+    from benchmarks.stubs import install_stubs
+    from services.clients import get_client_registry
+    install_stubs()
+    # Real SDK clients against the fault server; only Cosmos DB keeps its stub
+    registry = get_client_registry()
+    for name in ("openai", "search"):
+        registry.set(name, None)
+        registry.set_async(name, None)
+    from orchestrator import Orchestrator
+    orchestrator = Orchestrator()
+
+    limiters = {dependency: get_resilience(dependency).limiters if args.rate_limits else {} for dependency in ("openai", "search")}
+    report = {}
+    for scenario in args.scenarios:
+        report[scenario] = {}
+        for mode in ("off", "on"):
+            state.update("all", **DEFAULT_FAULTS)
+            for service, faults in SCENARIOS[scenario].items():
+                state.update(service, **faults)
+            state.reset()
+            configure(mode == "on", args.timeout, args.deadline, limiters)
+            started = time.perf_counter()
+            results = asyncio.run(run_scenario(orchestrator, args.requests, args.concurrency))
+            report[scenario][mode] = summarize(results, state, time.perf_counter() - started)
+    server.shutdown()
+    print(json.dumps({"config": vars(args), "scenarios": report}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Replays a logged query set through the model router with stubbed models.
+
+Each query is routed with the configured signals. The stubbed deployment answers with
+the input tokens of the real packed prompt and a modelled latency, and the small
+deployment gives a low-confidence answer for a share of the queries to exercise
+escalation on `low_confidence_phrases`. Reports the projected cost and latency against sending every query to the
+large deployment. Also checks the retrieval spread signal on the score scale of each
+search type: reciprocal rank fusion scores of hybrid search must not vote, and semantic
+reranker scores must vote only when they are flat. The exit code is 1 when a check fails.
+
+The query set is JSONL: {"query": ..., "search": [{"score", "content"}, ...]}. Records
+exported from the evals container ({"chat": {"query", "context"}}) are accepted too;
+their chunks get rank-based scores.
+
+Usage:
+    python -m benchmarks.routing_replay --queries logged_queries.jsonl
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import statistics
+import sys
+from benchmarks.stubs import install_stubs
+from config.config import get_settings
+from services.router import RouteDecision
+from services.tokens import count_message_tokens
+
+SAMPLE_QUERIES = [
+    "How do I reset my password?",
+    "What is the refund period?",
+    "Where can I download the invoice?",
+    "Compare the premium and basic plans and explain which one fits a team of ten.",
+    "Why was my payment rejected? What can I do to fix it?",
+    "¿Cuál es el horario de atención?",
+    "Explica las diferencias entre la cuenta personal y la cuenta empresa.",
+    "How do I change the delivery address of an order that has already shipped, and does it cost extra if the carrier has picked it up?",
+]
+
+# Latency model of a completion: time to first token plus generation time per output token
+LATENCY = {
+    "gpt-4o": {"first_token_s": 0.45, "per_output_token_s": 0.012},
+    "gpt-4o-mini": {"first_token_s": 0.30, "per_output_token_s": 0.006},
+}
+
+def load_queries(path):
+    if not path:
+        return [{"query": query} for query in SAMPLE_QUERIES]
+    records = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "chat" in record:
+                chat = record["chat"]
+                context = chat.get("context") or []
+                record = {"query": chat["query"], "search": [{"score": 1.0 / (61 + rank), "content": chunk} for rank, chunk in enumerate(context)]}
+            records.append(record)
+    return records
+
+def stub_search(search_type, top=5):
+    """Stub results on the score scale of the search type, as the search service returns them."""
+    if search_type in ("hybrid", "hybrid_semantic"):
+        # Reciprocal rank fusion with k = 60, with the reranker score of semantic ranking
+        results = [{"score": 1.0 / (61 + rank), "content": f"Stub chunk number {rank} about the product and its policies."} for rank in range(top)]
+        if search_type == "hybrid_semantic":
+            for rank, result in enumerate(results):
+                result["reranker_score"] = 3.2 - 0.6 * rank
+        return results
+    return [{"score": 0.86 - 0.05 * rank, "content": f"Stub chunk number {rank} about the product and its policies."} for rank in range(top)]
+
+def spread_check(router):
+    """Routes a simple query with fixed results per search type; returns whether the spread signal voted for each."""
+    query = SAMPLE_QUERIES[0]
+    search_type = router.search_type
+    cases = {
+        "hybrid_rrf": ("hybrid", stub_search("hybrid"), False),
+        "semantic_peaked": ("hybrid_semantic", stub_search("hybrid_semantic"), False),
+        "semantic_flat": ("hybrid_semantic", [dict(result, reranker_score=1.2 - 0.01 * rank) for rank, result in enumerate(stub_search("hybrid"))], True),
+        "semantic_without_reranker": ("hybrid_semantic", stub_search("hybrid"), False),
+        "vector_peaked": ("vector", stub_search("vector"), False),
+        "vector_flat": ("vector", [dict(result, score=0.8) for result in stub_search("vector")], True),
+    }
+    report = {}
+    try:
+        for name, (router.search_type, search, expected) in cases.items():
+            voted = any(reason.startswith("retrieval_spread") for reason in router.route(query, search).reasons)
+            report[name] = {"voted": voted, "passed": voted == expected}
+    finally:
+        router.search_type = search_type
+    return report
+
+def fails_on_small_model(query, rate):
+    """Deterministically picks the queries the small model answers with low confidence."""
+    digest = hashlib.sha256(query.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") / 2**32 < rate
+
+def summarize(runs, baseline_cost=None):
+    latencies = sorted(run["latency_s"] for run in runs)
+    cost = sum(run["cost"] for run in runs)
+    report = {
+        "queries": len(runs),
+        "models": {model: sum(1 for run in runs if run["model"] == model) for model in sorted({run["model"] for run in runs})},
+        "escalations": sum(1 for run in runs if run["escalated"]),
+        "total_cost": round(cost, 6),
+        "cost_per_query": round(cost / len(runs), 8) if runs else 0.0,
+        "latency_mean_s": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "latency_p50_s": round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+        "latency_p95_s": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3) if latencies else 0.0,
+    }
+    if baseline_cost:
+        report["cost_saved_pct"] = round(100 * (1 - cost / baseline_cost), 1)
+    return report
+
+async def replay(orchestrator, records, output_tokens, mini_failure_rate):
+    router = orchestrator.router
+    settings = get_settings()
+    system_prompt = settings.prompt(settings.config["model"]["prompt"]["system_prompt"])
+    documents = stub_search(router.search_type)
+
+    async def run(record, force_large):
+        query = record["query"]
+        search = record.get("search") or documents
+        context = orchestrator.context_packer.pack(search)
+        messages = orchestrator.azureopenai.build_messages(system_prompt, [{"role": "user", "content": f"CONTEXT:\n{context['text']}\n\nQUERY: {query}"}])
+        input_tokens = count_message_tokens(messages)
+        latency = {"s": 0.0}
+
+        async def complete(model):
+            timing = LATENCY.get(model, LATENCY["gpt-4o"])
+            latency["s"] += timing["first_token_s"] + timing["per_output_token_s"] * output_tokens
+            answer = "Here are the steps to follow."
+            if model == router.small_model and fails_on_small_model(query, mini_failure_rate):
+                answer = "I don't have information about that in the documents."
+            return {"response": {"answer": answer}, "model": model, "input_tokens": input_tokens, "output_tokens": output_tokens}
+
+        decision = RouteDecision(router.large_model) if force_large else router.route(query, search)
+        result = await router.run_async(decision, complete)
+        return {
+            "model": result["model"],
+            "escalated": "escalated" in result["routing"],
+            "cost": router.cost(result["attempts"]),
+            "latency_s": latency["s"],
+        }
+
+    baseline = [await run(record, True) for record in records]
+    routed = [await run(record, False) for record in records]
+    baseline_report = summarize(baseline)
+    return {"always_large": baseline_report, "routed": summarize(routed, baseline_report["total_cost"])}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", help="JSONL query set; defaults to a small built-in sample.")
+    parser.add_argument("--output-tokens", type=int, default=120)
+    parser.add_argument("--mini-failure-rate", type=float, default=0.1, help="Share of queries the small model answers with low confidence.")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    install_stubs()
+    from orchestrator import Orchestrator
+    orchestrator = Orchestrator()
+    orchestrator.router.enabled = True
+    orchestrator.router.escalate_on_phrases = True
+    records = load_queries(args.queries)
+    report = asyncio.run(replay(orchestrator, records, args.output_tokens, args.mini_failure_rate))
+    spread = spread_check(orchestrator.router)
+    failures = [f"retrieval spread signal on {name}: voted={case['voted']}" for name, case in spread.items() if not case["passed"]]
+    print(json.dumps({"config": vars(args), **report, "retrieval_spread": spread, "failures": failures}, indent=2))
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Throughput of the production launcher (serve.py) against the Flask development server.
+
+Each server runs in its own process with stub Azure services and receives the same
+concurrent POST /chat load over HTTP; the report shows requests per second and latency
+percentiles. The production run then checks graceful drain: SIGTERM is sent while
+chats are in flight, and every one of them should still be answered before exit.
+
+Usage:
+    python -m benchmarks.serving --requests 400 --concurrency 32 --workers 4 --llm-latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+import httpx
+
+def serve(mode, port, workers, llm_latency):
+    """Server process: installs the stubs, then runs the requested server in the foreground."""
+    from benchmarks.stubs import install_stubs
+    install_stubs(llm_latency=llm_latency)
+    if mode == "dev":
+        import app
+        # start_app() with the reloader off, which would re-execute the process
+        app.app.run(host="127.0.0.1", port=port, debug=True, use_reloader=False)
+    else:
+        from serve import Launcher
+        Launcher("127.0.0.1", port, workers).run()
+
+def start_server(mode, port, workers, llm_latency):
+    command = [sys.executable, "-m", "benchmarks.serving", "--serve", mode, "--port", str(port), "--workers", str(workers), "--llm-latency", str(llm_latency)]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+async def wait_ready(url, timeout=60):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get(f"{url}/readyz")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready.")
+
+async def load(url, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+
+        async def one(position):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"{url}/chat", json={"query": f"Question {position}: how do I reset my password?", "sessionID": str(uuid.uuid4())})
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(position) for position in range(requests)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2),
+        "latency_p50_s": round(latencies[len(latencies) // 2], 3),
+        "latency_p95_s": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3),
+    }
+
+async def drain_check(process, url, requests):
+    """Sends SIGTERM while `requests` chats are in flight and reports how many were answered."""
+    chats = asyncio.ensure_future(load(url, requests, requests))
+    await asyncio.sleep(0.3)
+    stopped = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    report = await chats
+    exit_code = await asyncio.to_thread(process.wait, 60)
+    return {"in_flight": requests, "statuses": report["statuses"], "exit_code": exit_code, "exit_after_s": round(time.perf_counter() - stopped, 3)}
+
+def bench(mode, args, port):
+    process = start_server(mode, port, args.workers, args.llm_latency)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_ready(url))
+        asyncio.run(load(url, min(args.concurrency, args.requests), args.concurrency))
+        report = asyncio.run(load(url, args.requests, args.concurrency))
+        if mode == "prod":
+            report["drain"] = asyncio.run(drain_check(process, url, args.drain_requests))
+        return report
+    finally:
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--drain-requests", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", choices=("dev", "prod"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.workers, args.llm_latency)
+        return
+    logging.disable(logging.CRITICAL)
+    report = {mode: bench(mode, args, args.port + position) for position, mode in enumerate(("dev", "prod"))}
+    print(json.dumps({"config": vars(args), **report}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Measures the settings and asset work moved from every chat turn to startup.
+
+Compares the previous per-turn path (read and parse the system prompt and function schema
+from disk, with the config parsed and .env loaded by each service constructor) against
+lookups in the preloaded settings snapshot.
+
+Usage:
+    python -m benchmarks.startup --turns 2000
+"""
+import argparse
+import builtins
+import json
+import logging
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from benchmarks.stubs import install_stubs
+from config.config import CONFIG_PATH, Config, get_settings, load_settings, reload_settings
+
+@contextmanager
+def count_opens():
+    """Counts the files opened inside the block."""
+    counter = {"opens": 0}
+    original = builtins.open
+
+    def counting_open(*args, **kwargs):
+        counter["opens"] += 1
+        return original(*args, **kwargs)
+
+    builtins.open = counting_open
+    try:
+        yield counter
+    finally:
+        builtins.open = original
+
+def legacy_turn():
+    """Replays the previous per-turn work: both asset files read and parsed from disk."""
+    files = get_settings().config["model"]
+    with open(f"{files['prompt']['path']}/{files['prompt']['system_prompt']}") as file:
+        file.read()
+    with open(f"{files['parameters']['functions']['path']}/{files['parameters']['functions']['file']}") as file:
+        json.load(file)
+
+def preloaded_turn():
+    settings = get_settings()
+    files = settings.config["model"]
+    settings.prompt(files["prompt"]["system_prompt"])
+    settings.function_schema(files["parameters"]["functions"]["file"])
+
+def legacy_service_setup(services):
+    """Replays the previous constructor work: one config parse and one .env load per service."""
+    for _ in range(services):
+        Config(CONFIG_PATH).load_config()
+        load_dotenv()
+
+def measure(func, repeat, *args):
+    with count_opens() as counter:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func(*args)
+        elapsed = time.perf_counter() - started
+    return {"total_ms": round(elapsed * 1000, 3), "per_call_us": round(elapsed * 1e6 / repeat, 3), "files_opened": counter["opens"]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    with count_opens() as counter:
+        started = time.perf_counter()
+        install_stubs()
+        get_settings()
+        from orchestrator import Orchestrator
+        Orchestrator()
+        startup_ms = (time.perf_counter() - started) * 1000
+    services = 9
+
+    report = {
+        "config": vars(args),
+        "startup": {"total_ms": round(startup_ms, 3), "files_opened": counter["opens"]},
+        "settings_load": measure(load_settings, 20),
+        "settings_reload": measure(reload_settings, 20),
+        "per_turn": {
+            "legacy": measure(legacy_turn, args.turns),
+            "preloaded": measure(preloaded_turn, args.turns),
+        },
+        "per_service_setup": {
+            "services": services,
+            "legacy": measure(legacy_service_setup, 20, services),
+            "preloaded": measure(lambda: [Config() for _ in range(services)], 20),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+import asyncio
+import copy
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from services.clients import get_client_registry
+from services.embeddings import HashingEmbedder
+from services.resilience import get_resilience
+
+STUB_ENV_VARS = {
+    "AZURE_OPENAI_ENDPOINT": "https://stub.openai.azure.com",
+    "AZURE_OPENAI_API_KEY": "stub",
+    "AZURE_OPENAI_API_VERSION": "2024-06-01",
+    "AZURE_AI_SEARCH_ENDPOINT": "https://stub.search.windows.net",
+    "AZURE_AI_SEARCH_KEY": "stub",
+    "AZURE_AI_SEARCH_INDEX_NAME": "stub-index",
+    "SEMANTIC_CONFIGURATION_NAME": "stub-semantic",
+    "COSMOS_DB_ENDPOINT": "https://stub.documents.azure.com",
+    "COSMOS_DB_PRIMARY_KEY": "stub",
+    "COSMOS_DB_DATABASE_NAME": "stub-db",
+    "COSMOS_DB_CONTAINER_HISTORY": "history",
+    "COSMOS_DB_CONTAINER_EVALS": "evals",
+}
+
+class InFlightCounter:
+    """Tracks how many stub calls are waiting at the same time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+        self.calls = 0
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.calls += 1
+            self.peak = max(self.peak, self.current)
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.current -= 1
+
+    def reset(self):
+        with self._lock:
+            self.current = 0
+            self.peak = 0
+            self.calls = 0
+
+class Distribution:
+    """Samples positive values around `median`; `spread` is the sigma of a log-normal, 0 for a constant."""
+
+    def __init__(self, median, spread=0.0, seed=None):
+        self.median = median
+        self.spread = spread
+        self.random = random.Random(seed)
+
+    def sample(self):
+        if not self.spread or not self.median:
+            return self.median
+        return self.median * math.exp(self.random.gauss(0.0, self.spread))
+
+def count_prompt_tokens(messages):
+    """Approximates the prompt tokens of a request at four characters per token."""
+    return sum(len(str(message.get("content") or "")) for message in messages or []) // 4 + 1
+
+def make_completion(answer, prompt_tokens=1200, completion_tokens=80, cached_tokens=0):
+    """Builds an object shaped like an OpenAI chat completion answered through function calling."""
+    function_call = SimpleNamespace(name="output_structure", arguments=json.dumps({"answer": answer}))
+    message = SimpleNamespace(content=None, function_call=function_call, tool_calls=None)
+    usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+def make_text_completion(text, prompt_tokens=300, completion_tokens=40):
+    """Builds an object shaped like a plain text chat completion."""
+    message = SimpleNamespace(content=text, function_call=None, tool_calls=None)
+    usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+def make_stream_chunks(answer, prompt_tokens=1200, chunk_size=8, cached_tokens=0):
+    """Builds chunks shaped like a streamed function-calling completion, usage last."""
+    arguments = json.dumps({"answer": answer})
+    pieces = [arguments[start:start + chunk_size] for start in range(0, len(arguments), chunk_size)]
+    chunks = []
+    for piece in pieces:
+        delta = SimpleNamespace(content=None, tool_calls=None, function_call=SimpleNamespace(name=None, arguments=piece))
+        chunks.append(SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], usage=None))
+    usage = {
+        "prompt_tokens": prompt_tokens, "completion_tokens": len(pieces), "total_tokens": prompt_tokens + len(pieces),
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+    chunks.append(SimpleNamespace(choices=[], usage=usage))
+    return chunks
+
+class _AsyncStream:
+    def __init__(self, chunks, interval):
+        self._chunks = iter(chunks)
+        self.interval = interval
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+        await asyncio.sleep(self.interval)
+        return chunk
+
+class _Completions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, **params):
+        with self.owner.in_flight:
+            time.sleep(self.owner.latency_for(params))
+        return self.owner.completion(params)
+
+class _AsyncCompletions(_Completions):
+    async def create(self, **params):
+        if params.get("stream"):
+            # Time to first token is a fifth of the full latency; the rest is spread over the chunks
+            latency = self.owner.sample_latency()
+            chunks = make_stream_chunks(self.owner.answer, self.owner.prompt_tokens_for(params), cached_tokens=self.owner.cached_tokens_for(params))
+            await asyncio.sleep(latency / 5)
+            return _AsyncStream(chunks, latency * 4 / 5 / len(chunks))
+        with self.owner.in_flight:
+            await asyncio.sleep(self.owner.latency_for(params))
+        return self.owner.completion(params)
+
+class _Embeddings:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, input, dimensions=None, **params):
+        time.sleep(self.owner.embedding_latency)
+        return self.owner.embeddings_response(input, dimensions)
+
+class _AsyncEmbeddings(_Embeddings):
+    async def create(self, input, dimensions=None, **params):
+        await asyncio.sleep(self.owner.embedding_latency)
+        return self.owner.embeddings_response(input, dimensions)
+
+class StubOpenAI:
+    """Synchronous stand-in for AzureOpenAI.
+
+    Completion latency and output tokens are log-normal around their medians (constant
+    with a zero spread); prompt tokens are fixed or, with `prompt_tokens=None`, counted
+    from the messages. With `prompt_cache`, usage reports the cached tokens the provider's
+    automatic prompt caching would serve. With `text_answer` (a string, or a function of the
+    request parameters), requests without functions or tools get that plain text answer
+    after `text_latency` (the completion latency when None). Embeddings come from the
+    offline hashing embedder.
+    """
+
+    def __init__(self, latency=0.5, answer="Stub answer.", latency_spread=0.0, prompt_tokens=1200,
+                 completion_tokens=80, completion_spread=0.0, embedding_latency=0.02, seed=None, prompt_cache=False,
+                 text_answer=None, text_latency=None):
+        self.latency = latency
+        self.answer = answer
+        self.latency_distribution = Distribution(latency, latency_spread, seed)
+        self.prompt_tokens = prompt_tokens
+        self.completion_distribution = Distribution(completion_tokens, completion_spread, seed)
+        self.embedding_latency = embedding_latency
+        self.prompt_cache = prompt_cache
+        self.text_answer = text_answer
+        self.text_latency = text_latency
+        self.cached_prefixes = set()
+        self.last_request = None
+        self.embedders = {}
+        self.in_flight = InFlightCounter()
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.embeddings = _Embeddings(self)
+        self.models = SimpleNamespace(list=lambda: [])
+
+    def sample_latency(self):
+        # `latency` may be changed after construction; the spread applies around its current value
+        self.latency_distribution.median = self.latency
+        return self.latency_distribution.sample()
+
+    def is_text_request(self, params):
+        return self.text_answer is not None and not params.get("functions") and not params.get("tools")
+
+    def latency_for(self, params):
+        if self.is_text_request(params) and self.text_latency is not None:
+            return self.text_latency
+        return self.sample_latency()
+
+    def prompt_tokens_for(self, params):
+        return self.prompt_tokens if self.prompt_tokens is not None else count_prompt_tokens(params.get("messages"))
+
+    def cached_tokens_for(self, params):
+        """Longest prefix, at message boundaries, already sent with the same functions and tools.
+
+        Like the provider, only prefixes of at least 1024 tokens are cached, in 128-token steps.
+        """
+        self.last_request = params
+        if not self.prompt_cache:
+            return 0
+        digest = hashlib.sha256(json.dumps([params.get("functions"), params.get("tools")], sort_keys=True).encode("utf-8"))
+        messages = params.get("messages") or []
+        cached_messages = 0
+        prefixes = []
+        for position, message in enumerate(messages):
+            digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+            prefix = digest.copy().hexdigest()
+            if prefix in self.cached_prefixes:
+                cached_messages = position + 1
+            prefixes.append(prefix)
+        self.cached_prefixes.update(prefixes)
+        tokens = min(count_prompt_tokens(messages[:cached_messages]), self.prompt_tokens_for(params) - 1) if cached_messages else 0
+        return tokens // 128 * 128 if tokens >= 1024 else 0
+
+    def completion(self, params):
+        if self.is_text_request(params):
+            text = self.text_answer(params) if callable(self.text_answer) else self.text_answer
+            return make_text_completion(text, count_prompt_tokens(params.get("messages")))
+        return make_completion(
+            self.answer, self.prompt_tokens_for(params), max(1, round(self.completion_distribution.sample())), self.cached_tokens_for(params)
+        )
+
+    def embeddings_response(self, texts, dimensions=None):
+        texts = [texts] if isinstance(texts, str) else texts
+        embedder = self.embedders.setdefault(dimensions or 256, HashingEmbedder(dimensions or 256))
+        tokens = sum(len(text) for text in texts) // 4 + 1
+        data = [SimpleNamespace(embedding=vector, index=index) for index, vector in enumerate(embedder.embed(texts))]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(prompt_tokens=tokens, total_tokens=tokens))
+
+    def close(self):
+        pass
+
+class StubAsyncOpenAI(StubOpenAI):
+    """Asynchronous stand-in for AsyncAzureOpenAI with the same latency and token models."""
+
+    def __init__(self, latency=0.5, answer="Stub answer.", **options):
+        super().__init__(latency, answer, **options)
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(self))
+        self.embeddings = _AsyncEmbeddings(self)
+        self.models = SimpleNamespace(list=self.list_models)
+
+    async def list_models(self):
+        return []
+
+    async def close(self):
+        pass
+
+def make_documents(top=5):
+    return [{"@search.score": 1.0 / (rank + 1), "chunk": f"Stub chunk number {rank}."} for rank in range(top)]
+
+class _AsyncResults:
+    def __init__(self, documents):
+        self._documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class StubSearchClient:
+    """Synchronous stand-in for azure.search.documents.SearchClient."""
+
+    def __init__(self, latency=0.05, top=5):
+        self.latency = latency
+        self.top = top
+        self.in_flight = InFlightCounter()
+
+    def search(self, **kwargs):
+        with self.in_flight:
+            time.sleep(self.latency)
+        return make_documents(kwargs.get("top") or self.top)
+
+    def get_document_count(self):
+        return self.top
+
+    def close(self):
+        pass
+
+class StubAsyncSearchClient(StubSearchClient):
+    """Asynchronous stand-in for azure.search.documents.aio.SearchClient."""
+
+    async def search(self, **kwargs):
+        with self.in_flight:
+            await asyncio.sleep(self.latency)
+        return _AsyncResults(make_documents(kwargs.get("top") or self.top))
+
+    async def get_document_count(self):
+        return self.top
+
+    async def close(self):
+        pass
+
+_FILTER_PATTERN = re.compile(r"^FROM c WHERE c\.(\w+) = (.+)$")
+_NOT_DEFINED_PATTERN = re.compile(r"NOT IS_DEFINED\(c\.(\w+)\)")
+
+class StubContainer:
+    """In-memory stand-in for a Cosmos DB container proxy.
+
+    Supports point reads and writes with ETags, conditional replace, the patch operations
+    used by the service (set, add, incr, remove, with simple filter predicates),
+    'SELECT c.id ... NOT IS_DEFINED(c.x)' and 'SELECT * FROM c' queries. Every call is counted with the bytes
+    sent and received, to compare storage layouts.
+    """
+
+    partition_key_path = "/id"
+
+    def __init__(self, container_id, store=None, latency=0.01):
+        self.id = container_id
+        self.store = store if store is not None else {}
+        self.latency = latency
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _record(self, operation, sent=None, received=None):
+        self.calls[operation] += 1
+        self.bytes_sent += len(json.dumps(sent)) if sent is not None else 0
+        self.bytes_received += len(json.dumps(received)) if received is not None else 0
+        return copy.deepcopy(received)
+
+    def _get(self, item):
+        if item not in self.store:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item '{item}' not found.")
+        return self.store[item]
+
+    def _write(self, body):
+        body = copy.deepcopy(body)
+        body["_etag"] = uuid.uuid4().hex
+        self.store[body["id"]] = body
+        return body
+
+    def _check_etag(self, item, etag, match_condition):
+        if etag is not None and match_condition == MatchConditions.IfNotModified and self._get(item).get("_etag") != etag:
+            raise exceptions.CosmosAccessConditionFailedError(status_code=412, message=f"Item '{item}' was modified.")
+
+    def _read(self, item):
+        return self._record("read", received=self._get(item))
+
+    def _create(self, body):
+        if body["id"] in self.store:
+            raise exceptions.CosmosResourceExistsError(status_code=409, message=f"Item '{body['id']}' already exists.")
+        return self._record("create", sent=body, received=self._write(body))
+
+    def _upsert(self, body):
+        return self._record("upsert", sent=body, received=self._write(body))
+
+    def _replace(self, item, body, etag=None, match_condition=None):
+        self._check_etag(item, etag, match_condition)
+        return self._record("replace", sent=body, received=self._write(dict(body, id=item)))
+
+    def _patch(self, item, patch_operations, filter_predicate=None, etag=None, match_condition=None):
+        document = copy.deepcopy(self._get(item))
+        self._check_etag(item, etag, match_condition)
+        if filter_predicate:
+            field, value = _FILTER_PATTERN.match(filter_predicate).groups()
+            if document.get(field) != json.loads(value):
+                raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="Filter predicate not satisfied.")
+        for operation in patch_operations:
+            *parents, name = operation["path"].strip("/").split("/")
+            target = document
+            for parent in parents:
+                target = target[parent]
+            if operation["op"] == "incr":
+                target[name] = target.get(name, 0) + operation["value"]
+            elif operation["op"] == "add" and name == "-":
+                target.append(copy.deepcopy(operation["value"]))
+            elif operation["op"] == "remove":
+                target.pop(name, None)
+            else:
+                target[name] = copy.deepcopy(operation["value"])
+        return self._record("patch", sent=patch_operations, received=self._write(document))
+
+    def properties(self):
+        return {"id": self.id, "partitionKey": {"paths": [self.partition_key_path]}}
+
+    def _query(self, query):
+        if query.startswith("SELECT *"):
+            return self._record("query", received=list(self.store.values()))
+        missing = _NOT_DEFINED_PATTERN.findall(query)
+        results = [{"id": document["id"]} for document in self.store.values() if not any(field in document for field in missing)]
+        return self._record("query", received=results)
+
+    def read(self, **kwargs):
+        return self.properties()
+
+    def read_item(self, item, partition_key, **kwargs):
+        time.sleep(self.latency)
+        return self._read(item)
+
+    def create_item(self, body, **kwargs):
+        time.sleep(self.latency)
+        return self._create(body)
+
+    def upsert_item(self, body, **kwargs):
+        time.sleep(self.latency)
+        return self._upsert(body)
+
+    def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        time.sleep(self.latency)
+        return self._replace(item, body, etag, match_condition)
+
+    def patch_item(self, item, partition_key, patch_operations, filter_predicate=None, etag=None, match_condition=None, **kwargs):
+        time.sleep(self.latency)
+        return self._patch(item, patch_operations, filter_predicate, etag, match_condition)
+
+    def query_items(self, query, **kwargs):
+        time.sleep(self.latency)
+        return iter(self._query(query))
+
+class StubAsyncContainer(StubContainer):
+    """In-memory stand-in for an async Cosmos DB container proxy."""
+
+    async def read(self, **kwargs):
+        return self.properties()
+
+    async def read_item(self, item, partition_key, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._read(item)
+
+    async def create_item(self, body, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._create(body)
+
+    async def upsert_item(self, body, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._upsert(body)
+
+    async def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._replace(item, body, etag, match_condition)
+
+    async def patch_item(self, item, partition_key, patch_operations, filter_predicate=None, etag=None, match_condition=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._patch(item, patch_operations, filter_predicate, etag, match_condition)
+
+    def query_items(self, query, **kwargs):
+        # The async SDK returns an async pager without awaiting the call itself
+        return _AsyncResults(self._query(query))
+
+class StubDatabase:
+    def __init__(self, client):
+        self.client = client
+
+    def create_container_if_not_exists(self, id, partition_key=None, **kwargs):
+        created = id not in self.client.containers
+        container = self.get_container_client(id)
+        if created and partition_key:
+            container.partition_key_path = partition_key["paths"][0]
+        return container
+
+    def get_container_client(self, container):
+        client = self.client
+        if container not in client.containers:
+            client.containers[container] = client.container_class(container, client.stores.setdefault(container, {}), client.latency)
+        return client.containers[container]
+
+class StubCosmosClient:
+    """Stand-in for azure.cosmos.CosmosClient backed by shared in-memory stores."""
+
+    container_class = StubContainer
+
+    def __init__(self, stores=None, latency=0.01):
+        self.stores = stores if stores is not None else {}
+        self.latency = latency
+        self.containers = {}
+
+    def create_database_if_not_exists(self, id, **kwargs):
+        return self.get_database_client(id)
+
+    def get_database_client(self, database):
+        return StubDatabase(self)
+
+    def close(self):
+        pass
+
+class StubAsyncCosmosClient(StubCosmosClient):
+    """Stand-in for azure.cosmos.aio.CosmosClient sharing the stores of the sync stub."""
+
+    container_class = StubAsyncContainer
+
+    async def close(self):
+        pass
+
+def install_stubs(llm_latency=0.5, search_latency=0.05, cosmos_latency=0.01, **openai_options):
+    """Registers stub clients for every Azure service and returns them by name.
+
+    `openai_options` are passed to the Azure OpenAI stubs (latency spread, token models).
+    """
+    for name, value in STUB_ENV_VARS.items():
+        os.environ.setdefault(name, value)
+    registry = get_client_registry()
+    stores = {}
+    stubs = {
+        "openai": StubOpenAI(llm_latency, **openai_options),
+        "openai_async": StubAsyncOpenAI(llm_latency, **openai_options),
+        "search": StubSearchClient(search_latency),
+        "search_async": StubAsyncSearchClient(search_latency),
+        "cosmos": StubCosmosClient(stores, cosmos_latency),
+        "cosmos_async": StubAsyncCosmosClient(stores, cosmos_latency),
+    }
+    for name in ("openai", "search", "cosmos"):
+        registry.set(name, stubs[name])
+        registry.set_async(name, stubs[f"{name}_async"])
+    # The stubs have no quota, so the deployment rate limits would only slow benchmarks down
+    get_resilience("openai").limiters = {}
+    return stubs
@@ -0,0 +1,247 @@
+"""Benchmark suite of the full chat pipeline against in-process stub Azure services.
+
+Runs the orchestrator end to end (answer cache, retrieval, history, routing, the LLM call
+and write-behind persistence) with stubs for Azure OpenAI, AI Search and Cosmos DB, so no
+quota is used. Scenarios: single-turn latency, streamed turns (time to first token),
+one long session whose history keeps growing, many concurrent sessions and the answer
+cache under a skewed query mix. Each reports p50/p95/p99 latency and throughput, plus
+the peak and retained Python allocations per turn measured in a separate tracemalloc
+pass. Results are printed as JSON (and written to --output); with --baseline, p95
+latency, throughput and retained memory are compared with a previous result file and
+the exit code is 1 when any of them regressed beyond --tolerance.
+
+Usage:
+    python -m benchmarks.suite --output results.json [--baseline baseline.json] [--scenarios single_turn cache]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from benchmarks.stubs import install_stubs
+
+QUERIES = [
+    "How do I reset my password?",
+    "What is covered by the warranty?",
+    "How can I change my billing address?",
+    "Which plans include priority support?",
+    "How do I export my data?",
+    "Can I transfer my subscription to another account?",
+    "What happens when my trial ends?",
+    "How do I enable two-factor authentication?",
+    "Where can I download my invoices?",
+    "How do I cancel my subscription?",
+]
+
+def percentile(values, share):
+    return round(values[min(int(len(values) * share), len(values) - 1)], 4) if values else 0.0
+
+def summarize(latencies, elapsed, **extra):
+    latencies = sorted(latencies)
+    return {
+        "turns": len(latencies),
+        "latency_p50_s": percentile(latencies, 0.5),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "latency_p99_s": percentile(latencies, 0.99),
+        "throughput_tps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        **extra,
+    }
+
+def question(position):
+    return f"{QUERIES[position % len(QUERIES)]} (case {position})"
+
+async def timed_answer(orchestrator, session_id, query):
+    started = time.perf_counter()
+    payload, status = await orchestrator.answer(session_id, query, include_cost=True)
+    if status != 200:
+        raise RuntimeError(f"Chat failed with status {status}: {payload}")
+    return time.perf_counter() - started, payload["cost"]
+
+async def single_turn(orchestrator, turns, args):
+    """First turns of new sessions, one at a time."""
+    latencies = []
+    started = time.perf_counter()
+    for position in range(turns):
+        latency, _ = await timed_answer(orchestrator, str(uuid.uuid4()), question(position))
+        latencies.append(latency)
+    return summarize(latencies, time.perf_counter() - started)
+
+async def streaming(orchestrator, turns, args):
+    """Streamed first turns, one at a time; also reports the time to first token."""
+    latencies = []
+    first_tokens = []
+    started = time.perf_counter()
+    for position in range(turns):
+        turn_started = time.perf_counter()
+        first_token = None
+        async for event, payload in orchestrator.answer_stream(str(uuid.uuid4()), question(position)):
+            if event == "delta" and first_token is None:
+                first_token = time.perf_counter() - turn_started
+            elif event == "error":
+                raise RuntimeError(f"Streamed chat failed: {payload}")
+        latencies.append(time.perf_counter() - turn_started)
+        first_tokens.append(first_token or latencies[-1])
+    first_tokens.sort()
+    return summarize(
+        latencies, time.perf_counter() - started,
+        ttft_p50_s=percentile(first_tokens, 0.5), ttft_p95_s=percentile(first_tokens, 0.95),
+    )
+
+async def long_session(orchestrator, turns, args):
+    """Consecutive turns of one session; latency and prompt tokens should stay flat as history grows."""
+    session_id = str(uuid.uuid4())
+    latencies = []
+    input_tokens = []
+    started = time.perf_counter()
+    for position in range(turns):
+        latency, cost = await timed_answer(orchestrator, session_id, question(position))
+        latencies.append(latency)
+        input_tokens.append(cost["input_tokens"])
+    window = max(1, turns // 10)
+    return summarize(
+        latencies, time.perf_counter() - started,
+        first_turns_latency_s=round(sum(latencies[:window]) / window, 4),
+        last_turns_latency_s=round(sum(latencies[-window:]) / window, 4),
+        first_turns_input_tokens=round(sum(input_tokens[:window]) / window),
+        last_turns_input_tokens=round(sum(input_tokens[-window:]) / window),
+    )
+
+async def concurrent_sessions(orchestrator, turns, args):
+    """`--sessions` sessions at once, each sending its turns one after another."""
+    sessions = min(args.sessions, turns)
+    latencies = []
+
+    async def session(number):
+        session_id = str(uuid.uuid4())
+        for position in range(number, turns, sessions):
+            latency, _ = await timed_answer(orchestrator, session_id, question(position))
+            latencies.append(latency)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(number) for number in range(sessions)))
+    return summarize(latencies, time.perf_counter() - started, sessions=sessions)
+
+async def cache(orchestrator, turns, args):
+    """First turns drawn from a skewed (Zipf) mix of queries, some spelled differently, with the answer cache on."""
+    from services.answer_cache import AnswerCache, InMemoryAnswerCacheBackend
+    from services.embeddings import AzureEmbeddingClient
+    orchestrator.answer_cache = AnswerCache(AzureEmbeddingClient().embed_async, InMemoryAnswerCacheBackend())
+    orchestrator.answer_cache.enabled = True
+    orchestrator.answer_cache.first_turn_only = True
+    chooser = random.Random(args.seed)
+    weights = [1 / (rank + 1) for rank in range(len(QUERIES))]
+    hits = []
+    misses = []
+    started = time.perf_counter()
+    for _ in range(turns):
+        query = chooser.choices(QUERIES, weights)[0]
+        if chooser.random() < 0.3:
+            # Differs only in case and punctuation; served by the normalized exact key
+            query = query.upper().rstrip("?") + " ?"
+        latency, cost = await timed_answer(orchestrator, str(uuid.uuid4()), query)
+        (hits if cost["model"] == "answer_cache" else misses).append(latency)
+    stats = orchestrator.answer_cache.stats()
+    hits.sort()
+    misses.sort()
+    return summarize(
+        hits + misses, time.perf_counter() - started,
+        hit_ratio=round(stats["hit_rate"], 4), exact_hits=stats["exact_hits"], semantic_hits=stats["semantic_hits"],
+        hit_latency_p50_s=percentile(hits, 0.5), miss_latency_p50_s=percentile(misses, 0.5),
+    )
+
+SCENARIOS = {
+    "single_turn": single_turn,
+    "streaming": streaming,
+    "long_session": long_session,
+    "concurrent_sessions": concurrent_sessions,
+    "cache": cache,
+}
+
+async def run_scenario(scenario, turns, args):
+    from orchestrator import Orchestrator
+    orchestrator = Orchestrator()
+    await orchestrator.warmup_async()
+    try:
+        return await SCENARIOS[scenario](orchestrator, turns, args)
+    finally:
+        await orchestrator.close_async()
+
+def measure_allocations(scenario, args):
+    """Runs the scenario again under tracemalloc; reports the peak and the memory still held per turn."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        asyncio.run(run_scenario(scenario, args.allocation_turns, args))
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "alloc_peak_kb": round((peak - before) / 1024, 1),
+        "alloc_retained_kb_per_turn": round((after - before) / 1024 / args.allocation_turns, 2),
+    }
+
+# Compared with the baseline: name, whether higher is better
+CHECKS = [("latency_p95_s", False), ("throughput_tps", True), ("alloc_retained_kb_per_turn", False)]
+
+def regressions(results, baseline, tolerance):
+    """Lists the metrics that got worse than the baseline by more than `tolerance` (a share)."""
+    found = []
+    for scenario, metrics in results.items():
+        previous = baseline.get("scenarios", {}).get(scenario, {})
+        for name, higher_is_better in CHECKS:
+            if name not in metrics or not previous.get(name):
+                continue
+            change = (metrics[name] - previous[name]) / previous[name]
+            if (-change if higher_is_better else change) > tolerance:
+                found.append({"scenario": scenario, "metric": name, "baseline": previous[name], "current": metrics[name], "change": round(change, 4)})
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--turns", type=int, default=100, help="Turns per scenario.")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent sessions of concurrent_sessions.")
+    parser.add_argument("--allocation-turns", type=int, default=20, help="Turns of the tracemalloc pass; 0 skips it.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Median completion latency in seconds.")
+    parser.add_argument("--llm-latency-spread", type=float, default=0.3, help="Sigma of the log-normal completion latency.")
+    parser.add_argument("--completion-tokens", type=int, default=80, help="Median completion tokens.")
+    parser.add_argument("--search-latency", type=float, default=0.01)
+    parser.add_argument("--cosmos-latency", type=float, default=0.002)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Also write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Previous results file to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression against the baseline.")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    install_stubs(
+        args.llm_latency, args.search_latency, args.cosmos_latency,
+        latency_spread=args.llm_latency_spread, prompt_tokens=None,
+        completion_tokens=args.completion_tokens, completion_spread=0.3, seed=args.seed,
+    )
+    results = {}
+    for scenario in args.scenarios:
+        results[scenario] = asyncio.run(run_scenario(scenario, args.turns, args))
+        if args.allocation_turns:
+            results[scenario].update(measure_allocations(scenario, args))
+
+    report = {"config": {name: value for name, value in vars(args).items() if name not in ("output", "baseline")}, "scenarios": results}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            report["regressions"] = regressions(results, json.load(baseline_file), args.tolerance)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    print(json.dumps(report, indent=2))
+    if report.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,27 @@
 import logging
 import json
 import os
+import threading
+import time
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CONFIG_PATH = "config/config.json"
+
 class Config:
-    """Class to load configuration parameters from a JSON file."""
+    """Class to load configuration parameters from a JSON file.
+
+    The default configuration comes from the preloaded settings shared by the process;
+    other paths are read from disk.
+    """
 
-    def __init__(self, config_path="config/config.json"):
+    def __init__(self, config_path=CONFIG_PATH):
         self.config_path = config_path
-        self.config = self.load_config()
+        self.config = get_settings().config if config_path == CONFIG_PATH else self.load_config()
 
     def load_config(self):
         """Loads config parameters from the JSON configuration file."""
@@ -26,4 +36,154 @@ class Config:
         except json.JSONDecodeError as e:
             logger.error(f"Error decoding JSON from the configuration file: {e}")
             return {}
- 
\ No newline at end of file
+
+@dataclass(frozen=True)
+class Settings:
+    """Snapshot of the configuration, prompts and function schemas loaded once at startup.
+
+    Shared by every service and request; treat it as read-only. Reloading builds a new
+    snapshot and swaps it in, so a request holding one always sees consistent files.
+    """
+    config: dict
+    prompts: dict
+    functions: dict
+    version: int = 1
+    loaded_at: float = field(default_factory=time.time)
+    load_seconds: float = 0.0
+
+    def prompt(self, name):
+        """Returns the text of a prompt file from the prompt path."""
+        if name not in self.prompts:
+            logger.error(f"Prompt '{name}' not found.")
+            return ""
+        return self.prompts[name]
+
+    def function_schema(self, name):
+        """Returns the parsed JSON of a tools/functions file."""
+        if name not in self.functions:
+            logger.error(f"Function schema '{name}' not found.")
+            return ""
+        return self.functions[name]
+
+_environment_loaded = False
+_settings = None
+_settings_lock = threading.Lock()
+
+def load_environment():
+    """Loads the .env file into the environment once per process."""
+    global _environment_loaded
+    if not _environment_loaded:
+        load_dotenv()
+        _environment_loaded = True
+
+def asset_paths(config):
+    """Returns the prompt directory and the tools/functions directories named in the config."""
+    parameters = config.get("model", {}).get("parameters", {})
+    prompt_path = config.get("model", {}).get("prompt", {}).get("path", "prompts")
+    function_paths = {parameters.get(kind, {}).get("path") for kind in ("functions", "tools")} - {None, ""}
+    return prompt_path, sorted(function_paths)
+
+def watched_files():
+    """Returns the modification time of the config file and of every asset file."""
+    prompt_path, function_paths = asset_paths(get_settings().config)
+    paths = [CONFIG_PATH]
+    for directory in [prompt_path, *function_paths]:
+        if os.path.isdir(directory):
+            paths.extend(os.path.join(directory, name) for name in os.listdir(directory))
+    files = {}
+    for path in paths:
+        try:
+            files[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    return files
+
+def load_settings(config_path=CONFIG_PATH, version=1):
+    """Reads the configuration, every prompt and every function schema from disk."""
+    started = time.perf_counter()
+    load_environment()
+    with open(config_path) as file:
+        config = json.load(file)
+    prompt_path, function_paths = asset_paths(config)
+    prompts = {}
+    if os.path.isdir(prompt_path):
+        for name in sorted(os.listdir(prompt_path)):
+            if not os.path.isfile(os.path.join(prompt_path, name)):
+                continue
+            with open(os.path.join(prompt_path, name)) as file:
+                prompts[name] = file.read()
+    functions = {}
+    for directory in function_paths:
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(directory, name)) as file:
+                    functions[name] = json.load(file)
+    logger.info(f"Settings v{version} loaded: {len(prompts)} prompts, {len(functions)} function schemas.")
+    return Settings(config, prompts, functions, version, load_seconds=time.perf_counter() - started)
+
+def get_settings():
+    """Returns the current settings snapshot, loading it on first use."""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                try:
+                    _settings = load_settings()
+                except FileNotFoundError:
+                    logger.error(f"Configuration file not found at {CONFIG_PATH}")
+                    _settings = Settings({}, {}, {})
+                except json.JSONDecodeError as e:
+                    logger.error(f"Error decoding JSON from the configuration or function files: {e}")
+                    _settings = Settings({}, {}, {})
+    return _settings
+
+def reload_settings():
+    """Builds a new snapshot from disk and swaps it in; keeps the current one if loading fails."""
+    global _settings
+    with _settings_lock:
+        version = _settings.version + 1 if _settings is not None else 1
+        try:
+            _settings = load_settings(version=version)
+        except Exception as e:
+            logger.error(f"Error reloading settings, keeping version {version - 1}: {e}")
+            return _settings
+        settings = _settings
+    # Imported here: the metrics registry itself reads its configuration from the settings
+    from services.metrics import get_metrics
+    get_metrics().observe("rag_span_duration_seconds", settings.load_seconds, span="config_load")
+    return settings
+
+class SettingsWatcher:
+    """Polls the config and asset files and reloads the settings when one changes."""
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="settings-watcher", daemon=True)
+            self._thread.start()
+            logger.info(f"Watching settings files every {self.interval}s.")
+        return self
+
+    def run(self):
+        files = watched_files()
+        while not self._stop.wait(self.interval):
+            current = watched_files()
+            if current != files:
+                files = current
+                reload_settings()
+
+    def stop(self):
+        self._stop.set()
+
+def start_settings_watcher():
+    """Starts hot reloading if `settings.hot_reload` is enabled; returns the watcher or None."""
+    settings_config = get_settings().config.get("settings", {})
+    if not settings_config.get("hot_reload", False):
+        return None
+    return SettingsWatcher(settings_config.get("poll_interval_seconds", 2.0)).start()
@@ -1,13 +1,27 @@
-import json
 import logging
 import asyncio
 import os
 import time
+from functools import partial
 from flask import request, jsonify
-from services.azopenai import AzureOpenAIClient
+from services.azopenai import AzureOpenAIClient, get_balancer
 from services.aisearch import AzureAISearchClient
+from services.localsearch import LocalSearchClient
 from services.cosmosdb import AzureCosmosDBClient
-from config.config import Config
+from services.clients import get_client_registry
+from services.pipeline import Pipeline
+from services.answer_cache import AnswerCache
+from services.history import ChatHistoryWindow
+from services.context import ContextPacker
+from services.router import ModelRouter
+from services.rewriting import QueryRewriter
+from services.persistence import PersistenceQueue
+from services.coalescing import RequestCoalescer
+from services.metrics import get_metrics
+from services.embeddings import query_embedder_stats
+from services.resilience import ResilienceError
+from services.serialization import get_json_codec
+from config.config import Config, get_settings
 
 
 # Configure logging
@@ -26,6 +40,20 @@ class Orchestrator:
             # Set parameters configuration
             config = Config().config
             self.azurecosmos = AzureCosmosDBClient()            
+            self.azureopenai = AzureOpenAIClient()
+            # Retrieval runs on Azure AI Search or, for offline runs, on a local index
+            if config["ai_search"].get("backend", "azure") == "local":
+                self.azureaisearch = LocalSearchClient()
+            else:
+                self.azureaisearch = AzureAISearchClient()
+            self.answer_cache = AnswerCache()
+            self.history_window = ChatHistoryWindow(self.azureopenai)
+            self.context_packer = ContextPacker()
+            self.router = ModelRouter()
+            self.query_rewriter = QueryRewriter(self.azureopenai)
+            self.persistence = PersistenceQueue(self.azurecosmos)
+            self.coalescer = RequestCoalescer()
+            self.background_tasks = set()
             self.gpt4o_name = config["model"]["deployments"]["gpt-4o"]["name"]
             self.gpt4o_input_price = config["model"]["deployments"]["gpt-4o"]["price"]["input_tokens"]
             self.gpt4o_output_price = config["model"]["deployments"]["gpt-4o"]["price"]["output_tokens"]
@@ -50,119 +78,436 @@ class Orchestrator:
         except Exception as e:
             logger.error(f"Error loading configuration: {e}")
             raise
+
+    def warmup(self):
+        """Creates the pooled service clients before the first request arrives."""
+        self.azureopenai.get_client()
+        for backend in self.openai_backends():
+            self.azureopenai.get_client(backend)
+        self.azureaisearch.get_client()
+        logger.info(f"Service clients ready: {get_client_registry().stats()}")
+
+    async def warmup_async(self):
+        """Creates the pooled async service clients on the running event loop."""
+        await self.azureopenai.get_async_client()
+        for backend in self.openai_backends():
+            await self.azureopenai.get_async_client(backend)
+        await self.azureaisearch.get_async_client()
+        await self.azurecosmos.get_async_container(self.azurecosmos.container_history)
+        self.persistence.start()
+        logger.info(f"Async service clients ready: {get_client_registry().stats()}")
+
+    async def warmup_connections_async(self, timeout=30):
+        """Opens a connection to Azure OpenAI, AI Search and Cosmos DB so the first chats skip TCP and TLS setup.
+
+        Returns "ok" or the error per service; failures are logged and left to the resilience layer.
+        """
+        services = {
+            "openai": self.azureopenai.ping_async((self.gpt4o_name, self.gpt4o_mini_name)),
+            "search": self.azureaisearch.ping_async(),
+            "cosmos": self.azurecosmos.ping_async(),
+        }
+        outcomes = await asyncio.gather(*(asyncio.wait_for(ping, timeout) for ping in services.values()), return_exceptions=True)
+        results = {}
+        for service, outcome in zip(services, outcomes):
+            results[service] = "ok" if not isinstance(outcome, BaseException) else f"{type(outcome).__name__}: {outcome}"
+            if results[service] != "ok":
+                logger.warning(f"Warmup of {service} failed: {results[service]}")
+        logger.info(f"Service connections warmed up: {results}")
+        return results
+
+    def openai_backends(self):
+        """Returns the backends of every chat deployment, whose clients are created at warmup."""
+        return [backend for model in (self.gpt4o_name, self.gpt4o_mini_name) for backend in get_balancer(model).backends]
+
+    async def close_async(self):
+        """Persists pending turns and summaries, closes the async service clients and flushes exported metrics."""
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        await self.persistence.drain()
+        await get_client_registry().close_async()
+        await asyncio.to_thread(get_metrics().shutdown)
     
-    @staticmethod
-    def read_file(file_path, as_json=False):
-        """Reads content from a file."""
+    def retrieval_stats(self):
+        """Returns the retrieval cache counters and search latency, the query embedding cache counters and latency, and the answer cache counters."""
+        return {"search": self.azureaisearch.cache_stats(), "query_embedding": query_embedder_stats(), "answer_cache": self.answer_cache.stats()}
+
+    async def run(self, session_id, query):
+        """Processes the chat request and returns a Flask response."""
+        payload, status = await self.answer(session_id, query)
+        return jsonify(payload), status
+
+    async def lookup_cached_answer(self, session_id, query):
+        """Looks the query up in the answer cache; returns the lookup and the session if it was read.
+
+        With `first_turn_only`, cached answers are only served to sessions without history,
+        since follow-up questions depend on the conversation.
+        """
+        if not self.answer_cache.enabled:
+            return None, None
         try:
-            with open(file_path, 'r') as file:
-                logger.info(f"File '{file_path}' successfully loaded.")
-                if as_json:
-                    return json.load(file)
-                else:
-                    return file.read()
-        except json.JSONDecodeError:
-            logger.error(f"Error decoding JSON file: {file_path}")
-            return ""
+            if not self.answer_cache.first_turn_only:
+                return await self.answer_cache.lookup(query), None
+            lookup, session = await asyncio.gather(
+                self.answer_cache.lookup(query),
+                self.load_session(session_id)
+            )
+            if session["chat_history"]:
+                # Follow-up turns are neither served from nor stored in the cache
+                return None, session
+            return lookup, session
         except Exception as e:
-            logger.error(f"Error reading file: {e}")
-            return ""
-    
-    async def run(self, session_id, query):
-        """Processes the chat request and returns a response."""
+            logger.warning(f"Answer cache lookup failed, answering without cache: {e}")
+            return None, None
+
+    async def load_session(self, session_id):
+        """Reads the recent chat history once the queued turns of the session are written."""
+        await self.persistence.wait_for_session(self.azurecosmos.container_history, session_id)
+        # Only the turns the history window can keep are read
+        last_turns = self.history_window.max_turns if self.history_window.enabled else None
+        return await self.azurecosmos.get_session_async(session_id, last_turns)
+
+    def build_pipeline(self, session_id, query, session=None):
+        """Builds the stages preparing the LLM call: prompt/function files, retrieval and history.
+
+        Independent stages run concurrently; add a stage depending on "system_prompt",
+        "functions", "message" and "history" to call the model as soon as they are ready.
+        The "window" stage holds the history token statistics and the turns left out of it;
+        the "context" stage the packed chunks and their token statistics; the "route" stage
+        the deployment chosen for the request. With query rewriting on, a "rewrite" stage
+        turns the query and the session history into the queries the "search" stage fans out.
+        """
+        def retrieve_context(search):
+            if not search or isinstance(search, dict):
+                raise ValueError(f"Empty response from Azure AI Search: {search}")
+            context = self.context_packer.pack(search)
+            logger.info(f"Context: {context['info']}\n{context['text']}")
+            return context
+
+        async def build_message(context):
+            return [{"role": "user", "content": f"CONTEXT:\n{context['text']}\n\nQUERY: {query}"}]
+
+        async def route(search):
+            decision = self.router.route(query, search)
+            logger.info(f"Routed to {decision.model}: {decision.reasons or 'no signal for the large model'}")
+            return decision
+
+        async def select_history(window):
+            return window["messages"]
+
+        def apply_window(session):
+            window, older_count, info = self.history_window.apply(session["chat_history"], session["summary"], session["offset"])
+            logger.info(f"Chat history window: {info}")
+            return {"messages": window, "older_count": older_count, "info": info}
+
+        # Prompt and function files come from the preloaded settings; one snapshot per turn
+        settings = get_settings()
+        files = settings.config["model"]
+
+        async def system_prompt():
+            return settings.prompt(files["prompt"]["system_prompt"])
+
+        async def functions():
+            return settings.function_schema(files["parameters"]["functions"]["file"])
+
+        async def rewrite(session):
+            return await self.query_rewriter.rewrite_async(query, session)
+
+        async def search(rewrite):
+            return await self.query_rewriter.search_async(self.azureaisearch.run_async, rewrite["queries"])
+
+        pipeline = (
+            Pipeline()
+            .add("system_prompt", system_prompt)
+            .add("functions", functions)
+            .add("session", partial(self.load_session, session_id) if session is None else (lambda: session))
+        )
+        if self.query_rewriter.enabled:
+            # Retrieval waits for the history the query is rewritten against
+            pipeline.add("rewrite", rewrite, depends_on=("session",)).add("search", search, depends_on=("rewrite",))
+        else:
+            pipeline.add("search", partial(self.azureaisearch.run_async, query))
+        return (
+            pipeline
+            .add("window", apply_window, depends_on=("session",))
+            .add("history", select_history, depends_on=("window",))
+            .add("context", retrieve_context, depends_on=("search",))
+            .add("message", build_message, depends_on=("context",))
+            .add("route", route, depends_on=("search",))
+        )
+
+    def schedule_summary(self, session_id, session, new_messages):
+        """Refreshes the rolling summary in the background once turns fall out of the window."""
+        if session is None or not self.history_window.summary_enabled:
+            return
+        messages = session["chat_history"] + new_messages
+
+        async def refresh():
+            try:
+                _, older_count, _ = await asyncio.to_thread(self.history_window.apply, messages, session["summary"], session["offset"])
+                if not self.history_window.needs_summary(session["summary"], older_count):
+                    return
+                summary = await self.history_window.summarize(messages, session["summary"], older_count, session["offset"])
+                # The summary is stored on the session head, which the queued turn may create
+                await self.persistence.wait_for_session(self.azurecosmos.container_history, session_id)
+                await self.azurecosmos.save_summary_async(session_id, summary)
+            except Exception as e:
+                logger.warning(f"Failed to refresh chat history summary for session ID '{session_id}': {e}")
+
+        # Keep a reference so the task is not garbage collected before it finishes
+        task = asyncio.create_task(refresh())
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def save_turn(self, session_id, query, context, result, timings, start_time, cache_lookup=None, window=None, session=None, packing=None, rewrite=None):
+        """Stores the turn in the chat history and its cost in the evals container; returns the answer and its cost.
+
+        The query rewriting call, if any, is priced with the turn as one more attempt.
+        """
+        if not result or "error" in result:
+            raise ValueError(f"Empty result from Azure OpenAI: {result}")
+        logger.info(f"Result received: {result}")
+
+        response_data = result["response"]
+
+        logger.info(f"Response data: \n{response_data}")
+
+        if isinstance(response_data, dict) and "answer" in response_data:
+            answer = response_data["answer"]
+        else:
+            answer = response_data
+
+        execution_time = time.time() - start_time
+
+        # The answer text, or compact JSON for other responses; it is re-sent with every later turn
+        history_content = answer if isinstance(answer, str) else get_json_codec().dumps(response_data)
+        message_save = [{"role": "user", "content": query},
+                        {"role": "assistant", "content": history_content}]
+
+        cache_hit = cache_lookup is not None and cache_lookup.hit
+        # Priced with the deployment that answered; an escalated turn also pays for the first attempt
+        attempts = result.get("attempts") or [{
+            "model": result["model"],
+            "input_tokens": result["input_tokens"],
+            "output_tokens": result["output_tokens"],
+            "cached_input_tokens": result.get("cached_input_tokens", 0),
+        }]
+        if rewrite is not None and "usage" in rewrite:
+            attempts = attempts + [rewrite["usage"]]
+        price = self.router.price(result["model"])
+        # Answers served from the cache cost nothing
+        input_price = 0 if cache_hit else price["input_tokens"]
+        output_price = 0 if cache_hit else price["output_tokens"]
+        cached_input_price = 0 if cache_hit else price["cached_input_tokens"]
+        total_tokens_cost = 0 if cache_hit else self.router.cost(attempts)
+        if not cache_hit:
+            metrics = get_metrics()
+            for attempt in attempts:
+                metrics.inc("rag_llm_tokens_total", attempt["input_tokens"], model=attempt["model"], kind="input")
+                metrics.inc("rag_llm_tokens_total", attempt["output_tokens"], model=attempt["model"], kind="output")
+                metrics.inc("rag_llm_tokens_total", attempt.get("cached_input_tokens", 0), model=attempt["model"], kind="cached_input")
+                metrics.inc("rag_llm_cost_total", self.router.cost([attempt]), model=attempt["model"])
+
+        evals_save = [{
+                        "chat": {
+                                "query": query,
+                                "context": context,
+                                "answer": answer
+                            },
+                        "cost": {
+                            "model": result["model"],
+                            "input_tokens": result["input_tokens"],
+                            "output_tokens": result["output_tokens"],
+                            "cached_input_tokens": result.get("cached_input_tokens", 0),
+                            "input_tokens_price": input_price,
+                            "output_tokens_price": output_price,
+                            "cached_input_tokens_price": cached_input_price,
+                            "total_tokens_cost": total_tokens_cost,
+                            "attempts": attempts,
+                            },
+                        "time": execution_time,
+                        "timings": timings
+                    }]
+        if window is not None:
+            evals_save[0]["history"] = window["info"]
+        if packing is not None:
+            evals_save[0]["context"] = packing
+        if "routing" in result:
+            evals_save[0]["routing"] = result["routing"]
+        if rewrite is not None:
+            evals_save[0]["retrieval"] = {name: rewrite[name] for name in ("queries", "outcome", "duration")}
+        if cache_lookup is not None:
+            evals_save[0]["cache"] = {
+                "hit": cache_hit,
+                "kind": cache_lookup.kind,
+                "similarity": cache_lookup.similarity
+            }
+
+        # Written behind the response; evals are analytics and never hold up a turn
+        await self.persistence.submit(self.azurecosmos.container_history, session_id, message_save, "chat_history")
+        await self.persistence.submit(self.azurecosmos.container_evals, session_id, evals_save, "evals", critical=False)
+        if cache_lookup is not None and not cache_hit:
+            await self.answer_cache.store(cache_lookup, query, answer)
+        self.schedule_summary(session_id, session, message_save)
+        return answer, evals_save[0]["cost"]
+
+    @staticmethod
+    def cached_result(cache_lookup):
+        """Builds a model-shaped result for an answer served from the cache."""
+        return {
+            "response": {"answer": cache_lookup.answer},
+            "model": "answer_cache",
+            "input_tokens": 0,
+            "output_tokens": 0
+        }
+
+    @staticmethod
+    def unavailable(error):
+        """Builds the error payload for a throttled or unavailable dependency."""
+        payload = {"error": str(error), "dependency": error.dependency}
+        if error.retry_after is not None:
+            payload["retry_after"] = max(1, round(error.retry_after))
+        return payload
+
+    async def answer(self, session_id, query, include_cost=False, idempotency_key=None):
+        """Processes the chat request and returns the response payload and HTTP status.
+
+        With `include_cost`, the payload also holds the cost record stored in the evals container.
+        Duplicates of a running request (same session and normalized query, or same
+        `idempotency_key`) share its turn, and the turns of a session run one at a time.
+        """
+        payload, status = await self.coalescer.run(
+            session_id, query, partial(self.answer_turn, session_id, query), idempotency_key
+        )
+        # The payload is shared by coalesced requests
+        payload = dict(payload)
+        if not include_cost:
+            payload.pop("cost", None)
+        return payload, status
+
+    async def answer_turn(self, session_id, query):
+        """Runs one chat turn; the payload holds the cost record unless the turn failed."""
         try:
             start_time = time.time()
             logger.info("Starting chat response processing...")
-            azurezopenai = AzureOpenAIClient()
-            azureaisearch = AzureAISearchClient()
-
-            model_gpt4o=self.gpt4o_name
-            model_gpt4o_mini=self.gpt4o_mini_name
 
             if not query or not session_id:
                 logger.error("query or session_id not provided")
-                return jsonify({"error": "query or session_id not provided"}), 400
-
-            # Load system prompt and data
-            system_prompt = self.read_file(os.path.join(self.prompts_path, self.system_prompt))
-
-            functions = self.read_file(os.path.join(self.functions_path, self.functions), as_json=True)
-            function_call = self.function_call
-
-            context_results = azureaisearch.run(query)
-            if not context_results:
-                raise ValueError("Empty response from Azure OpenAI")
-            context = [item['content'] for item in context_results]
-            logger.info(f"Context: \n{context}")
-            
-            user_input = {"CONTEXT": f"'''{context}'''", "QUERY": {query}}
-            message_user = [{"role": "user", "content": f"'''{user_input}'''"}]
-            
-            messages_history = await self.azurecosmos.get_chat_history_async(session_id)
-
-            result = azurezopenai.run(
-                                model_gpt4o, 
-                                system_prompt, 
-                                message_user, 
-                                messages_history,
-                                # tools,
-                                # tool_choice,
-                                functions,
-                                function_call
-                                )
-            
-            if not result:
-                raise ValueError("Empty result from Azure OpenAI")
-            logger.info(f"Result received: {result}")
-
-            response_data = result["response"]
-
-            logger.info(f"Response data: \n{response_data}")
-
-            if isinstance(response_data, dict) and "answer" in response_data:
-                answer = response_data["answer"]
-            else:
-                answer = response_data
-
-            execution_time = time.time() - start_time
-        
-            message_save = [{"role": "user", "content": query},
-                            {"role": "assistant", "content": f"'''{response_data}'''"}]
-            
-            total_tokens_cost = ( 
-                    result["input_tokens"]*self.gpt4o_input_price + 
-                    result["output_tokens"]*self.gpt4o_output_price
+                return {"error": "query or session_id not provided"}, 400
+
+            cache_lookup, session = await self.lookup_cached_answer(session_id, query)
+            if cache_lookup is not None and cache_lookup.hit:
+                logger.info(f"Answer served from cache ({cache_lookup.kind}).")
+                answer, cost = await self.save_turn(session_id, query, [], self.cached_result(cache_lookup), {}, start_time, cache_lookup)
+                get_metrics().inc("rag_chat_requests_total", mode="sync", outcome="cache_hit")
+                return {"response": answer, "cost": cost}, 200
+
+            async def complete(system_prompt, functions, message, history, route):
+                return await self.router.run_async(route, lambda model: self.azureopenai.run_async(
+                                    model,
+                                    system_prompt,
+                                    message,
+                                    history,
+                                    # tools=tools,
+                                    # tool_choice=tool_choice,
+                                    functions=functions,
+                                    function_call=self.function_call
+                                    ))
+
+            pipeline = self.build_pipeline(session_id, query, session).add(
+                "completion", complete, depends_on=("system_prompt", "functions", "message", "history", "route")
             )
-            
-            evals_save = [{ 
-                            "chat": {
-                                    "query": query,
-                                    "context": context,
-                                    "answer": answer
-                                },
-                            "cost": {
-                                "model": result["model"],
-                                "input_tokens": result["input_tokens"],
-                                "output_tokens": result["output_tokens"],
-                                "input_tokens_price": self.gpt4o_input_price,
-                                "output_tokens_price": self.gpt4o_output_price,
-                                "total_tokens_cost": total_tokens_cost,
-                                },
-                            "time": execution_time
-                        }]
-
-            await asyncio.gather(
-                self.azurecosmos.insert_items_async(
-                            self.azurecosmos.container_history, 
-                            session_id, 
-                            message_save, 
-                            "chat_history"
-                ),
-                self.azurecosmos.insert_evals_async(session_id, evals_save)
+            results, timings = await pipeline.run()
+            answer, cost = await self.save_turn(
+                session_id, query, results["context"]["chunks"], results["completion"], timings, start_time,
+                cache_lookup, results["window"], results["session"], results["context"]["info"], results.get("rewrite")
             )
 
             logger.info("Chat response processing completed successfully.")
-            return jsonify({"response": answer}), 200
+            get_metrics().inc("rag_chat_requests_total", mode="sync", outcome="ok")
+            return {"response": answer, "cost": cost}, 200
+        except ResilienceError as e:
+            # Throttled or unavailable dependency: tell the client when to come back
+            logger.error(f"Dependency unavailable while generating model response: {e}")
+            get_metrics().inc("rag_chat_requests_total", mode="sync", outcome="unavailable")
+            return self.unavailable(e), 503
         except Exception as e:
             logger.error(f"Error generating model response: {e}")
-            return jsonify({"error": str(e)}), 500
\ No newline at end of file
+            get_metrics().inc("rag_chat_requests_total", mode="sync", outcome="error")
+            return {"error": str(e)}, 500
+
+    async def answer_stream(self, session_id, query, idempotency_key=None):
+        """Processes the chat request, yielding (event, data) pairs as the answer is generated.
+
+        Emits "delta" events with answer text as tokens arrive, then "done" with the full
+        answer once the turn has been recorded, or "error" if anything fails. Duplicates of
+        a running request receive the whole answer in one "delta" when it is ready.
+        """
+        async for item in self.coalescer.stream(session_id, query, partial(self.stream_turn, session_id, query), idempotency_key):
+            yield item
+
+    async def stream_turn(self, session_id, query):
+        """Runs one streamed chat turn."""
+        try:
+            start_time = time.time()
+            logger.info("Starting streamed chat response processing...")
+
+            if not query or not session_id:
+                logger.error("query or session_id not provided")
+                yield "error", {"error": "query or session_id not provided"}
+                return
+
+            cache_lookup, session = await self.lookup_cached_answer(session_id, query)
+            if cache_lookup is not None and cache_lookup.hit:
+                logger.info(f"Answer served from cache ({cache_lookup.kind}).")
+                answer, _ = await self.save_turn(session_id, query, [], self.cached_result(cache_lookup), {}, start_time, cache_lookup)
+                get_metrics().inc("rag_chat_requests_total", mode="stream", outcome="cache_hit")
+                yield "delta", {"text": answer}
+                yield "done", {"response": answer}
+                return
+
+            results, timings = await self.build_pipeline(session_id, query, session).run()
+
+            started = time.perf_counter()
+            time_to_first_token = None
+            result = None
+            # Streamed tokens cannot be taken back, so the routed model answers without escalation
+            async for event in self.azureopenai.stream_async(
+                                results["route"].model,
+                                results["system_prompt"],
+                                results["message"],
+                                results["history"],
+                                None,
+                                None,
+                                results["functions"],
+                                self.function_call
+                                ):
+                if event["type"] == "delta":
+                    if time_to_first_token is None:
+                        time_to_first_token = time.perf_counter() - started
+                    yield "delta", {"text": event["text"]}
+                else:
+                    result = dict(event["result"], routing=dict(results["route"].info(), escalation_enabled=False))
+
+            duration = time.perf_counter() - started
+            timings["completion"] = {
+                "start": timings["total"]["duration"],
+                "duration": round(duration, 6),
+                "time_to_first_token": round(time_to_first_token or duration, 6),
+            }
+            timings["total"]["duration"] = round(timings["total"]["duration"] + duration, 6)
+            answer, _ = await self.save_turn(
+                session_id, query, results["context"]["chunks"], result, timings, start_time,
+                cache_lookup, results["window"], results["session"], results["context"]["info"], results.get("rewrite")
+            )
+
+            logger.info("Streamed chat response processing completed successfully.")
+            get_metrics().inc("rag_chat_requests_total", mode="stream", outcome="ok")
+            yield "done", {"response": answer}
+        except ResilienceError as e:
+            logger.error(f"Dependency unavailable while streaming model response: {e}")
+            get_metrics().inc("rag_chat_requests_total", mode="stream", outcome="unavailable")
+            yield "error", self.unavailable(e)
+        except Exception as e:
+            logger.error(f"Error generating streamed model response: {e}")
+            get_metrics().inc("rag_chat_requests_total", mode="stream", outcome="error")
+            yield "error", {"error": str(e)}
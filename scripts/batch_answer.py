@@ -0,0 +1,50 @@
+"""Answers a JSONL file of questions through the chat pipeline and writes the results.
+
+Each input line is {"id": ..., "query": ...} or a JSON string. Results are appended to the
+output JSONL as queries complete and cost records to <output>.costs.jsonl; re-running the
+same command resumes, skipping the items already answered. Prints throughput and cost.
+
+Usage:
+    python -m scripts.batch_answer questions.jsonl answers.jsonl [--concurrency 8]
+"""
+import argparse
+import asyncio
+import json
+from orchestrator import Orchestrator
+from services.batch import BatchCheckpoint, BatchRunner
+
+def read_items(path):
+    with open(path, encoding="utf-8") as input_file:
+        return BatchRunner.parse_items([json.loads(line) for line in input_file if line.strip()])
+
+async def answer(items, checkpoint, concurrency):
+    orchestrator = Orchestrator()
+    runner = BatchRunner(orchestrator)
+    if concurrency:
+        runner.concurrency = concurrency
+    await orchestrator.warmup_async()
+    checkpoint.open()
+    try:
+        _, _, summary = await runner.run(items, checkpoint.write)
+        return summary
+    finally:
+        checkpoint.close()
+        await orchestrator.close_async()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--costs", help="Cost records JSONL; defaults to <output>.costs.jsonl.")
+    parser.add_argument("--concurrency", type=int, help="Questions answered at once; defaults to batch.concurrency.")
+    args = parser.parse_args()
+
+    items = read_items(args.input)
+    checkpoint = BatchCheckpoint(args.output, args.costs or f"{args.output.removesuffix('.jsonl')}.costs.jsonl")
+    completed = checkpoint.completed_ids()
+    pending = [item for item in items if item["id"] not in completed]
+    summary = asyncio.run(answer(pending, checkpoint, args.concurrency)) if pending else {}
+    print(json.dumps({"skipped_completed": len(items) - len(pending), **summary}, indent=2))
+
+if __name__ == "__main__":
+    main()
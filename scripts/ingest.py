@@ -0,0 +1,47 @@
+"""Chunks, embeds and uploads a directory of documents to the search index.
+
+Re-running only embeds and uploads chunks that changed since the last run and deletes
+the chunks of removed documents; --full ignores the saved state and re-ingests everything.
+
+Usage:
+    python -m scripts.ingest docs/ [--target azure|local] [--full]
+"""
+import argparse
+import asyncio
+import json
+from config.config import Config
+from services.clients import get_client_registry
+from services.ingestion import AzureSearchIndexWriter, IngestionPipeline, LocalSearchIndexWriter
+
+def create_pipeline(target):
+    config = Config().config
+    ingestion_config = config.get("ingestion", {})
+    key_field = ingestion_config.get("key_field", "chunk_id")
+    if target == "local":
+        from services.localsearch import LocalSearchClient
+        local_config = config["ai_search"].get("local", {})
+        embedder = LocalSearchClient.create_embedder(local_config)
+        writer = LocalSearchIndexWriter(local_config.get("path", "data/local_index"), key_field, config["ai_search"]["fields"])
+    else:
+        from services.aisearch import AzureAISearchClient
+        from services.embeddings import AzureEmbeddingClient
+        embedder = AzureEmbeddingClient()
+        writer = AzureSearchIndexWriter(AzureAISearchClient(), key_field, ingestion_config.get("upload_batch_size", 500))
+    return IngestionPipeline(embedder, writer)
+
+async def ingest(directory, target, full):
+    try:
+        return await create_pipeline(target).run(directory, full)
+    finally:
+        await get_client_registry().close_async()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--target", choices=["azure", "local"], default=Config().config["ai_search"].get("backend", "azure"))
+    parser.add_argument("--full", action="store_true", help="ignore the saved state and re-ingest every chunk")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(ingest(args.directory, args.target, args.full)), indent=2))
+
+if __name__ == "__main__":
+    main()
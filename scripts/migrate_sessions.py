@@ -0,0 +1,46 @@
+"""Migrates legacy single-document sessions in Cosmos DB to the paged layout.
+
+Sessions are also migrated on their first new turn, so running this is optional; it moves
+idle sessions too. Safe to re-run and to run while the app is serving.
+
+Containers created before sessions were partitioned on /session_id are partitioned on
+/id, one partition per page. Cosmos DB cannot change a partition key, so
+`--copy-history-to` and `--copy-evals-to` copy them into new /session_id containers after
+the migration; point COSMOS_DB_CONTAINER_HISTORY and COSMOS_DB_CONTAINER_EVALS at the
+copies, then re-run the copy to catch up on turns written in between.
+
+Usage:
+    python -m scripts.migrate_sessions [--copy-history-to NAME] [--copy-evals-to NAME]
+"""
+import argparse
+import asyncio
+import json
+from services.clients import get_client_registry
+from services.cosmosdb import AzureCosmosDBClient
+
+async def migrate(args):
+    cosmos = AzureCosmosDBClient()
+    try:
+        report = {
+            "migrated_sessions": {
+                "history": await cosmos.migrate_container_async(cosmos.container_history, "chat_history"),
+                "evals": await cosmos.migrate_container_async(cosmos.container_evals, "evals"),
+            }
+        }
+        copies = {"history": (cosmos.container_history, args.copy_history_to), "evals": (cosmos.container_evals, args.copy_evals_to)}
+        copied = {name: await cosmos.copy_container_async(container, target) for name, (container, target) in copies.items() if target}
+        if copied:
+            report["copied_documents"] = copied
+        return report
+    finally:
+        await get_client_registry().close_async()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--copy-history-to", help="New history container, partitioned on /session_id.")
+    parser.add_argument("--copy-evals-to", help="New evals container, partitioned on /session_id.")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(migrate(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
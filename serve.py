@@ -0,0 +1,156 @@
+"""Production entry point: pre-forked uvicorn workers serving the ASGI app.
+
+The parent process binds the socket, imports the modules and loads the configuration,
+prompts and function schemas once, then forks `flask.workers` workers that share them.
+No service object is built before the fork: each worker builds its own, with their
+clients and connection pools, then warms the connections to Azure OpenAI, AI Search and
+Cosmos DB before it accepts requests (/readyz turns 200). On SIGTERM or SIGINT the
+workers stop accepting connections, finish the chats in flight within
+`flask.graceful_timeout_seconds` and flush pending writes; crashed workers are replaced.
+
+Usage:
+    python serve.py [--workers 4] [--threads 32] [--host 0.0.0.0] [--port 8080]
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import time
+import uvicorn
+from config.config import Config, get_settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that reports draining on /readyz as soon as shutdown is requested."""
+
+    def handle_exit(self, sig, frame):
+        import asgi
+        if not asgi.serving["draining"]:
+            asgi.serving["draining"] = True
+            logger.info(f"Worker {os.getpid()} draining {asgi.serving['in_flight']} chats in flight.")
+        super().handle_exit(sig, frame)
+
+class Launcher:
+    """Binds the listening socket, forks the workers and supervises them until shutdown."""
+
+    def __init__(self, host=None, port=None, workers=None, threads=None):
+        try:
+            # Set parameters
+            config = Config().config
+            flask_config = config["flask"]
+            self.host = host or flask_config["host"]
+            self.port = port or flask_config["port"]
+            self.workers = workers or flask_config.get("workers") or os.cpu_count() or 1
+            self.threads = threads or flask_config.get("threads")
+            self.backlog = flask_config.get("backlog", 2048)
+            self.keep_alive = flask_config.get("keep_alive_seconds", 5)
+            self.graceful_timeout = flask_config.get("graceful_timeout_seconds", 30)
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.pids = set()
+        self.stopping = False
+
+    def bind(self):
+        sock = socket.socket(socket.AF_INET6 if ":" in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.set_inheritable(True)
+        return sock
+
+    def serve(self, sock):
+        """Runs one worker on the shared socket until it is told to stop."""
+        # Builds the orchestrator and its clients in this process, after the fork
+        import asgi
+        if self.threads:
+            asgi.executor_threads = self.threads
+        config = uvicorn.Config(
+            asgi.app,
+            lifespan="on",
+            backlog=self.backlog,
+            timeout_keep_alive=self.keep_alive,
+            timeout_graceful_shutdown=self.graceful_timeout,
+        )
+        DrainingServer(config).run(sockets=[sock])
+
+    def spawn(self, sock):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                self.serve(sock)
+            except BaseException as e:
+                logger.error(f"Worker {os.getpid()} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids.add(pid)
+        logger.info(f"Started worker {pid}.")
+
+    def stop(self, signum, frame):
+        if not self.stopping:
+            logger.info(f"Received signal {signum}; draining {len(self.pids)} workers.")
+            self.stopping = True
+            self.stop_deadline = time.monotonic() + self.graceful_timeout + 10
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def supervise(self, sock):
+        while self.pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.stopping and time.monotonic() > self.stop_deadline:
+                    logger.error(f"Workers {sorted(self.pids)} did not drain in time; killing them.")
+                    for worker in self.pids:
+                        try:
+                            os.kill(worker, signal.SIGKILL)
+                        except ProcessLookupError:
+                            # Exited since the last wait; reaped on the next one
+                            pass
+                time.sleep(0.2)
+                continue
+            self.pids.discard(pid)
+            if not self.stopping:
+                logger.warning(f"Worker {pid} exited with status {status}; starting a new one.")
+                time.sleep(1)
+                self.spawn(sock)
+        logger.info("All workers stopped.")
+
+    def run(self):
+        sock = self.bind()
+        # Pre-fork: modules, settings, prompts and function schemas are loaded once and shared.
+        # Service objects are not: their clients hold sockets a forked worker must not share.
+        import orchestrator
+        get_settings()
+        logger.info(f"Serving on {self.host}:{self.port} with {self.workers} workers.")
+        if self.workers == 1 or not hasattr(os, "fork"):
+            self.serve(sock)
+            return
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn(sock)
+        self.supervise(sock)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads", type=int)
+    args = parser.parse_args()
+    Launcher(args.host, args.port, args.workers, args.threads).run()
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,37 @@
 import os
 import logging
-from dotenv import load_dotenv
+import time
 from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.models import VectorizableTextQuery
 from azure.search.documents.models import (
     VectorizableTextQuery,
+    VectorizedQuery,
     QueryType,
     QueryCaptionType,
     QueryAnswerType,
 )
-from config.config import Config
+from config.config import Config, get_settings, load_environment
+from services.clients import get_client_registry
+from services.cache import LRUCache, SingleFlight, normalize_query
+from services.embeddings import get_query_embedder
+from services.metrics import get_metrics
+from services.resilience import ResilienceError, get_resilience
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class AzureAISearchClient:
-    """Class to interact with Azure AI Search service."""
+    """Class to interact with Azure AI Search service.
+
+    With `vectorization: client`, queries are embedded here through the shared cached
+    query embedder and sent as vectors, instead of being embedded by the index vectorizer
+    on every search; the vectors are cached for the answer cache and other callers.
+    """
 
     def __init__(self):
         try:
@@ -28,16 +41,27 @@ class AzureAISearchClient:
             self.k_nearest_neighbors = config["ai_search"]["k_nearest_neighbors"]
             self.fields = config["ai_search"]["fields"]
             self.top = config["ai_search"]["top"]
+            self.vectorization = config["ai_search"].get("vectorization", "service")
+            if self.vectorization not in ("service", "client"):
+                raise ValueError(f"Unknown query vectorization: {self.vectorization}")
+            self.query_embedder = get_query_embedder() if self.vectorization == "client" else None
+            cache_config = config["ai_search"].get("cache", {})
+            self.cache_enabled = cache_config.get("enabled", False)
+            self.cache = LRUCache(cache_config.get("max_entries", 1000), cache_config.get("ttl_seconds", 300))
+            self.single_flight = SingleFlight()
+            self.env_vars = self.load_env_var()
             logger.info("Configuration loaded successfully.")
         except Exception as e:
             logger.error(f"Error loading configuration: {e}")
             raise
+        self.searches = 0
+        self.search_seconds = 0.0
     
     @staticmethod
     def load_env_var():
         """Loads necessary environment variables for Azure AI Search."""
         try:
-            load_dotenv()
+            load_environment()
             required_vars = [
                     "AZURE_AI_SEARCH_ENDPOINT",
                     "AZURE_AI_SEARCH_KEY",
@@ -56,14 +80,20 @@ class AzureAISearchClient:
             raise
     
     @staticmethod
-    def create_search_client(env_vars):
+    def create_search_client(env_vars, transport=None):
         """Creates and returns an Azure SearchClient instance."""
         try:
             credential = AzureKeyCredential(env_vars["AZURE_AI_SEARCH_KEY"]) if len(env_vars["AZURE_AI_SEARCH_KEY"]) > 0 else DefaultAzureCredential()
+            client_kwargs = {"credential": credential}
+            if transport is not None:
+                client_kwargs["transport"] = transport
+            if get_resilience("search").enabled:
+                # Retries are left to the resilience layer so they are not multiplied
+                client_kwargs["retry_total"] = 0
             client = SearchClient(
                         env_vars["AZURE_AI_SEARCH_ENDPOINT"], 
                         env_vars["AZURE_AI_SEARCH_INDEX_NAME"], 
-                        credential=credential,
+                        **client_kwargs,
                     )
             logger.info("AI Search client created successfully.")
             return client
@@ -71,9 +101,58 @@ class AzureAISearchClient:
             logger.error(f"Error creating Azure AI Search client: {e}")
             raise
 
-    def search(self, client, query, env_vars):
-        """Performs a search query using Azure AI Search."""
+    @staticmethod
+    def create_async_search_client(env_vars, transport=None):
+        """Creates and returns an async Azure SearchClient instance."""
         try:
+            credential = AzureKeyCredential(env_vars["AZURE_AI_SEARCH_KEY"]) if len(env_vars["AZURE_AI_SEARCH_KEY"]) > 0 else AsyncDefaultAzureCredential()
+            client_kwargs = {"credential": credential}
+            if transport is not None:
+                client_kwargs["transport"] = transport
+            if get_resilience("search").enabled:
+                client_kwargs["retry_total"] = 0
+            client = AsyncSearchClient(
+                        env_vars["AZURE_AI_SEARCH_ENDPOINT"],
+                        env_vars["AZURE_AI_SEARCH_INDEX_NAME"],
+                        **client_kwargs,
+                    )
+            logger.info("Async AI Search client created successfully.")
+            return client
+        except Exception as e:
+            logger.error(f"Error creating async Azure AI Search client: {e}")
+            raise
+
+    def get_client(self):
+        """Returns the process-wide pooled SearchClient."""
+        registry = get_client_registry()
+        return registry.get(
+            "search",
+            lambda: self.create_search_client(self.env_vars, registry.azure_transport()),
+        )
+
+    async def get_async_client(self):
+        """Returns the pooled async SearchClient bound to the running event loop."""
+        registry = get_client_registry()
+        return registry.get_async(
+            "search",
+            lambda: self.create_async_search_client(self.env_vars, registry.async_azure_transport()),
+        )
+
+    async def ping_async(self):
+        """Sends a cheap request so the pooled async client holds an open connection."""
+        client = await self.get_async_client()
+        await client.get_document_count()
+
+    def build_search_kwargs(self, query, env_vars, vector=None):
+        """Builds the search arguments for the configured search type; `vector` is the query embedding, if computed here."""
+        if vector is not None:
+            vector_query = VectorizedQuery(
+                vector=vector,
+                k_nearest_neighbors=self.k_nearest_neighbors,
+                fields=self.fields,
+                exhaustive=True,
+            )
+        else:
             vector_query = VectorizableTextQuery(
                 text=query,
                 k_nearest_neighbors=self.k_nearest_neighbors,
@@ -81,43 +160,136 @@ class AzureAISearchClient:
                 exhaustive=True,
             )
 
-            search_kwargs = {
-                "search_text": None,
-                "vector_queries": [vector_query],
-                "top": self.top,
-            }
-
-            if self.search_type == "hybrid":
-                search_kwargs["search_text"] = query
-            elif self.search_type == "hybrid_semantic":
-                search_kwargs.update({
-                    "search_text": query,
-                    "query_type": QueryType.SEMANTIC,
-                    "semantic_configuration_name": env_vars["SEMANTIC_CONFIGURATION_NAME"],
-                    "query_caption": QueryCaptionType.EXTRACTIVE,
-                    "query_answer": QueryAnswerType.EXTRACTIVE,
-                })
-
-            response = client.search(**search_kwargs)
+        search_kwargs = {
+            "search_text": None,
+            "vector_queries": [vector_query],
+            "top": self.top,
+        }
+
+        if self.search_type == "hybrid":
+            search_kwargs["search_text"] = query
+        elif self.search_type == "hybrid_semantic":
+            search_kwargs.update({
+                "search_text": query,
+                "query_type": QueryType.SEMANTIC,
+                "semantic_configuration_name": env_vars["SEMANTIC_CONFIGURATION_NAME"],
+                "query_caption": QueryCaptionType.EXTRACTIVE,
+                "query_answer": QueryAnswerType.EXTRACTIVE,
+            })
+        return search_kwargs
+
+    def search(self, client, query, env_vars, timeout=None, vector=None):
+        """Performs a search query using Azure AI Search."""
+        try:
+            response = client.search(**self.build_search_kwargs(query, env_vars, vector), **({"timeout": timeout} if timeout else {}))
             return response
             
         except Exception as e:
             logger.error(f"Error getting Search from Azure AISearch: {e}")
             raise
 
+    async def search_async(self, client, query, env_vars, timeout=None, vector=None):
+        """Performs a search query using the async Azure AI Search client."""
+        try:
+            response = await client.search(**self.build_search_kwargs(query, env_vars, vector), **({"timeout": timeout} if timeout else {}))
+            return response
+
+        except Exception as e:
+            logger.error(f"Error getting Search from Azure AISearch: {e}")
+            raise
+
+    def cache_key(self, query):
+        """Builds the retrieval cache key from the normalized query and the search settings.
+
+        The index version is read from the current settings, so a hot reload that changes
+        it stops serving the results cached for the previous index.
+        """
+        index_version = str(get_settings().config["ai_search"].get("index_version", ""))
+        return (normalize_query(query), self.search_type, self.k_nearest_neighbors, self.fields, self.top, index_version, self.vectorization)
+
+    @staticmethod
+    def scored_chunk(result):
+        """Returns {"score", "content"} for a search result, with the "reranker_score" of semantic ranking if any."""
+        chunk = {"score": result["@search.score"], "content": result["chunk"]}
+        if result.get("@search.reranker_score") is not None:
+            chunk["reranker_score"] = result["@search.reranker_score"]
+        return chunk
+
+    def record_search(self, started):
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+
+    def retrieve(self, query):
+        """Queries the search service and returns the scored chunks."""
+        # Embedded ahead of the search span, so embedding and search latency are reported apart
+        vector = self.query_embedder.embed([query])[0] if self.query_embedder else None
+        started = time.perf_counter()
+        with get_metrics().span("search", backend="azure"):
+            client = self.get_client()
+
+            def attempt(timeout):
+                # Results are paged lazily, so the whole iteration is one attempt
+                search_results = self.search(client, query, self.env_vars, timeout, vector)
+                return [self.scored_chunk(result) for result in search_results]
+            results = get_resilience("search").call(attempt)
+        self.record_search(started)
+        return results
+
+    async def retrieve_async(self, query):
+        """Queries the search service with the async client and returns the scored chunks."""
+        vector = (await self.query_embedder.embed_async([query]))[0] if self.query_embedder else None
+        started = time.perf_counter()
+        with get_metrics().span("search", backend="azure"):
+            client = await self.get_async_client()
+
+            async def attempt(timeout):
+                search_results = await self.search_async(client, query, self.env_vars, timeout, vector)
+                return [self.scored_chunk(result) async for result in search_results]
+            results = await get_resilience("search").call_async(attempt)
+        self.record_search(started)
+        return results
+
     def run(self, query):
         """Executes the search process and returns the results."""
         try:
-            env_vars = self.load_env_var()
-            client = self.create_search_client(env_vars)
-            search_results = self.search(client, query, env_vars)
-
-            response = [
-                    {"score": result["@search.score"], "content": result["chunk"]}
-                    for result in search_results
-            ]
-            
-            return response
+            if not self.cache_enabled:
+                return self.retrieve(query)
+            key = self.cache_key(query)
+            response = self.cache.get(key)
+            if response is None:
+                # Concurrent identical lookups share one request to the search service
+                response = self.single_flight.run(key, lambda: self.retrieve(query))
+                self.cache.set(key, response)
+            return list(response)
+        except ResilienceError:
+            raise
         except Exception as e:
             logger.error(f"Error running Azure AI Search process: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+            return {"error": str(e)}
+
+    async def run_async(self, query):
+        """Executes the search process on the shared async client and returns the results."""
+        try:
+            if not self.cache_enabled:
+                return await self.retrieve_async(query)
+            key = self.cache_key(query)
+            response = self.cache.get(key)
+            if response is None:
+                # Concurrent identical lookups share one request to the search service
+                response = await self.single_flight.run_async(key, lambda: self.retrieve_async(query))
+                self.cache.set(key, response)
+            return list(response)
+        except ResilienceError:
+            raise
+        except Exception as e:
+            logger.error(f"Error running Azure AI Search process: {e}")
+            return {"error": str(e)}
+
+    def cache_stats(self):
+        """Returns the retrieval cache counters, including lookups deduplicated in flight, and the search latency."""
+        return dict(
+            self.cache.stats(),
+            deduplicated=self.single_flight.shared,
+            searches=self.searches,
+            search_latency_mean_s=round(self.search_seconds / self.searches, 6) if self.searches else 0.0,
+        )
\ No newline at end of file
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+from config.config import Config, get_settings
+from services.cache import normalize_query
+from services.metrics import get_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def query_key(normalized_query, index_version):
+    digest = hashlib.sha256(normalized_query.encode("utf-8")).hexdigest()
+    return f"{index_version}:{digest}"
+
+@dataclass
+class CacheLookup:
+    """Outcome of an answer cache lookup; keeps the key and embedding to store the answer on a miss."""
+    key: str
+    vector: list = None
+    answer: str = None
+    similarity: float = 0.0
+    kind: str = "miss"
+
+    @property
+    def hit(self):
+        return self.answer is not None
+
+class InMemoryAnswerCacheBackend:
+    """In-process answer store with LRU/TTL eviction and an embedding matrix grown on demand.
+
+    The matrix doubles from `initial_rows` up to `max_entries` rows, so a small cache does
+    not hold the memory of a full one.
+    """
+
+    blocking = False
+    initial_rows = 64
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._slots = OrderedDict()
+        self._free = []
+        self._entries = []
+        self._expires = np.full(0, -np.inf)
+        self._matrix = None
+
+    def _release(self, key):
+        slot = self._slots.pop(key)
+        self._entries[slot] = None
+        self._expires[slot] = -np.inf
+        self._matrix[slot] = 0.0
+        self._free.append(slot)
+
+    def _allocate(self, dimensions):
+        """Returns a free slot, growing the matrix or evicting the least recently used entry."""
+        if self._free:
+            return self._free.pop()
+        if len(self._entries) >= self.max_entries:
+            self._release(next(iter(self._slots)))
+            return self._free.pop()
+        slot = len(self._entries)
+        self._entries.append(None)
+        rows = 0 if self._matrix is None else self._matrix.shape[0]
+        if slot >= rows:
+            rows = min(max(rows * 2, self.initial_rows), self.max_entries)
+            matrix = np.zeros((rows, dimensions), dtype=np.float32)
+            expires = np.full(rows, -np.inf)
+            if self._matrix is not None:
+                matrix[:slot] = self._matrix[:slot]
+                expires[:slot] = self._expires[:slot]
+            self._matrix, self._expires = matrix, expires
+        return slot
+
+    def get(self, key):
+        """Returns the entry stored under `key` if it has not expired."""
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            if self._expires[slot] <= self.clock():
+                self._release(key)
+                return None
+            self._slots.move_to_end(key)
+            return self._entries[slot]
+
+    def search(self, vector, version=None):
+        """Returns the live entry most similar to `vector` and its cosine similarity.
+
+        Entries of other index versions are cleared on version change, so `version` is not needed here.
+        """
+        with self._lock:
+            if not self._slots or self._matrix is None:
+                return None, 0.0
+            query = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if not norm:
+                return None, 0.0
+            used = len(self._entries)
+            scores = self._matrix[:used] @ (query / norm)
+            scores[self._expires[:used] <= self.clock()] = -np.inf
+            slot = int(np.argmax(scores))
+            if not np.isfinite(scores[slot]) or self._entries[slot] is None:
+                return None, 0.0
+            entry = self._entries[slot]
+            self._slots.move_to_end(entry["key"])
+            return entry, float(scores[slot])
+
+    def put(self, key, entry, vector):
+        """Stores `entry` and its embedding, evicting the least recently used entry if full."""
+        with self._lock:
+            vector = np.asarray(vector, dtype=np.float32)
+            if key in self._slots:
+                self._release(key)
+            slot = self._allocate(vector.shape[0])
+            norm = np.linalg.norm(vector)
+            self._matrix[slot] = vector / norm if norm else vector
+            self._entries[slot] = dict(entry, key=key)
+            self._expires[slot] = self.clock() + self.ttl_seconds if self.ttl_seconds else np.inf
+            self._slots[key] = slot
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._slots):
+                self._release(key)
+
+    def __len__(self):
+        return len(self._slots)
+
+class RedisAnswerCacheBackend:
+    """Answer store shared between workers, backed by Redis Stack vector search.
+
+    Entries expire with their TTL; configure `maxmemory-policy allkeys-lru` on the server
+    to bound memory.
+    """
+
+    blocking = True
+
+    def __init__(self, url, ttl_seconds=3600, dimensions=1536, namespace="answer-cache"):
+        try:
+            import redis
+            from redis.commands.search.field import TagField, VectorField
+            from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+        except ImportError as e:
+            logger.error("The redis answer cache backend requires the 'redis' package.")
+            raise ValueError("The redis answer cache backend requires the 'redis' package.") from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = f"{namespace}:"
+        self.index = f"{namespace}-idx"
+        try:
+            self.client.ft(self.index).info()
+        except redis.ResponseError:
+            self.client.ft(self.index).create_index(
+                [
+                    TagField("version"),
+                    VectorField("vector", "HNSW", {"TYPE": "FLOAT32", "DIM": dimensions, "DISTANCE_METRIC": "COSINE"}),
+                ],
+                definition=IndexDefinition(prefix=[self.prefix], index_type=IndexType.HASH),
+            )
+
+    def get(self, key):
+        payload = self.client.hget(self.prefix + key, "payload")
+        return json.loads(payload) if payload else None
+
+    def search(self, vector, version=None):
+        from redis.commands.search.query import Query
+        version_filter = f"@version:{{{version}}}" if version else "*"
+        query = (
+            Query(f"({version_filter})=>[KNN 1 @vector $vector AS distance]")
+            .sort_by("distance")
+            .return_fields("payload", "distance")
+            .dialect(2)
+        )
+        result = self.client.ft(self.index).search(
+            query, query_params={"vector": np.asarray(vector, dtype=np.float32).tobytes()}
+        )
+        if not result.docs:
+            return None, 0.0
+        document = result.docs[0]
+        return json.loads(document.payload), 1.0 - float(document.distance)
+
+    def put(self, key, entry, vector):
+        name = self.prefix + key
+        self.client.hset(name, mapping={
+            "payload": json.dumps(dict(entry, key=key)),
+            "version": entry.get("index_version", ""),
+            "vector": np.asarray(vector, dtype=np.float32).tobytes(),
+        })
+        if self.ttl_seconds:
+            self.client.expire(name, self.ttl_seconds)
+
+    def clear(self):
+        for name in self.client.scan_iter(match=f"{self.prefix}*"):
+            self.client.delete(name)
+
+class AnswerCache:
+    """Semantic cache of final answers keyed on the query text and its embedding."""
+
+    def __init__(self, embed_fn=None, backend=None):
+        try:
+            # Set parameters
+            config = Config().config
+            cache_config = config.get("answer_cache", {})
+            self.enabled = cache_config.get("enabled", False)
+            self.similarity_threshold = cache_config.get("similarity_threshold", 0.95)
+            self.first_turn_only = cache_config.get("first_turn_only", True)
+            self.index_version = str(config.get("ai_search", {}).get("index_version", ""))
+            self.settings_version = get_settings().version
+            ttl_seconds = cache_config.get("ttl_seconds", 3600)
+            max_entries = cache_config.get("max_entries", 10000)
+            if backend is None and cache_config.get("backend", "memory") == "redis":
+                backend = RedisAnswerCacheBackend(
+                    cache_config["redis_url"],
+                    ttl_seconds,
+                    config["model"]["embedding"].get("dimensions") or 1536,
+                )
+            elif backend is None:
+                backend = InMemoryAnswerCacheBackend(max_entries, ttl_seconds)
+            self.backend = backend
+            if embed_fn is None and self.enabled:
+                # Shares the cached query vectors with client-side search vectorization
+                from services.embeddings import get_query_embedder
+                embed_fn = get_query_embedder().embed_async
+            self.embed_fn = embed_fn
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    async def _backend_call(self, method, *args, blocking=False):
+        if blocking or self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def set_index_version(self, index_version):
+        """Invalidates every cached answer when the search index version changes."""
+        index_version = str(index_version)
+        if index_version != self.index_version:
+            logger.info(f"Search index version changed to '{index_version}', clearing the answer cache.")
+            self.index_version = index_version
+            self.backend.clear()
+
+    async def sync_index_version(self):
+        """Follows `ai_search.index_version` across settings reloads, clearing the cache when it changes."""
+        settings = get_settings()
+        if settings.version == self.settings_version:
+            return
+        self.settings_version = settings.version
+        index_version = str(settings.config.get("ai_search", {}).get("index_version", ""))
+        if index_version != self.index_version:
+            await self._backend_call(self.set_index_version, index_version)
+
+    async def lookup(self, query):
+        """Looks the query up by exact normalized text first, then by embedding similarity."""
+        await self.sync_index_version()
+        normalized = normalize_query(query)
+        key = query_key(normalized, self.index_version)
+        entry = await self._backend_call(self.backend.get, key)
+        if entry is not None:
+            self.exact_hits += 1
+            get_metrics().inc("rag_answer_cache_lookups_total", result="exact")
+            return CacheLookup(key, answer=entry["answer"], similarity=1.0, kind="exact")
+
+        vector = (await self.embed_fn([normalized]))[0]
+        # A product over every cached embedding; kept off the event loop
+        entry, similarity = await self._backend_call(self.backend.search, vector, self.index_version, blocking=True)
+        if entry is not None and similarity >= self.similarity_threshold and entry.get("index_version") == self.index_version:
+            self.semantic_hits += 1
+            get_metrics().inc("rag_answer_cache_lookups_total", result="semantic")
+            return CacheLookup(key, vector, entry["answer"], similarity, "semantic")
+
+        self.misses += 1
+        get_metrics().inc("rag_answer_cache_lookups_total", result="miss")
+        return CacheLookup(key, vector, similarity=similarity)
+
+    async def store(self, lookup, query, answer):
+        """Stores the answer produced after a cache miss."""
+        if lookup.hit or lookup.vector is None or not isinstance(answer, str):
+            return
+        entry = {"query": query, "answer": answer, "index_version": self.index_version}
+        await self._backend_call(self.backend.put, lookup.key, entry, lookup.vector)
+
+    def stats(self):
+        """Returns the lookup counters of this process, as served by GET /retrieval."""
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        hits = self.exact_hits + self.semantic_hits
+        return {
+            "enabled": self.enabled,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
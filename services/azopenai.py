@@ -1,16 +1,301 @@
 import os
-import json
-import re
+import asyncio
+import functools
 import logging
+import threading
+import time
 from pydantic import BaseModel
-from dotenv import load_dotenv
-from openai import AzureOpenAI
-from config.config import Config
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from config.config import Config, load_environment
+from services.clients import get_client_registry
+from services.metrics import get_metrics
+from services.resilience import RateLimitedError, ResilienceError, error_status, get_resilience, is_retryable, retry_after
+from services.serialization import get_json_codec
+from services.streaming import AnswerFieldExtractor
+from services.tokens import count_message_tokens, count_tokens
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Wrappers models put around JSON content; "```json" is checked before "```"
+_CONTENT_OPENINGS = ("```json", "```", "'''", '"""')
+_CONTENT_CLOSINGS = ("```", "'''", '"""')
+_JSON_VALUE_START = frozenset('{["-0123456789tfn')
+
+class StructureOutput(BaseModel):
+    answer: str
+    array_intent: list[str]
+    flag_intent: bool
+
+DEFAULT_ENV_NAMES = {
+    "AZURE_OPENAI_ENDPOINT": "AZURE_OPENAI_ENDPOINT",
+    "AZURE_OPENAI_API_KEY": "AZURE_OPENAI_API_KEY",
+    "AZURE_OPENAI_API_VERSION": "AZURE_OPENAI_API_VERSION",
+}
+
+class Backend:
+    """One deployment of a logical model on an Azure OpenAI resource."""
+
+    def __init__(self, name, deployment, env_vars, client_name, tpm=None):
+        self.name = name
+        self.deployment = deployment
+        self.env_vars = env_vars
+        self.client_name = client_name
+        self.capacity = tpm or 1
+        self.outstanding_requests = 0
+        self.outstanding_tokens = 0
+        self.drained_until = 0.0
+        self.requests = 0
+        self.tokens = 0
+
+    def stats(self, now):
+        return {
+            "deployment": self.deployment,
+            "outstanding_requests": self.outstanding_requests,
+            "outstanding_tokens": self.outstanding_tokens,
+            "drained_for": round(max(0.0, self.drained_until - now), 3),
+            "requests": self.requests,
+            "tokens": self.tokens,
+        }
+
+class ReservedStream:
+    """Async iterator over a streamed completion that keeps its backend reserved until the stream ends.
+
+    The reservation is returned when the last chunk is read, when reading fails or when
+    the stream is closed early, with the tokens the usage chunk reported.
+    """
+
+    def __init__(self, balancer, backend, tokens, stream):
+        self.balancer = balancer
+        self.backend = backend
+        self.tokens = tokens
+        self.stream = stream
+        self.usage = None
+        self.released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self.stream.__anext__()
+        except StopAsyncIteration:
+            self.release()
+            raise
+        except Exception as e:
+            self.release(e)
+            raise
+        except BaseException:
+            # Cancelled by the caller; the backend did nothing wrong
+            self.release()
+            raise
+        self.usage = getattr(chunk, "usage", None) or self.usage
+        return chunk
+
+    def release(self, exc=None):
+        if self.released:
+            return
+        self.released = True
+        usage = self.usage
+        used_tokens = (usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)) or 0
+        self.balancer.release(self.backend, self.tokens, exc, used_tokens=used_tokens)
+
+    async def aclose(self):
+        """Releases the reservation and closes the underlying response."""
+        self.release()
+        close = getattr(self.stream, "close", None)
+        if close is not None:
+            await close()
+
+class DeploymentBalancer:
+    """Spreads the calls to one logical model over its backends (deployments in several resources or regions).
+
+    A call goes to the available backend with the fewest outstanding tokens relative to its
+    `tpm`, then the fewest outstanding requests. A 429 drains the backend until its
+    retry-after expires and other retryable errors drain it for `error_drain_seconds`; the
+    call fails over to the next backend and the error is raised once every backend was tried.
+    """
+
+    def __init__(self, model, backends=None):
+        try:
+            # Set parameters
+            config = Config().config
+            balancing_config = config["model"].get("balancing", {})
+            self.error_drain = balancing_config.get("error_drain_seconds", 5.0)
+            self.default_drain = balancing_config.get("default_drain_seconds", 10.0)
+            self.max_wait = balancing_config.get("max_wait_seconds", 10.0)
+            deployment, specs = self.configured_backends(config["model"]["deployments"], model)
+            self.backends = [self.build_backend(spec, deployment, position) for position, spec in enumerate(backends or specs)]
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.model = model
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def configured_backends(deployments, model):
+        """Returns the deployment name and backend list of `model`; one default backend if none are listed."""
+        for key, entry in deployments.items():
+            if model in (key, entry.get("name")):
+                return entry.get("name", key), entry.get("backends") or [{}]
+        return model, [{}]
+
+    @staticmethod
+    def build_backend(spec, deployment, position):
+        """Resolves a backend entry; endpoint, key and API version are read from the environment variables it names."""
+        load_environment()
+        env_names = {var: spec.get(f"{var[len('AZURE_OPENAI_'):].lower()}_env", name) for var, name in DEFAULT_ENV_NAMES.items()}
+        env_vars = {var: os.getenv(name) for var, name in env_names.items()}
+        missing_vars = [env_names[var] for var, value in env_vars.items() if not value]
+        if missing_vars:
+            logger.error(f"Missing environment variables: {', '.join(missing_vars)}")
+            raise ValueError(f"Missing environment variables: {', '.join(missing_vars)}")
+        # Backends on the default endpoint share the pooled "openai" client
+        client_name = "openai" if env_names == DEFAULT_ENV_NAMES else "openai:" + ":".join(env_names.values())
+        return Backend(spec.get("name", "default" if position == 0 else f"backend-{position}"), spec.get("deployment", deployment), env_vars, client_name, spec.get("tpm"))
+
+    def acquire(self, tokens, tried):
+        """Reserves the least loaded backend that is not drained or already tried, or returns None."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [backend for backend in self.backends if backend not in tried and backend.drained_until <= now]
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda backend: (
+                (backend.outstanding_tokens + tokens) / backend.capacity,
+                backend.outstanding_requests,
+                backend.requests / backend.capacity,
+            ))
+            backend.outstanding_requests += 1
+            backend.outstanding_tokens += tokens
+            backend.requests += 1
+            return backend
+
+    def release(self, backend, tokens, exc=None, used_tokens=0):
+        """Returns the reservation and drains the backend if it throttled or failed."""
+        outcome = "ok"
+        with self._lock:
+            now = time.monotonic()
+            backend.outstanding_requests -= 1
+            backend.outstanding_tokens -= tokens
+            backend.tokens += used_tokens
+            if exc is not None:
+                outcome = "error"
+                drain = 0.0
+                if error_status(exc) == 429:
+                    outcome = "throttled"
+                    delay = retry_after(exc)
+                    drain = self.default_drain if delay is None else delay
+                elif is_retryable(exc):
+                    drain = self.error_drain
+                # With a single backend there is nothing to fail over to; retries pace themselves
+                if drain and len(self.backends) > 1:
+                    backend.drained_until = max(backend.drained_until, now + drain)
+        metrics = get_metrics()
+        metrics.inc("rag_openai_backend_requests_total", model=self.model, backend=backend.name, outcome=outcome)
+        if used_tokens:
+            metrics.inc("rag_openai_backend_tokens_total", used_tokens, model=self.model, backend=backend.name)
+
+    def unavailable(self, last_error):
+        """Returns the seconds until a drained backend is back, or raises when the call should give up."""
+        if last_error is not None:
+            raise last_error
+        with self._lock:
+            wait = max(0.0, min(backend.drained_until for backend in self.backends) - time.monotonic())
+        if wait > self.max_wait:
+            raise RateLimitedError(f"Every backend of {self.model} is draining for {wait:.1f}s.", "openai", wait)
+        return wait
+
+    def failover(self, backend, tokens, exc, tried):
+        """Records a failed call; returns True if it should be retried on another backend."""
+        self.release(backend, tokens, exc)
+        if not isinstance(exc, Exception) or not is_retryable(exc) or len(tried) == len(self.backends):
+            return False
+        logger.warning(f"Failing over {self.model} from backend '{backend.name}': {exc!r}")
+        return True
+
+    @staticmethod
+    def used_tokens(result):
+        usage = getattr(result, "usage", None)
+        return getattr(usage, "total_tokens", None) or 0
+
+    def estimate(self, tokens):
+        # Token estimates only matter when there is a choice of backend
+        if len(self.backends) == 1:
+            return 0
+        return tokens() if callable(tokens) else tokens
+
+    def call(self, func, tokens=0):
+        """Calls `func(backend)` on the least loaded backend, failing over on retryable errors."""
+        tokens = self.estimate(tokens)
+        tried = []
+        last_error = None
+        while True:
+            backend = self.acquire(tokens, tried)
+            if backend is None:
+                time.sleep(self.unavailable(last_error))
+                continue
+            tried.append(backend)
+            try:
+                result = func(backend)
+            except BaseException as e:
+                if not self.failover(backend, tokens, e, tried):
+                    raise
+                last_error = e
+                continue
+            self.release(backend, tokens, used_tokens=self.used_tokens(result))
+            return result
+
+    async def call_async(self, func, tokens=0, stream=False):
+        """Awaits `func(backend)` on the least loaded backend, failing over on retryable errors.
+
+        With `stream`, the result is a completion stream and is returned as a ReservedStream,
+        which keeps the backend reserved until the stream is exhausted or closed.
+        """
+        tokens = self.estimate(tokens)
+        tried = []
+        last_error = None
+        while True:
+            backend = self.acquire(tokens, tried)
+            if backend is None:
+                await asyncio.sleep(self.unavailable(last_error))
+                continue
+            tried.append(backend)
+            try:
+                result = await func(backend)
+            except BaseException as e:
+                if not self.failover(backend, tokens, e, tried):
+                    raise
+                last_error = e
+                continue
+            if stream:
+                return ReservedStream(self, backend, tokens, result)
+            self.release(backend, tokens, used_tokens=self.used_tokens(result))
+            return result
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {backend.name: backend.stats(now) for backend in self.backends}
+
+_balancers = {}
+_balancers_lock = threading.Lock()
+
+def get_balancer(model):
+    """Returns the process-wide balancer of a logical model (deployment name)."""
+    balancer = _balancers.get(model)
+    if balancer is None:
+        with _balancers_lock:
+            balancer = _balancers.get(model)
+            if balancer is None:
+                balancer = _balancers[model] = DeploymentBalancer(model)
+    return balancer
+
+def balancer_stats():
+    return {model: balancer.stats() for model, balancer in _balancers.items()}
+
 class AzureOpenAIClient:
     """Class to interact with Azure OpenAI service."""
 
@@ -23,6 +308,7 @@ class AzureOpenAIClient:
             self.top_p = config["model"]["parameters"]["top_p"]
             self.max_tokens = config["model"]["parameters"]["max_tokens"]
             self.seed = config["model"]["parameters"]["seed"]
+            self.env_vars = self.load_env_var()
             logger.info("Configuration loaded successfully.")
         except Exception as e:
             logger.error(f"Error loading configuration: {e}")
@@ -32,7 +318,7 @@ class AzureOpenAIClient:
     def load_env_var():
         """Loads necessary environment variables for Azure OpenAI."""
         try:
-            load_dotenv()
+            load_environment()
             required_vars = [
                     "AZURE_OPENAI_ENDPOINT",
                     "AZURE_OPENAI_API_KEY",
@@ -50,13 +336,15 @@ class AzureOpenAIClient:
             raise
     
     @staticmethod
-    def create_openai_client(env_vars):
+    def create_openai_client(env_vars, http_client=None, max_retries=2):
         """Creates and returns an Azure OpenAI client instance."""
         try:
             client = AzureOpenAI(
                 azure_endpoint=env_vars["AZURE_OPENAI_ENDPOINT"],
                 api_key=env_vars["AZURE_OPENAI_API_KEY"],
-                api_version=env_vars["AZURE_OPENAI_API_VERSION"]
+                api_version=env_vars["AZURE_OPENAI_API_VERSION"],
+                http_client=http_client,
+                max_retries=max_retries
             )
             logger.info("Azure OpenAI client created successfully.")
             return client
@@ -65,129 +353,397 @@ class AzureOpenAIClient:
             raise
     
     @staticmethod
-    def read_file(file_path, as_json=False):
-        """Reads content from a file."""
+    def create_async_openai_client(env_vars, http_client=None, max_retries=2):
+        """Creates and returns an async Azure OpenAI client instance."""
         try:
-            with open(file_path, 'r') as file:
-                logger.info(f"File '{file_path}' successfully loaded.")
-                if as_json:
-                    return json.load(file)
-                else:
-                    return file.read()
-        except json.JSONDecodeError:
-            logger.error(f"Error decoding JSON file: {file_path}")
-            return ""
+            client = AsyncAzureOpenAI(
+                azure_endpoint=env_vars["AZURE_OPENAI_ENDPOINT"],
+                api_key=env_vars["AZURE_OPENAI_API_KEY"],
+                api_version=env_vars["AZURE_OPENAI_API_VERSION"],
+                http_client=http_client,
+                max_retries=max_retries
+            )
+            logger.info("Async Azure OpenAI client created successfully.")
+            return client
         except Exception as e:
-            logger.error(f"Error reading file: {e}")
-            return ""
-    
+            logger.error(f"Error creating async Azure OpenAI client: {e}")
+            raise
+
+    @staticmethod
+    def sdk_max_retries():
+        """Retries are left to the resilience layer when it is enabled, so they are not multiplied."""
+        return 0 if get_resilience("openai").enabled else 2
+
+    @staticmethod
+    def timeout_kwargs(timeout):
+        # Passing timeout=None to the SDK would disable the client timeout
+        return {"timeout": timeout} if timeout else {}
+
+    def estimate_tokens(self, model, messages, max_tokens=None):
+        """Estimates the quota a completion draws: prompt tokens plus the max_tokens reserved for the answer."""
+        return lambda: count_message_tokens(messages, model) + (max_tokens or self.max_tokens or 0)
+
+    def get_client(self, backend=None):
+        """Returns the process-wide pooled Azure OpenAI client of a backend (the default endpoint if None)."""
+        registry = get_client_registry()
+        name, env_vars = ("openai", self.env_vars) if backend is None else (backend.client_name, backend.env_vars)
+        return registry.get(
+            name,
+            lambda: self.create_openai_client(env_vars, registry.http_client(), self.sdk_max_retries()),
+        )
+
+    async def get_async_client(self, backend=None):
+        """Returns the pooled async Azure OpenAI client of a backend bound to the running event loop."""
+        registry = get_client_registry()
+        name, env_vars = ("openai", self.env_vars) if backend is None else (backend.client_name, backend.env_vars)
+        return registry.get_async(
+            name,
+            lambda: self.create_async_openai_client(env_vars, registry.async_http_client(), self.sdk_max_retries()),
+        )
+
+    async def ping_async(self, models):
+        """Lists the models on every backend of `models` so each pooled async client holds an open connection."""
+        for backend in {backend.client_name: backend for model in models for backend in get_balancer(model).backends}.values():
+            client = await self.get_async_client(backend)
+            await client.models.list()
+
+    def call_model(self, model, create, tokens=0):
+        """Runs `create(client, deployment, timeout)` on a backend of `model` under the resilience policy.
+
+        `tokens` is the quota estimate (or a callable returning it) used by the rate limiter and the balancer.
+        """
+        balancer = get_balancer(model)
+        tokens = functools.cache(tokens) if callable(tokens) else tokens
+        return get_resilience("openai").call(
+            lambda timeout: balancer.call(lambda backend: create(self.get_client(backend), backend.deployment, timeout), tokens),
+            key=model,
+            tokens=tokens
+        )
+
+    async def call_model_async(self, model, create, tokens=0, stream=False):
+        """Awaits `create(client, deployment, timeout)` on a backend of `model` under the resilience policy.
+
+        With `stream`, the backend stays reserved until the returned stream is exhausted or closed.
+        """
+        balancer = get_balancer(model)
+        tokens = functools.cache(tokens) if callable(tokens) else tokens
+
+        async def on_backend(backend, timeout):
+            client = await self.get_async_client(backend)
+            return await create(client, backend.deployment, timeout)
+
+        return await get_resilience("openai").call_async(
+            lambda timeout: balancer.call_async(lambda backend: on_backend(backend, timeout), tokens, stream),
+            key=model,
+            tokens=tokens
+        )
+
     @staticmethod
     def parse_content(response_content):
-        """Extracts JSON content from a message string."""
-        # Remove JSON code block markers if present
-        response_content = re.sub(r'^```json\s*', '', response_content.strip(), flags=re.MULTILINE)
-        response_content = re.sub(r'^```\s*', '', response_content.strip(), flags=re.MULTILINE)
-        response_content = re.sub(r'\s*```$', '', response_content.strip(), flags=re.MULTILINE)
-        
-        # Remove triple single quotes at the start and end, handling potential whitespace
-        response_content = re.sub(r'^\s*\'\'\'|^\s*"""', '', response_content.strip())
-        response_content = re.sub(r'\'\'\'\s*$|"""\s*$', '', response_content.strip())
-        
-        response_content = response_content.strip()
-        try:
-            return json.loads(response_content)
-        except json.JSONDecodeError:
-            return response_content  # Return the plain text if it's not JSON
+        """Extracts JSON content from a message string, unwrapping code fences and triple quotes."""
+        content = response_content.strip()
+        # Peel the wrappers in one pass over the ends of the string
+        unwrapped = True
+        while unwrapped:
+            unwrapped = False
+            for opening in _CONTENT_OPENINGS:
+                if content.startswith(opening):
+                    content = content[len(opening):].lstrip()
+                    unwrapped = True
+                    break
+            for closing in _CONTENT_CLOSINGS:
+                if content.endswith(closing):
+                    content = content[:-len(closing)].rstrip()
+                    unwrapped = True
+                    break
+        # Only text starting like a JSON value is decoded; prose is returned as is
+        if content[:1] in _JSON_VALUE_START:
+            try:
+                return get_json_codec().loads(content)
+            except ValueError:
+                pass
+        return content  # Return the plain text if it's not JSON
     
-    def openai_response(self, client, model, messages, tools = None, tool_choice = None, functions = None, function_call = None):
-        """Gets a response from Azure OpenAI with multiple response format options."""
-        try:
-            completion_params = {
-                "model": model,
-                "temperature": self.temperature,
-                "top_p": self.top_p,
-                "max_tokens": self.max_tokens,
-                "seed": self.seed,
-                "messages": messages
-            }
+    def build_completion_params(self, model, messages, tools = None, tool_choice = None, functions = None, function_call = None):
+        """Builds the chat completion parameters for the configured response format."""
+        completion_params = {
+            "model": model,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "max_tokens": self.max_tokens,
+            "seed": self.seed,
+            "messages": messages
+        }
 
-            if self.response_format is None or self.response_format == "normal":
-                completion = client.chat.completions.create(**completion_params)
-                response_content = completion.choices[0].message.content
+        if self.response_format is None or self.response_format == "normal":
+            pass
+        elif self.response_format == "tools":
+            completion_params.update({"tools": tools, "tool_choice": tool_choice})
+        elif self.response_format == "function_calling":
+            completion_params.update({"functions": functions, "function_call": function_call})
+        elif self.response_format == "base_model":
+            completion_params.update({"response_format": StructureOutput})
+        else:
+            raise ValueError(f"Unknown response format: {self.response_format}")
+        return completion_params
+
+    def parse_completion(self, completion):
+        """Extracts the response from a chat completion according to the response format."""
+        message = completion.choices[0].message
+        if self.response_format is None or self.response_format == "normal":
+            response_content = message.content
+            json_data = self.parse_content(response_content)
+            response = json_data if json_data else response_content
+            logger.info("Azure OpenAI response generated by content.")
+        elif self.response_format == "tools":
+            tool_calls = message.tool_calls
+            if tool_calls:
+                response = tool_calls[0].function.arguments
+                logger.info("Azure OpenAI response generated by tool_call.")
+            else:
+                response_content = message.content
                 json_data = self.parse_content(response_content)
                 response = json_data if json_data else response_content
-                logger.info("Azure OpenAI response generated by content.")
-            elif self.response_format == "tools":
-                completion_params.update({"tools": tools, "tool_choice": tool_choice})
-                completion = client.chat.completions.create(**completion_params)
-                tool_calls = completion.choices[0].message.tool_calls
-                if tool_calls:
-                    response = tool_calls[0].function.arguments
-                    logger.info("Azure OpenAI response generated by tool_call.")
-                else:
-                    response_content = completion.choices[0].message.content
-                    json_data = self.parse_content(response_content)
-                    response = json_data if json_data else response_content
-                    logger.warning("Azure OpenAI response generated by content, not by tool_call.")
-            elif self.response_format == "function_calling":
-                completion_params.update({"functions": functions, "function_call": function_call})
-                completion = client.chat.completions.create(**completion_params)
-                function_call = completion.choices[0].message.function_call
-                if function_call:
-                    #response = function_call.arguments
-                    try:
-                        response = json.loads(function_call.arguments)
-                    except json.JSONDecodeError:
-                        response = {"answer": function_call.arguments}
-                    logger.info("Azure OpenAI response generated by function_call.")
-                else:
-                    response_content = completion.choices[0].message.content
-                    json_data = self.parse_content(response_content)
-                    response = json_data if json_data else response_content
-                    logger.warning("Azure OpenAI response generated by content, not by function_call.")
-            elif self.response_format == "base_model":
-                class StructureOutput(BaseModel):
-                    answer: str
-                    array_intent: list[str]
-                    flag_intent: bool
-                completion = client.beta.chat.completions.parse(
-                                **completion_params,
-                                response_format=StructureOutput
-                            )
-                response = completion.choices[0].message.parsed.model_dump()
-                logger.info("Azure OpenAI response generated by base_model.")
-
+                logger.warning("Azure OpenAI response generated by content, not by tool_call.")
+        elif self.response_format == "function_calling":
+            function_call = message.function_call
+            if function_call:
+                try:
+                    response = get_json_codec().loads(function_call.arguments)
+                except ValueError:
+                    response = {"answer": function_call.arguments}
+                logger.info("Azure OpenAI response generated by function_call.")
             else:
-                raise ValueError(f"Unknown response format: {self.response_format}")
+                response_content = message.content
+                json_data = self.parse_content(response_content)
+                response = json_data if json_data else response_content
+                logger.warning("Azure OpenAI response generated by content, not by function_call.")
+        elif self.response_format == "base_model":
+            response = message.parsed.model_dump()
+            logger.info("Azure OpenAI response generated by base_model.")
+        else:
+            raise ValueError(f"Unknown response format: {self.response_format}")
+        return response
+
+    def format_result(self, completion, model):
+        """Builds the result dictionary with the response and token usage."""
+        with get_metrics().span("response_parse", format=self.response_format):
+            response = self.parse_completion(completion)
+        logger.info("Response received from Azure OpenAI.")
+        return {
+            "response": response,
+            "model": model,
+            "input_tokens": completion.usage.prompt_tokens,
+            "output_tokens": completion.usage.completion_tokens,
+            "cached_input_tokens": self.cached_tokens(completion.usage)
+        }
 
-            logger.info("Response received from Azure OpenAI.")
-            
+    @staticmethod
+    def build_messages(system_prompt, message, messages_history = None):
+        """Assembles the system prompt, chat history and user message."""
+        messages = [{"role": "system", "content": f"'''{system_prompt}'''"}]
+        if messages_history:
+            messages.extend(messages_history)
+        if message:
+            messages.extend(message)
+        return messages
+
+    def create_completion(self, completion_params):
+        """Returns `create(client, deployment, timeout)` sending the completion to a backend deployment."""
+        def create(client, deployment, timeout):
+            method = client.beta.chat.completions.parse if self.response_format == "base_model" else client.chat.completions.create
+            return method(**dict(completion_params, model=deployment), **self.timeout_kwargs(timeout))
+        return create
+
+    def openai_response(self, model, messages, tools = None, tool_choice = None, functions = None, function_call = None):
+        """Gets a response from Azure OpenAI with multiple response format options."""
+        try:
+            completion_params = self.build_completion_params(model, messages, tools, tool_choice, functions, function_call)
+            with get_metrics().span("llm_call", model=model, stream="false"):
+                completion = self.call_model(model, self.create_completion(completion_params), self.estimate_tokens(model, messages))
+            return self.format_result(completion, model)
+        except Exception as e:
+            logger.error(f"Error getting response from Azure OpenAI: {e}")
+            raise
+
+    async def openai_response_async(self, model, messages, tools = None, tool_choice = None, functions = None, function_call = None):
+        """Gets a response from Azure OpenAI without blocking the event loop."""
+        try:
+            completion_params = self.build_completion_params(model, messages, tools, tool_choice, functions, function_call)
+            with get_metrics().span("llm_call", model=model, stream="false"):
+                completion = await self.call_model_async(model, self.create_completion(completion_params), self.estimate_tokens(model, messages))
+            return self.format_result(completion, model)
+        except Exception as e:
+            logger.error(f"Error getting response from Azure OpenAI: {e}")
+            raise
+    
+    async def complete_text_async(self, model, messages, max_tokens = None):
+        """Gets a plain text completion, ignoring the configured response format."""
+        try:
+            completion = await self.call_model_async(
+                model,
+                lambda client, deployment, timeout: client.chat.completions.create(
+                    model=deployment,
+                    messages=messages,
+                    temperature=0,
+                    max_tokens=max_tokens or self.max_tokens,
+                    seed=self.seed,
+                    **self.timeout_kwargs(timeout)
+                ),
+                self.estimate_tokens(model, messages, max_tokens)
+            )
             return {
-                "response": response,
+                "response": (completion.choices[0].message.content or "").strip(),
                 "model": model,
                 "input_tokens": completion.usage.prompt_tokens,
-                "output_tokens": completion.usage.completion_tokens
+                "output_tokens": completion.usage.completion_tokens,
+                "cached_input_tokens": self.cached_tokens(completion.usage)
             }
         except Exception as e:
-            logger.error(f"Error getting response from Azure OpenAI: {e}")
+            logger.error(f"Error getting text completion from Azure OpenAI: {e}")
             raise
-    
+
+    def parse_streamed(self, arguments, content):
+        """Builds the final response from the accumulated stream, mirroring `parse_completion`."""
+        if arguments and self.response_format == "function_calling":
+            try:
+                return get_json_codec().loads(arguments)
+            except ValueError:
+                return {"answer": arguments}
+        if arguments and self.response_format == "tools":
+            return arguments
+        json_data = self.parse_content(content)
+        return json_data if json_data else content
+
+    @staticmethod
+    def usage_value(usage, key):
+        """Reads a usage counter from a streamed usage payload (dict or object)."""
+        if isinstance(usage, dict):
+            return usage.get(key)
+        return getattr(usage, key, None)
+
+    @classmethod
+    def cached_tokens(cls, usage):
+        """Reads the prompt tokens served from the provider's prompt cache; 0 when not reported."""
+        details = cls.usage_value(usage, "prompt_tokens_details") if usage is not None else None
+        return (cls.usage_value(details, "cached_tokens") if details is not None else None) or 0
+
+    async def stream_async(self, model, system_prompt, message, messages_history = None, tools = None, tool_choice = None, functions = None, function_call = None):
+        """Streams the chat completion, yielding answer text deltas and then the full result.
+
+        Yields {"type": "delta", "text": ...} events while tokens arrive and a final
+        {"type": "done", "result": ...} event shaped like the result of `run`.
+        """
+        messages = self.build_messages(system_prompt, message, messages_history)
+
+        if self.response_format == "base_model":
+            # Structured parsing needs the whole completion, so it is sent as one delta
+            result = await self.openai_response_async(model, messages, tools, tool_choice, functions, function_call)
+            yield {"type": "delta", "text": result["response"].get("answer", "")}
+            yield {"type": "done", "result": result}
+            return
+
+        completion_params = self.build_completion_params(model, messages, tools, tool_choice, functions, function_call)
+        completion_params.update({
+            "stream": True,
+            "extra_body": {"stream_options": {"include_usage": True}},
+        })
+        # The stream is consumed across yields, so it is timed by hand rather than with a span
+        metrics = get_metrics()
+        started = time.perf_counter()
+        first_token = None
+        try:
+            # Only opening the stream is retried; tokens already yielded cannot be taken back
+            stream = await self.call_model_async(
+                model,
+                lambda client, deployment, timeout: client.chat.completions.create(**dict(completion_params, model=deployment), **self.timeout_kwargs(timeout)),
+                self.estimate_tokens(model, messages),
+                stream=True
+            )
+        except Exception as e:
+            logger.error(f"Error getting response stream from Azure OpenAI: {e}")
+            metrics.inc("rag_span_errors_total", span="llm_call", error=type(e).__name__)
+            raise
+
+        extractor = AnswerFieldExtractor()
+        argument_parts = []
+        content_parts = []
+        content_is_json = None
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                text = ""
+                if delta.function_call and delta.function_call.arguments:
+                    argument_parts.append(delta.function_call.arguments)
+                    text = extractor.feed(delta.function_call.arguments)
+                elif delta.tool_calls and delta.tool_calls[0].function and delta.tool_calls[0].function.arguments:
+                    argument_parts.append(delta.tool_calls[0].function.arguments)
+                    text = extractor.feed(delta.tool_calls[0].function.arguments)
+                elif delta.content:
+                    content_parts.append(delta.content)
+                    if content_is_json is None and delta.content.strip():
+                        content_is_json = delta.content.lstrip()[0] in "{`'"
+                    text = extractor.feed(delta.content) if content_is_json else delta.content
+                if text:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                        metrics.observe("rag_llm_time_to_first_token_seconds", first_token, model=model)
+                    yield {"type": "delta", "text": text}
+        finally:
+            # A caller that stops reading early must still give the backend back
+            await stream.aclose()
+        metrics.observe("rag_span_duration_seconds", time.perf_counter() - started, span="llm_call", model=model, stream="true")
+
+        arguments = "".join(argument_parts)
+        content = "".join(content_parts)
+        with metrics.span("response_parse", format=self.response_format):
+            response = self.parse_streamed(arguments, content)
+        input_tokens = self.usage_value(usage, "prompt_tokens")
+        output_tokens = self.usage_value(usage, "completion_tokens")
+        if input_tokens is None or output_tokens is None:
+            # The API version did not report usage for the stream; count locally
+            input_tokens = count_message_tokens(messages, model)
+            output_tokens = count_tokens(arguments or content, model)
+        logger.info("Response stream received from Azure OpenAI.")
+        yield {
+            "type": "done",
+            "result": {
+                "response": response,
+                "model": model,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cached_input_tokens": self.cached_tokens(usage)
+            }
+        }
+
     def run(self, model, system_prompt, message, messages_history = None, tools = None, tool_choice = None, functions = None, function_call = None):
         """Executes the OpenAI chat completion process."""
         try:
-            env_vars = self.load_env_var()
-            client = self.create_openai_client(env_vars)
-
-            messages = [{"role": "system", "content": f"'''{system_prompt}'''"}]
-            if messages_history:
-                messages.extend(messages_history)
-            if message:
-                messages.extend(message)
+            messages = self.build_messages(system_prompt, message, messages_history)
 
             ## logger.info(f"Messages: \n{messages}")
-            result = self.openai_response(client, model, messages, tools, tool_choice, functions, function_call)
+            result = self.openai_response(model, messages, tools, tool_choice, functions, function_call)
+            return result
+
+        except ResilienceError:
+            raise
+        except Exception as e:
+            logger.error(f"Error running Azure OpenAI process: {e}")
+            return {"error": str(e)}
+
+    async def run_async(self, model, system_prompt, message, messages_history = None, tools = None, tool_choice = None, functions = None, function_call = None):
+        """Executes the OpenAI chat completion process on the shared async client."""
+        try:
+            messages = self.build_messages(system_prompt, message, messages_history)
+            result = await self.openai_response_async(model, messages, tools, tool_choice, functions, function_call)
             return result
-        
+
+        except ResilienceError:
+            raise
         except Exception as e:
             logger.error(f"Error running Azure OpenAI process: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+            return {"error": str(e)}
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from config.config import Config
+from services.cache import normalize_query
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class BatchRunner:
+    """Answers many independent questions through the orchestrator with bounded concurrency.
+
+    Queries are grouped by their normalized text: each distinct query is retrieved and
+    answered once, in its own new session, and the answer is shared by its duplicates.
+    Every distinct query yields one cost record, the one stored in the evals container.
+    """
+
+    def __init__(self, orchestrator):
+        try:
+            # Set parameters
+            config = Config().config
+            batch_config = config.get("batch", {})
+            self.concurrency = batch_config.get("concurrency", 8)
+            self.max_request_items = batch_config.get("max_request_items", 100)
+            self.session_prefix = batch_config.get("session_prefix", "batch")
+            self.orchestrator = orchestrator
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+
+    @staticmethod
+    def parse_items(items):
+        """Accepts query strings or {"id", "query"} objects; ids default to the item position."""
+        parsed = []
+        for position, item in enumerate(items):
+            if isinstance(item, str):
+                item = {"query": item}
+            if not isinstance(item, dict) or not isinstance(item.get("query"), str) or not item["query"].strip():
+                raise ValueError(f"Batch item {position} has no 'query': {item}")
+            parsed.append({"id": str(item.get("id", position)), "query": item["query"]})
+        ids = [item["id"] for item in parsed]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Batch item ids must be unique.")
+        return parsed
+
+    @staticmethod
+    def group(items):
+        """Groups the items by normalized query, keeping the order of first appearance."""
+        groups = {}
+        for item in items:
+            groups.setdefault(normalize_query(item["query"]), []).append(item)
+        return groups
+
+    async def answer_group(self, items):
+        """Answers the first query of a group and returns one result per item plus the cost record."""
+        first = items[0]
+        session_id = f"{self.session_prefix}-{uuid.uuid4()}"
+        payload, status = await self.orchestrator.answer(session_id, first["query"], include_cost=True)
+        cost = payload.pop("cost", None)
+        results = []
+        for item in items:
+            result = {"id": item["id"], "query": item["query"], "status": status, **payload}
+            if item is not first:
+                result["duplicate_of"] = first["id"]
+            results.append(result)
+        cost_record = {"ids": [item["id"] for item in items], "query": first["query"], "session_id": session_id, **cost} if cost else None
+        return results, cost_record
+
+    async def run(self, items, on_result=None):
+        """Answers the items; returns their results, the cost records and a run summary.
+
+        `on_result(results, cost_record)` is awaited as each distinct query completes, so
+        callers can checkpoint progress.
+        """
+        started = time.perf_counter()
+        groups = self.group(items)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_group(members):
+            async with semaphore:
+                results, cost_record = await self.answer_group(members)
+            if on_result is not None:
+                await on_result(results, cost_record)
+            return results, cost_record
+
+        outcomes = await asyncio.gather(*(run_group(members) for members in groups.values()))
+        results = [result for group_results, _ in outcomes for result in group_results]
+        costs = [cost_record for _, cost_record in outcomes if cost_record]
+        return results, costs, self.summarize(results, costs, len(groups), time.perf_counter() - started)
+
+    @staticmethod
+    def summarize(results, costs, distinct, elapsed):
+        """Reports answered and failed items, throughput, tokens and cost per model."""
+        by_model = {}
+        for record in costs:
+            for attempt in record["attempts"]:
+                model = by_model.setdefault(attempt["model"], {"calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0})
+                model["calls"] += 1
+                model["input_tokens"] += attempt["input_tokens"]
+                model["cached_input_tokens"] += attempt.get("cached_input_tokens", 0)
+                model["output_tokens"] += attempt["output_tokens"]
+        answered = sum(1 for result in results if result["status"] == 200)
+        return {
+            "items": len(results),
+            "distinct_queries": distinct,
+            "deduplicated": len(results) - distinct,
+            "answered": answered,
+            "failed": len(results) - answered,
+            "elapsed_s": round(elapsed, 3),
+            "items_per_s": round(len(results) / elapsed, 2) if elapsed else 0.0,
+            "total_cost": round(sum(record["total_tokens_cost"] for record in costs), 6),
+            "by_model": by_model,
+        }
+
+class BatchCheckpoint:
+    """Results and cost records of a batch job as JSONL files, appended as queries complete.
+
+    Items already answered with status 200 are skipped when the job is run again; failed
+    items are retried and appended again, so the last line of an id holds its result.
+    """
+
+    def __init__(self, results_path, costs_path):
+        self.results_path = results_path
+        self.costs_path = costs_path
+
+    def completed_ids(self):
+        completed = set()
+        if not os.path.exists(self.results_path):
+            return completed
+        with open(self.results_path, encoding="utf-8") as results_file:
+            for line in results_file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run
+                    continue
+                if result.get("status") == 200:
+                    completed.add(str(result["id"]))
+        return completed
+
+    def open(self):
+        self.results_file = open(self.results_path, "a+", encoding="utf-8")
+        if self.results_file.tell():
+            self.results_file.seek(self.results_file.tell() - 1)
+            if self.results_file.read(1) != "\n":
+                # Terminate a line cut short by an interrupted run
+                self.results_file.write("\n")
+        self.costs_file = open(self.costs_path, "a", encoding="utf-8")
+
+    async def write(self, results, cost_record):
+        self.results_file.writelines(json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+        self.results_file.flush()
+        if cost_record:
+            self.costs_file.write(json.dumps(cost_record, ensure_ascii=False) + "\n")
+            self.costs_file.flush()
+
+    def close(self):
+        self.results_file.close()
+        self.costs_file.close()
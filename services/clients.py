@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import threading
+from collections import Counter
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+import aiohttp
+from azure.core.pipeline.transport import RequestsTransport, AioHttpTransport
+from config.config import Config
+from services.metrics import get_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ClientRegistry:
+    """Process-wide registry of long-lived, thread-safe Azure service clients."""
+
+    def __init__(self):
+        try:
+            # Set parameters
+            config = Config().config
+            clients_config = config.get("clients", {})
+            self.max_connections = clients_config.get("max_connections", 100)
+            self.max_keepalive_connections = clients_config.get("max_keepalive_connections", 20)
+            self.keepalive_expiry = clients_config.get("keepalive_expiry", 30)
+            self.connection_timeout = clients_config.get("connection_timeout", 10)
+            self.read_timeout = clients_config.get("read_timeout", 120)
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._async_clients = {}
+        self._async_overrides = {}
+        self.created = Counter()
+        self.reused = Counter()
+
+    def get(self, name, factory):
+        """Returns the client registered under `name`, creating it once with `factory` if needed."""
+        client = self._clients.get(name)
+        if client is not None:
+            with self._lock:
+                self.reused[name] += 1
+            return client
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                with get_metrics().span("client_create", client=name):
+                    client = factory()
+                self._clients[name] = client
+                self.created[name] += 1
+                logger.info(f"Client '{name}' created and registered.")
+            else:
+                self.reused[name] += 1
+            return client
+
+    def set(self, name, client):
+        """Registers an already built client under `name`, replacing any previous one."""
+        with self._lock:
+            self._clients[name] = client
+
+    def get_async(self, name, factory):
+        """Returns the async client registered under `name` for the running event loop.
+
+        Async clients own loop-bound connection pools, so one instance is kept per event loop;
+        the clients of loops that have been closed are dropped when a new loop registers.
+        """
+        override = self._async_overrides.get(name)
+        if override is not None:
+            return override
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_clients:
+                self.drop_closed_loops()
+            loop_clients = self._async_clients.setdefault(loop, {})
+            client = loop_clients.get(name)
+            if client is None:
+                with get_metrics().span("client_create", client=f"{name}_async"):
+                    client = factory()
+                loop_clients[name] = client
+                self.created[f"{name}_async"] += 1
+                logger.info(f"Async client '{name}' created and registered.")
+            else:
+                self.reused[f"{name}_async"] += 1
+            return client
+
+    def drop_closed_loops(self):
+        """Forgets the async clients of closed event loops; their pools cannot be used or closed any more."""
+        for loop in [loop for loop in self._async_clients if loop.is_closed()]:
+            names = list(self._async_clients.pop(loop))
+            logger.info(f"Dropped async clients {names} of a closed event loop.")
+
+    def set_async(self, name, client):
+        """Registers an async client under `name` for every event loop."""
+        with self._lock:
+            self._async_overrides[name] = client
+
+    def http_client(self):
+        """Returns an httpx client with a bounded, keep-alive connection pool."""
+        return httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connection_timeout),
+        )
+
+    def azure_transport(self):
+        """Returns an azure-core transport backed by a pooled requests session."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_keepalive_connections, pool_maxsize=self.max_connections)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return RequestsTransport(
+            session=session,
+            session_owner=False,
+            connection_timeout=self.connection_timeout,
+            read_timeout=self.read_timeout,
+        )
+
+    def async_http_client(self):
+        """Returns an async httpx client with a bounded, keep-alive connection pool."""
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connection_timeout),
+        )
+
+    def async_azure_transport(self):
+        """Returns an azure-core async transport backed by a pooled aiohttp session."""
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_expiry)
+        session = aiohttp.ClientSession(connector=connector)
+        return AioHttpTransport(
+            session=session,
+            session_owner=True,
+            connection_timeout=self.connection_timeout,
+            read_timeout=self.read_timeout,
+        )
+
+    def stats(self):
+        """Returns how many times each client was created and reused."""
+        return {"created": dict(self.created), "reused": dict(self.reused)}
+
+    def close(self):
+        """Closes every registered client that supports it."""
+        with self._lock:
+            for name, client in self._clients.items():
+                try:
+                    if hasattr(client, "close"):
+                        client.close()
+                except Exception as e:
+                    logger.warning(f"Error closing client '{name}': {e}")
+            self._clients.clear()
+
+    async def close_async(self):
+        """Closes the async clients bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.pop(loop, {})
+        for name, client in loop_clients.items():
+            try:
+                if hasattr(client, "close"):
+                    await client.close()
+            except Exception as e:
+                logger.warning(f"Error closing async client '{name}': {e}")
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_client_registry():
+    """Returns the process-wide client registry."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ClientRegistry()
+    return _registry
@@ -0,0 +1,164 @@
+import asyncio
+import contextlib
+import logging
+import time
+from functools import partial
+from config.config import Config
+from services.cache import LRUCache, normalize_query
+from services.metrics import get_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class RequestCoalescer:
+    """Attaches duplicate chat requests to the turn already running and runs the turns of a session in order.
+
+    A request is a duplicate when it has the same session and normalized query as a request
+    still in flight, whatever its idempotency key. Completed results are also kept under their
+    idempotency key for `idempotency_ttl_seconds`, so a retry after a lost response gets the
+    answer without a new turn. Different sessions run fully in parallel.
+    The registry is per process, so each serve.py worker coalesces its own requests.
+    """
+
+    def __init__(self):
+        try:
+            # Set parameters
+            config = Config().config
+            coalescing_config = config.get("coalescing", {})
+            self.enabled = coalescing_config.get("enabled", True)
+            self.serialize_sessions = coalescing_config.get("serialize_sessions", True)
+            self.completed = LRUCache(
+                coalescing_config.get("max_idempotency_keys", 10000),
+                coalescing_config.get("idempotency_ttl_seconds", 300)
+            )
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.in_flight = {}
+        self.sessions = {}
+        self.coalesced = 0
+
+    @staticmethod
+    def key(mode, session_id, query):
+        """Key of the turn in flight for a session and query."""
+        return (mode, session_id, normalize_query(query or ""))
+
+    @staticmethod
+    def result_key(mode, session_id, idempotency_key):
+        """Key of a completed result for an idempotency key, or None without one."""
+        return (mode, session_id, idempotency_key) if idempotency_key else None
+
+    def record(self, mode, source):
+        self.coalesced += 1
+        logger.info(f"Coalesced a duplicate {mode} chat request ({source}).")
+        get_metrics().inc("rag_chat_coalesced_total", mode=mode, source=source)
+
+    @contextlib.asynccontextmanager
+    async def session_turn(self, session_id):
+        """Holds the lock of the session; waiting turns get it in arrival order."""
+        if not self.serialize_sessions:
+            yield
+            return
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            entry = self.sessions[session_id] = {"lock": asyncio.Lock(), "users": 0}
+        entry["users"] += 1
+        started = time.perf_counter()
+        try:
+            async with entry["lock"]:
+                get_metrics().observe("rag_session_queue_seconds", time.perf_counter() - started)
+                yield
+        finally:
+            entry["users"] -= 1
+            if not entry["users"]:
+                # Idle sessions hold no lock
+                self.sessions.pop(session_id, None)
+
+    async def run_turn(self, session_id, compute):
+        async with self.session_turn(session_id):
+            return await compute()
+
+    def keep(self, result_key, result):
+        if result_key is not None and result[1] == 200:
+            self.completed.set(result_key, result)
+
+    def finish(self, key, result_key, task):
+        self.in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.keep(result_key, task.result())
+
+    async def run(self, session_id, query, compute, idempotency_key=None):
+        """Returns the (payload, status) of `compute()`, shared with the duplicates of the request.
+
+        The turn runs in its own task, so a caller that goes away does not cancel it for the others.
+        """
+        if not self.enabled:
+            return await compute()
+        key = self.key("sync", session_id, query)
+        result_key = self.result_key("sync", session_id, idempotency_key)
+        if result_key is not None:
+            completed = self.completed.get(result_key)
+            if completed is not None:
+                self.record("sync", "idempotency_key")
+                return completed
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.record("sync", "in_flight")
+            result = await asyncio.shield(task)
+            # The duplicate may carry its own key; a retry with it gets the same answer
+            self.keep(result_key, result)
+            return result
+        task = asyncio.ensure_future(self.run_turn(session_id, compute))
+        self.in_flight[key] = task
+        task.add_done_callback(partial(self.finish, key, result_key))
+        return await asyncio.shield(task)
+
+    async def stream(self, session_id, query, produce, idempotency_key=None):
+        """Yields the (event, data) pairs of `produce()`; duplicates get the whole answer once it is ready."""
+        if not self.enabled:
+            async for item in produce():
+                yield item
+            return
+        key = self.key("stream", session_id, query)
+        result_key = self.result_key("stream", session_id, idempotency_key)
+        final = self.completed.get(result_key) if result_key is not None else None
+        if final is not None:
+            self.record("stream", "idempotency_key")
+        elif key in self.in_flight:
+            self.record("stream", "in_flight")
+            final = await asyncio.shield(self.in_flight[key])
+            if result_key is not None and final[0] == "done":
+                self.completed.set(result_key, final)
+        if final is not None:
+            event, payload = final
+            if event == "done" and isinstance(payload.get("response"), str):
+                yield "delta", {"text": payload["response"]}
+            yield event, payload
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        final = ("error", {"error": "The original request ended before its answer was complete."})
+        try:
+            async with self.session_turn(session_id):
+                async for event, payload in produce():
+                    if event != "delta":
+                        final = (event, payload)
+                    yield event, payload
+        finally:
+            self.in_flight.pop(key, None)
+            future.set_result(final)
+            if result_key is not None and final[0] == "done":
+                self.completed.set(result_key, final)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self.in_flight),
+            "active_sessions": len(self.sessions),
+            "coalesced": self.coalesced,
+            "idempotency_keys": len(self.completed),
+        }
@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import re
+from config.config import Config
+from services.tokens import count_tokens, get_encoding
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def shingles(text, size):
+    """Returns the hashed word n-grams of a text, used to compare chunks for near-duplicates."""
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {hash(" ".join(words))} if words else set()
+    return {hash(" ".join(words[start:start + size])) for start in range(len(words) - size + 1)}
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+class ContextPacker:
+    """Class to assemble the retrieved chunks sent to the model as CONTEXT.
+
+    Chunks are ordered by search score; exact and near-duplicate chunks (word shingle
+    Jaccard similarity at or above `dedup_threshold`) are dropped, and the rest are packed
+    into `max_tokens` tokens as a numbered list.
+    """
+
+    def __init__(self):
+        try:
+            # Set parameters
+            config = Config().config
+            context_config = config["model"].get("context", {})
+            self.enabled = context_config.get("enabled", True)
+            self.max_tokens = context_config.get("max_tokens", 3000)
+            self.dedup_threshold = context_config.get("dedup_threshold", 0.8)
+            self.shingle_size = context_config.get("shingle_size", 5)
+            self.tokenizer_model = context_config.get("tokenizer_model", config["model"]["deployments"]["gpt-4o"]["name"])
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+
+    @staticmethod
+    def format(chunks):
+        return "\n\n".join(f"[{position}] {chunk}" for position, chunk in enumerate(chunks, 1))
+
+    def deduplicate(self, results):
+        """Returns the results without exact or near-duplicate chunks, keeping the best scored."""
+        kept, kept_shingles, digests = [], [], set()
+        for result in results:
+            text = " ".join(result["content"].split())
+            digest = hashlib.sha1(text.lower().encode("utf-8")).digest()
+            if not text or digest in digests:
+                continue
+            chunk_shingles = shingles(text, self.shingle_size)
+            if any(jaccard(chunk_shingles, other) >= self.dedup_threshold for other in kept_shingles):
+                continue
+            digests.add(digest)
+            kept_shingles.append(chunk_shingles)
+            kept.append(text)
+        return kept
+
+    def truncate(self, text, max_tokens):
+        encoding = get_encoding(self.tokenizer_model)
+        if encoding is not None:
+            return encoding.decode(encoding.encode(text)[:max_tokens])
+        return text[:max_tokens * 4]
+
+    @staticmethod
+    def ranking_score(result):
+        """The score the results are ranked by: the fused score of multi-query retrieval, the semantic reranker score or the search score."""
+        for name in ("fused_score", "reranker_score", "score"):
+            if result.get(name) is not None:
+                return result[name]
+        return 0
+
+    def pack(self, results):
+        """Packs the search results ({"score", "content"}) into {"text", "chunks", "info"}.
+
+        "text" is the formatted context, "chunks" the chunks it holds and "info" the token
+        statistics against the unprocessed list of chunks.
+        """
+        raw = [result["content"] for result in results]
+        tokens_raw = count_tokens(str(raw), self.tokenizer_model)
+        if not self.enabled:
+            return {"text": str(raw), "chunks": raw, "info": {
+                "chunks_retrieved": len(results),
+                "chunks_sent": len(results),
+                "duplicates_removed": 0,
+                "tokens_raw": tokens_raw,
+                "tokens_sent": tokens_raw,
+                "tokens_saved": 0,
+            }}
+
+        ordered = sorted(results, key=self.ranking_score, reverse=True)
+        unique = self.deduplicate(ordered)
+
+        # Keep the best chunks that fit the budget; a first chunk larger than the budget is cut
+        packed, used = [], 0
+        for chunk in unique:
+            tokens = count_tokens(f"[{len(packed) + 1}] {chunk}\n\n", self.tokenizer_model)
+            if used + tokens <= self.max_tokens:
+                packed.append(chunk)
+                used += tokens
+            elif not packed:
+                packed.append(self.truncate(chunk, self.max_tokens - 8))
+                used = self.max_tokens
+        context = self.format(packed)
+        tokens_sent = count_tokens(context, self.tokenizer_model)
+        return {"text": context, "chunks": packed, "info": {
+            "chunks_retrieved": len(results),
+            "chunks_sent": len(packed),
+            "duplicates_removed": len(results) - len(unique),
+            "tokens_raw": tokens_raw,
+            "tokens_sent": tokens_sent,
+            "tokens_saved": max(tokens_raw - tokens_sent, 0),
+        }}
@@ -1,25 +1,61 @@
 import os
-import logging
 import asyncio
+import logging
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, exceptions, PartitionKey
-from dotenv import load_dotenv
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+from config.config import Config, load_environment
+from services.clients import get_client_registry
+from services.metrics import get_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Session documents written with one page document per `page_size` turns
+LAYOUT_VERSION = 2
+PATCH_OPERATIONS_LIMIT = 10
+
 class AzureCosmosDBClient:
-    """Class to interact with Azure Cosmos DB."""
+    """Class to interact with Azure Cosmos DB.
+
+    Each session is a small head document (id = session id) holding the turn counter and
+    the summary; turns are appended with patch operations to page documents with ids
+    '<session id>:<page>', so a turn costs O(turn) bytes whatever the session length.
+    Legacy documents keeping the whole list in one field are migrated on first write.
+
+    New containers are partitioned on `partition_key` ("/session_id"), so the head and
+    pages of a session share one logical partition. Containers created earlier keep
+    "/id", where each page is a partition of its own; their key path is read at startup
+    and both layouts work. Copy them with scripts/migrate_sessions.py to repartition.
+    """
 
     def __init__(self):
+        try:
+            # Set parameters
+            config = Config().config
+            cosmos_config = config.get("cosmos_db", {})
+            self.partition_key_path = cosmos_config.get("partition_key", "/session_id")
+            self.page_size = cosmos_config.get("page_size", 10)
+            self.max_retries = cosmos_config.get("max_retries", 5)
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
         env_vars = self.load_env_var()
-        self.client = self.create_cosmos_client(env_vars)
+        self.env_vars = env_vars
+        registry = get_client_registry()
+        self.client = registry.get(
+            "cosmos",
+            lambda: self.create_cosmos_client(env_vars, registry.azure_transport()),
+        )
         self.database = self.client.create_database_if_not_exists(id=env_vars["COSMOS_DB_DATABASE_NAME"])
+        self.partition_paths = {}
         self.container_history = self.get_container(self.database, env_vars["COSMOS_DB_CONTAINER_HISTORY"])
         self.container_evals = self.get_container(self.database, env_vars["COSMOS_DB_CONTAINER_EVALS"])
 
     @staticmethod
     def load_env_var():
-        load_dotenv()
+        load_environment()
         required_vars = [
             "COSMOS_DB_ENDPOINT",
             "COSMOS_DB_PRIMARY_KEY",
@@ -35,40 +71,274 @@ class AzureCosmosDBClient:
         return env_vars
 
     @staticmethod
-    def create_cosmos_client(env_vars):
+    def create_cosmos_client(env_vars, transport=None):
         try:
+            client_kwargs = {}
+            if transport is not None:
+                client_kwargs["transport"] = transport
             return CosmosClient(
                 url=env_vars["COSMOS_DB_ENDPOINT"],
                 credential=env_vars["COSMOS_DB_PRIMARY_KEY"],
+                **client_kwargs,
             )
         except Exception as e:
             logger.error(f"Error creating Cosmos Client: {e}")
             raise
 
     @staticmethod
-    def get_container(database, container_name):
+    def create_async_cosmos_client(env_vars, transport=None):
+        try:
+            client_kwargs = {}
+            if transport is not None:
+                client_kwargs["transport"] = transport
+            return AsyncCosmosClient(
+                url=env_vars["COSMOS_DB_ENDPOINT"],
+                credential=env_vars["COSMOS_DB_PRIMARY_KEY"],
+                **client_kwargs,
+            )
+        except Exception as e:
+            logger.error(f"Error creating async Cosmos Client: {e}")
+            raise
+
+    async def get_async_container(self, container):
+        """Returns the async proxy of `container` on the pooled async client of the running loop."""
+        registry = get_client_registry()
+        client = registry.get_async(
+            "cosmos",
+            lambda: self.create_async_cosmos_client(self.env_vars, registry.async_azure_transport()),
+        )
+        database = client.get_database_client(self.env_vars["COSMOS_DB_DATABASE_NAME"])
+        return database.get_container_client(container.id)
+
+    async def ping_async(self):
+        """Reads the history container properties so the pooled async client holds an open connection."""
+        container = await self.get_async_container(self.container_history)
+        await container.read()
+
+    def get_container(self, database, container_name, partition_key_path=None):
+        """Returns the container, creating it with the configured partition key; records the key path it has."""
         try:
-            return database.create_container_if_not_exists(
+            container = database.create_container_if_not_exists(
                 id=container_name,
-                partition_key=PartitionKey(path='/id')
+                partition_key=PartitionKey(path=partition_key_path or self.partition_key_path)
             )
+            path = container.read()["partitionKey"]["paths"][0]
         except exceptions.CosmosHttpResponseError as e:
             logger.error(f"Failed to create container '{container_name}': {e}")
             raise
+        if path not in ("/id", "/session_id"):
+            raise ValueError(f"Container '{container_name}' is partitioned on '{path}'; expected '/session_id' or '/id'.")
+        if path != self.partition_key_path:
+            logger.warning(f"Container '{container_name}' is partitioned on '{path}' instead of '{self.partition_key_path}'.")
+        self.partition_paths[container_name] = path
+        return container
+
+    def partition_key(self, container, session_id, item_id):
+        """Returns the partition key value of a session document in `container`."""
+        return session_id if self.partition_paths.get(container.id) == "/session_id" else item_id
+
+    @staticmethod
+    def page_id(session_id, page):
+        return f"{session_id}:{page}"
+
+    @staticmethod
+    def split_entries(items):
+        """Groups a legacy flat list into turns: chat messages by user message, anything else one per item."""
+        entries = []
+        for item in items or []:
+            if not entries or not isinstance(item, dict) or item.get("role", "user") == "user":
+                entries.append({"turn": len(entries) + 1, "items": [item]})
+            else:
+                entries[-1]["items"].append(item)
+        return entries
+
+    async def create_head_async(self, async_container, session_id):
+        """Creates the head document of a new session, tolerating a concurrent creation."""
+        try:
+            await async_container.create_item({"id": session_id, "session_id": session_id, "layout": LAYOUT_VERSION, "turns": 0, "page_size": self.page_size})
+        except exceptions.CosmosResourceExistsError:
+            pass
+
+    async def migrate_session_async(self, container, session_id, field):
+        """Moves a legacy session document to the paged layout; returns True if it was migrated.
+
+        The head is replaced only if its ETag is unchanged, so a concurrent legacy writer
+        makes the migration start over instead of losing its update.
+        """
+        with get_metrics().span("cosmos_write", operation="migrate"):
+            return await self._migrate_session_async(container, session_id, field)
+
+    async def _migrate_session_async(self, container, session_id, field):
+        async_container = await self.get_async_container(container)
+        for _ in range(self.max_retries):
+            try:
+                head = await async_container.read_item(item=session_id, partition_key=session_id)
+            except exceptions.CosmosResourceNotFoundError:
+                return False
+            if head.get("layout") == LAYOUT_VERSION:
+                return False
+            entries = self.split_entries(head.get(field, []))
+            pages = {}
+            for entry in entries:
+                pages.setdefault((entry["turn"] - 1) // self.page_size, []).append(entry)
+            # Page ids are deterministic, so pages left over by an interrupted migration are overwritten
+            await asyncio.gather(*(
+                async_container.upsert_item({"id": self.page_id(session_id, page), "session_id": session_id, "page": page, "entries": page_entries})
+                for page, page_entries in pages.items()
+            ))
+            new_head = {key: value for key, value in head.items() if not key.startswith("_") and key != field}
+            new_head.update({"session_id": session_id, "layout": LAYOUT_VERSION, "turns": len(entries), "page_size": self.page_size})
+            try:
+                await async_container.replace_item(
+                    item=session_id,
+                    body=new_head,
+                    etag=head["_etag"],
+                    match_condition=MatchConditions.IfNotModified
+                )
+                logger.info(f"Session '{session_id}' migrated to the paged layout ({len(entries)} turns).")
+                return True
+            except exceptions.CosmosAccessConditionFailedError:
+                logger.info(f"Session '{session_id}' changed during migration, retrying.")
+        raise RuntimeError(f"Could not migrate session '{session_id}' after {self.max_retries} attempts.")
+
+    async def migrate_container_async(self, container, field):
+        """Migrates every legacy session document of `container`; returns the number migrated."""
+        async_container = await self.get_async_container(container)
+        query = "SELECT c.id FROM c WHERE NOT IS_DEFINED(c.layout) AND NOT IS_DEFINED(c.session_id)"
+        session_ids = [item["id"] async for item in async_container.query_items(query=query)]
+        migrated = 0
+        for session_id in session_ids:
+            migrated += await self.migrate_session_async(container, session_id, field)
+        return migrated
+
+    async def copy_container_async(self, container, target_name):
+        """Copies every document of `container` to `target_name`, partitioned on /session_id; returns the number copied.
+
+        Cosmos DB cannot change the partition key of a container, so an /id container is
+        repartitioned by copying it and pointing the COSMOS_DB_CONTAINER_* variable at the
+        copy. Documents are upserted, so the copy can be re-run to catch up.
+        """
+        target = self.get_container(self.database, target_name, "/session_id")
+        async_container = await self.get_async_container(container)
+        async_target = await self.get_async_container(target)
+        copied = 0
+        async for item in async_container.query_items(query="SELECT * FROM c"):
+            document = {key: value for key, value in item.items() if not key.startswith("_")}
+            # Heads and legacy documents are keyed by the session id itself
+            document.setdefault("session_id", document["id"])
+            await async_target.upsert_item(document)
+            copied += 1
+        return copied
+
+    async def append_page_async(self, async_container, session_id, page, entries):
+        """Appends entries to one page document, creating it if needed."""
+        page_id = self.page_id(session_id, page)
+        # A patch request carries at most PATCH_OPERATIONS_LIMIT operations
+        for start in range(0, len(entries), PATCH_OPERATIONS_LIMIT):
+            chunk = entries[start:start + PATCH_OPERATIONS_LIMIT]
+            for _ in range(self.max_retries):
+                try:
+                    await async_container.patch_item(
+                        item=page_id,
+                        partition_key=self.partition_key(async_container, session_id, page_id),
+                        patch_operations=[{"op": "add", "path": "/entries/-", "value": entry} for entry in chunk]
+                    )
+                    break
+                except exceptions.CosmosResourceNotFoundError:
+                    try:
+                        await async_container.create_item({"id": page_id, "session_id": session_id, "page": page, "entries": chunk})
+                        break
+                    except exceptions.CosmosResourceExistsError:
+                        pass
+            else:
+                raise RuntimeError(f"Could not append to page '{page_id}' after {self.max_retries} attempts.")
+
+    async def append_many_async(self, container, session_id, turns, field):
+        """Appends several turns of items to the session; returns the number of the first one.
+
+        Turn numbers come from an atomic increment on the head, so concurrent writers to
+        the same session get distinct slots and never overwrite each other.
+        """
+        with get_metrics().span("cosmos_write", operation="append"):
+            return await self._append_many_async(container, session_id, turns, field)
+
+    async def _append_many_async(self, container, session_id, turns, field):
+        async_container = await self.get_async_container(container)
+        for _ in range(self.max_retries):
+            try:
+                head = await async_container.patch_item(
+                    item=session_id,
+                    partition_key=session_id,
+                    patch_operations=[{"op": "incr", "path": "/turns", "value": len(turns)}],
+                    filter_predicate=f"FROM c WHERE c.layout = {LAYOUT_VERSION}"
+                )
+                break
+            except exceptions.CosmosResourceNotFoundError:
+                await self.create_head_async(async_container, session_id)
+            except exceptions.CosmosAccessConditionFailedError:
+                await self.migrate_session_async(container, session_id, field)
+        else:
+            raise RuntimeError(f"Could not append to session '{session_id}' after {self.max_retries} attempts.")
+
+        first = head["turns"] - len(turns) + 1
+        pages = {}
+        for turn, items in enumerate(turns, start=first):
+            pages.setdefault((turn - 1) // head["page_size"], []).append({"turn": turn, "items": items})
+        await asyncio.gather(*(
+            self.append_page_async(async_container, session_id, page, entries) for page, entries in pages.items()
+        ))
+        return first
+
+    async def append_async(self, container, session_id, items, field):
+        """Appends one turn of items to the session; returns its turn number."""
+        return await self.append_many_async(container, session_id, [items], field)
+
+    async def read_recent_async(self, container, session_id, field, last_turns=None):
+        """Returns the session head and the entries of its last `last_turns` turns (all if None).
+
+        Only the pages holding those turns are read, concurrently, by point reads.
+        """
+        with get_metrics().span("cosmos_read", operation="read_recent"):
+            return await self._read_recent_async(container, session_id, field, last_turns)
+
+    async def _read_recent_async(self, container, session_id, field, last_turns=None):
+        async_container = await self.get_async_container(container)
+        try:
+            head = await async_container.read_item(item=session_id, partition_key=session_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None, []
+        if head.get("layout") != LAYOUT_VERSION:
+            entries = self.split_entries(head.get(field, []))
+            head["turns"] = len(entries)
+            return head, entries[-last_turns:] if last_turns else entries
+
+        turns = head["turns"]
+        if not turns:
+            return head, []
+        first = max(turns - last_turns, 0) if last_turns else 0
+        page_size = head["page_size"]
+
+        async def read_page(page):
+            page_id = self.page_id(session_id, page)
+            try:
+                return await async_container.read_item(item=page_id, partition_key=self.partition_key(async_container, session_id, page_id))
+            except exceptions.CosmosResourceNotFoundError:
+                # The turn counter is incremented before its page is written
+                return {"entries": []}
+
+        pages = await asyncio.gather(*(read_page(page) for page in range(first // page_size, (turns - 1) // page_size + 1)))
+        entries = sorted(
+            (entry for page in pages for entry in page["entries"] if entry["turn"] > first),
+            key=lambda entry: entry["turn"]
+        )
+        return head, entries
 
     async def insert_items_async(self, container, session_id, items, field):
         """Asynchronous insertion of chat history or evaluations into Cosmos DB."""
         try:
-            item = container.read_item(item=session_id, partition_key=session_id)
-            if field not in item:
-                item[field] = []
-            item[field].extend(items)
-        except exceptions.CosmosResourceNotFoundError:
-            item = {"id": session_id, field: items}
+            await self.append_async(container, session_id, items, field)
         except exceptions.CosmosHttpResponseError as e:
-            logger.error(f"Failed to upsert items for session ID '{session_id}': {e}")
-            return
-        await asyncio.to_thread(container.upsert_item, item)
+            logger.error(f"Failed to insert items for session ID '{session_id}': {e}")
 
     async def insert_evals_async(self, session_id, evals_data):
         """Insert evaluations data asynchronously into the evals container."""
@@ -80,11 +350,37 @@ class AzureCosmosDBClient:
 
     async def get_chat_history_async(self, session_id):
         """Retrieve chat history asynchronously from the Cosmos DB container."""
+        session = await self.get_session_async(session_id)
+        return session["chat_history"]
+
+    async def get_session_async(self, session_id, last_turns=None):
+        """Retrieve the last `last_turns` turns of chat history and the stored summary asynchronously.
+
+        `offset` is the number of earlier turns that were not read.
+        """
         try:
-            item = await asyncio.to_thread(self.container_history.read_item, item=session_id, partition_key=session_id)
-            return item.get('chat_history', [])
-        except exceptions.CosmosResourceNotFoundError:
-            return []
+            head, entries = await self.read_recent_async(self.container_history, session_id, "chat_history", last_turns)
         except exceptions.CosmosHttpResponseError as e:
             logger.error(f"Error retrieving chat history for session ID '{session_id}': {e}")
-            return []
+            head, entries = None, []
+        if head is None:
+            return {"chat_history": [], "summary": None, "turns": 0, "offset": 0}
+        return {
+            "chat_history": [item for entry in entries for item in entry["items"]],
+            "summary": head.get("summary"),
+            "turns": head["turns"],
+            "offset": entries[0]["turn"] - 1 if entries else head["turns"],
+        }
+
+    async def save_summary_async(self, session_id, summary):
+        """Store the rolling summary of older turns with the session, without rewriting its history."""
+        try:
+            async_container = await self.get_async_container(self.container_history)
+            with get_metrics().span("cosmos_write", operation="save_summary"):
+                await async_container.patch_item(
+                    item=session_id,
+                    partition_key=session_id,
+                    patch_operations=[{"op": "set", "path": "/summary", "value": summary}]
+                )
+        except exceptions.CosmosHttpResponseError as e:
+            logger.error(f"Failed to save summary for session ID '{session_id}': {e}")
\ No newline at end of file
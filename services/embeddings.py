@@ -0,0 +1,408 @@
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+from config.config import Config
+from services.azopenai import AzureOpenAIClient
+from services.cache import LRUCache, normalize_query
+from services.metrics import get_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+class EmbeddingAbandonedError(Exception):
+    """The request embedding a text was cancelled before the call answered."""
+
+class AzureEmbeddingClient:
+    """Class to compute text embeddings with an Azure OpenAI embedding deployment."""
+
+    def __init__(self):
+        try:
+            # Set parameters
+            config = Config().config
+            embedding = config["model"]["embedding"]
+            self.deployment = embedding["deployment"]
+            self.dimensions = embedding.get("dimensions")
+            self.batch_size = embedding.get("batch_size", 16)
+            self.azureopenai = AzureOpenAIClient()
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.tokens_used = 0
+
+    def embedding_params(self, texts):
+        params = {"model": self.deployment, "input": texts}
+        if self.dimensions:
+            params["dimensions"] = self.dimensions
+        return params
+
+    def create_embeddings(self, texts):
+        """Returns `create(client, deployment, timeout)` embedding `texts` on a backend deployment."""
+        return lambda client, deployment, timeout: client.embeddings.create(
+            **dict(self.embedding_params(texts), model=deployment), **self.azureopenai.timeout_kwargs(timeout)
+        )
+
+    def embedding_tokens(self, texts):
+        # Rough quota estimate for the rate limiter: about four characters per token
+        return lambda: sum(len(text) for text in texts) // 4 + 1
+
+    def record_usage(self, response):
+        """Counts the tokens of one embedding response and returns them."""
+        tokens = response.usage.total_tokens if response.usage else 0
+        self.tokens_used += tokens
+        get_metrics().inc("rag_embedding_tokens_total", tokens, deployment=self.deployment)
+        return tokens
+
+    def embed_with_usage(self, texts):
+        """Returns one embedding per text, sending them in batches, and the tokens these calls used."""
+        try:
+            vectors = []
+            tokens = 0
+            for start in range(0, len(texts), self.batch_size):
+                batch = texts[start:start + self.batch_size]
+                with get_metrics().span("embedding", deployment=self.deployment):
+                    response = self.azureopenai.call_model(self.deployment, self.create_embeddings(batch), self.embedding_tokens(batch))
+                vectors.extend(item.embedding for item in response.data)
+                tokens += self.record_usage(response)
+            return vectors, tokens
+        except Exception as e:
+            logger.error(f"Error getting embeddings from Azure OpenAI: {e}")
+            raise
+
+    async def embed_with_usage_async(self, texts):
+        """Returns one embedding per text and the tokens these calls used, without blocking the event loop.
+
+        The usage is per call, so concurrent callers do not see each other's tokens.
+        """
+        try:
+            vectors = []
+            tokens = 0
+            for start in range(0, len(texts), self.batch_size):
+                batch = texts[start:start + self.batch_size]
+                with get_metrics().span("embedding", deployment=self.deployment):
+                    response = await self.azureopenai.call_model_async(self.deployment, self.create_embeddings(batch), self.embedding_tokens(batch))
+                vectors.extend(item.embedding for item in response.data)
+                tokens += self.record_usage(response)
+            return vectors, tokens
+        except Exception as e:
+            logger.error(f"Error getting embeddings from Azure OpenAI: {e}")
+            raise
+
+    def embed(self, texts):
+        """Returns one embedding per text, sending them in batches."""
+        return self.embed_with_usage(texts)[0]
+
+    async def embed_async(self, texts):
+        """Returns one embedding per text without blocking the event loop."""
+        return (await self.embed_with_usage_async(texts))[0]
+
+class HashingEmbedder:
+    """Deterministic, offline embedder based on feature hashing of word unigrams and bigrams.
+
+    It captures lexical overlap only, which is enough for tests, benchmarks and air-gapped runs.
+    """
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def embed_one(self, text):
+        vector = [0.0] * self.dimensions
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[index] += sign
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed(self, texts):
+        return [self.embed_one(text) for text in texts]
+
+    async def embed_async(self, texts):
+        return self.embed(texts)
+
+class EmbeddingCache:
+    """Bounded cache of embeddings keyed by (model, dimensions, normalized text).
+
+    Vectors are kept as float32 arrays, or with `storage: int8` as int8 with one scale per
+    vector (a quarter of the size; cosine error well under 1e-3). With `disk_path`, entries
+    are also written to a SQLite file that outlives restarts and is shared by the workers,
+    pruned to `max_disk_entries` by last use.
+    """
+
+    def __init__(self, model=None, dimensions=None):
+        try:
+            # Set parameters
+            config = Config().config
+            embedding = config["model"]["embedding"]
+            cache_config = embedding.get("cache", {})
+            self.enabled = cache_config.get("enabled", True)
+            self.model = model or embedding["deployment"]
+            self.dimensions = dimensions or embedding.get("dimensions")
+            self.storage = cache_config.get("storage", "float32")
+            if self.storage not in ("float32", "int8"):
+                raise ValueError(f"Unknown embedding storage: {self.storage}")
+            self.memory = LRUCache(cache_config.get("max_entries", 10000))
+            self.disk_path = cache_config.get("disk_path", "")
+            self.max_disk_entries = cache_config.get("max_disk_entries", 100000)
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.disk = None
+        self._disk_lock = threading.Lock()
+        self._disk_writes = 0
+        if self.enabled and self.disk_path:
+            self.open_disk()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def open_disk(self):
+        self.disk = sqlite3.connect(self.disk_path, check_same_thread=False, isolation_level=None)
+        # Several workers may read and write the file at once
+        self.disk.execute("PRAGMA journal_mode=WAL")
+        self.disk.execute("PRAGMA busy_timeout=5000")
+        self.disk.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, scale REAL, used REAL)"
+        )
+
+    def key(self, normalized_text):
+        return f"{self.model}:{self.dimensions or ''}:{normalized_text}"
+
+    def encode(self, vector):
+        """Returns the compact (array, scale) form of a vector; scale is None for float32."""
+        array = np.asarray(vector, dtype=np.float32)
+        if self.storage == "float32":
+            return array, None
+        peak = float(np.max(np.abs(array))) if array.size else 0.0
+        scale = peak / 127 if peak else 1.0
+        return np.round(array / scale).astype(np.int8), scale
+
+    @staticmethod
+    def decode(entry):
+        array, scale = entry
+        if scale is None:
+            return array.tolist()
+        return (array.astype(np.float32) * np.float32(scale)).tolist()
+
+    def get(self, keys):
+        """Returns the vectors of `keys` found in memory, by key."""
+        found = {}
+        for key in keys:
+            entry = self.memory.get(key)
+            if entry is not None:
+                found[key] = self.decode(entry)
+        self.memory_hits += len(found)
+        return found
+
+    def get_disk(self, keys):
+        """Returns the vectors of `keys` found on disk, by key, and promotes them to memory."""
+        if self.disk is None or not keys:
+            return {}
+        with self._disk_lock:
+            rows = self.disk.execute(
+                f"SELECT key, vector, scale FROM embeddings WHERE key IN ({','.join('?' * len(keys))})", list(keys)
+            ).fetchall()
+            if rows:
+                self.disk.executemany("UPDATE embeddings SET used = ? WHERE key = ?", [(time.time(), row[0]) for row in rows])
+        found = {}
+        for key, blob, scale in rows:
+            entry = (np.frombuffer(blob, dtype=np.float32 if scale is None else np.int8), scale)
+            self.memory.set(key, entry)
+            found[key] = self.decode(entry)
+        self.disk_hits += len(found)
+        return found
+
+    def put(self, vectors):
+        """Stores {key: vector} in memory; returns the compact entries for `put_disk`."""
+        entries = {key: self.encode(vector) for key, vector in vectors.items()}
+        for key, entry in entries.items():
+            self.memory.set(key, entry)
+        return entries
+
+    def put_disk(self, entries):
+        if self.disk is None or not entries:
+            return
+        now = time.time()
+        with self._disk_lock:
+            self.disk.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, scale, used) VALUES (?, ?, ?, ?)",
+                [(key, array.tobytes(), scale, now) for key, (array, scale) in entries.items()]
+            )
+            self._disk_writes += len(entries)
+            if self._disk_writes >= 1000:
+                self._disk_writes = 0
+                self.disk.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+
+    def entry_bytes(self):
+        """Bytes of one stored vector."""
+        return (self.dimensions or 0) * (1 if self.storage == "int8" else 4)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "storage": self.storage,
+            "entries": len(self.memory),
+            "entry_bytes": self.entry_bytes(),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+class CachedEmbeddingClient:
+    """Embeds texts through `embedder`, reusing the vectors `cache` keeps by normalized text.
+
+    The texts missing from the cache are embedded as written in one batched call; concurrent
+    requests for a text already being embedded wait for that call instead of sending their
+    own, and embed it themselves if the request that sent it is cancelled.
+    """
+
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+        self.in_flight = {}
+        self.embedding_calls = 0
+        self.embedding_seconds = 0.0
+
+    def record(self, started, hits, misses):
+        elapsed = time.perf_counter() - started
+        metrics = get_metrics()
+        metrics.observe("rag_query_embedding_seconds", elapsed)
+        if hits:
+            metrics.inc("rag_embedding_cache_requests_total", hits, outcome="hit")
+        if misses:
+            metrics.inc("rag_embedding_cache_requests_total", misses, outcome="miss")
+
+    async def embed_missing(self, keys, texts):
+        started = time.perf_counter()
+        vectors = await self.embedder.embed_async(texts)
+        self.embedding_calls += 1
+        self.embedding_seconds += time.perf_counter() - started
+        return dict(zip(keys, vectors))
+
+    def keys(self, texts):
+        """Returns the cache key of each text and the first text seen for each key."""
+        keys = [self.cache.key(normalize_query(text)) for text in texts]
+        texts_by_key = {}
+        for key, text in zip(keys, texts):
+            texts_by_key.setdefault(key, text)
+        return keys, texts_by_key
+
+    async def embed_async(self, texts):
+        """Returns one embedding per text; texts with the same normalized form share a vector."""
+        started = time.perf_counter()
+        keys, texts_by_key = self.keys(texts)
+        if not self.cache.enabled:
+            vectors = await self.embed_missing(list(texts_by_key), list(texts_by_key.values()))
+            return [vectors[key] for key in keys]
+        vectors = self.cache.get(texts_by_key)
+        hits = len(vectors)
+        missing = [key for key in texts_by_key if key not in vectors]
+        if missing and self.cache.disk is not None:
+            found = await asyncio.to_thread(self.cache.get_disk, missing)
+            vectors.update(found)
+            hits += len(found)
+            missing = [key for key in missing if key not in found]
+
+        waiting = {key: self.in_flight[key] for key in missing if key in self.in_flight}
+        own = [key for key in missing if key not in waiting]
+        self.cache.misses += len(own)
+        if own:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in own}
+            self.in_flight.update(futures)
+            try:
+                computed = await self.embed_missing(own, [texts_by_key[key] for key in own])
+            except asyncio.CancelledError:
+                # Hand the texts over to the requests waiting for them
+                for future in futures.values():
+                    future.set_exception(EmbeddingAbandonedError("The embedding request was cancelled."))
+                    future.exception()
+                raise
+            except Exception as e:
+                for future in futures.values():
+                    future.set_exception(e)
+                    # Mark the exception as retrieved when nobody else was waiting
+                    future.exception()
+                raise
+            finally:
+                for key in own:
+                    self.in_flight.pop(key, None)
+            for key, future in futures.items():
+                future.set_result(computed[key])
+            vectors.update(computed)
+            entries = self.cache.put(computed)
+            if self.cache.disk is not None:
+                await asyncio.to_thread(self.cache.put_disk, entries)
+        for key, future in waiting.items():
+            try:
+                vectors[key] = await asyncio.shield(future)
+            except EmbeddingAbandonedError:
+                # The first waiter sends the call again and the others wait for it
+                vectors[key] = (await self.embed_async([texts_by_key[key]]))[0]
+        self.record(started, hits + len(waiting), len(own))
+        return [vectors[key] for key in keys]
+
+    def embed(self, texts):
+        """Blocking variant of `embed_async`, without sharing calls in flight."""
+        started = time.perf_counter()
+        keys, texts_by_key = self.keys(texts)
+        vectors = self.cache.get(texts_by_key) if self.cache.enabled else {}
+        hits = len(vectors)
+        missing = [key for key in texts_by_key if key not in vectors]
+        if missing and self.cache.disk is not None:
+            found = self.cache.get_disk(missing)
+            vectors.update(found)
+            hits += len(found)
+            missing = [key for key in missing if key not in found]
+        if missing:
+            self.cache.misses += len(missing)
+            called = time.perf_counter()
+            computed = dict(zip(missing, self.embedder.embed([texts_by_key[key] for key in missing])))
+            self.embedding_calls += 1
+            self.embedding_seconds += time.perf_counter() - called
+            vectors.update(computed)
+            if self.cache.enabled:
+                self.cache.put_disk(self.cache.put(computed))
+        self.record(started, hits, len(missing))
+        return [vectors[key] for key in keys]
+
+    def stats(self):
+        return dict(
+            self.cache.stats(),
+            embedding_calls=self.embedding_calls,
+            embedding_latency_mean_s=round(self.embedding_seconds / self.embedding_calls, 6) if self.embedding_calls else 0.0,
+        )
+
+_query_embedder = None
+_query_embedder_lock = threading.Lock()
+
+def get_query_embedder():
+    """Returns the process-wide cached embedding client for queries, shared by search and the answer cache."""
+    global _query_embedder
+    if _query_embedder is None:
+        with _query_embedder_lock:
+            if _query_embedder is None:
+                _query_embedder = CachedEmbeddingClient(AzureEmbeddingClient(), EmbeddingCache())
+    return _query_embedder
+
+def query_embedder_stats():
+    """Returns the query embedding cache counters, or None while nothing has used the query embedder."""
+    return _query_embedder.stats() if _query_embedder is not None else None
@@ -0,0 +1,145 @@
+import logging
+from config.config import Config, get_settings
+from services.tokens import count_message_tokens
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ChatHistoryWindow:
+    """Class to fit the chat history sent to the model into a token budget.
+
+    The most recent turns are kept verbatim within `max_turns` and `max_tokens`; older turns
+    are replaced by a rolling summary stored with the session, produced by a small model.
+
+    With the "stable_prefix" layout (`model.prompt_caching`), the window start only moves
+    in steps of `history_step_turns` turns, so between steps the history sent is the previous
+    one plus the last turn and the provider's prompt cache keeps matching its prefix.
+    """
+
+    def __init__(self, azureopenai=None):
+        try:
+            # Set parameters
+            config = Config().config
+            history_config = config["model"].get("history", {})
+            self.enabled = history_config.get("enabled", True)
+            self.max_tokens = history_config.get("max_tokens", 3000)
+            self.max_turns = history_config.get("max_turns", 10)
+            self.tokenizer_model = history_config.get("tokenizer_model", config["model"]["deployments"]["gpt-4o"]["name"])
+            caching_config = config["model"].get("prompt_caching", {})
+            self.layout = caching_config.get("layout", "sliding")
+            if self.layout not in ("sliding", "stable_prefix"):
+                raise ValueError(f"Unknown prompt layout: {self.layout}")
+            self.step_turns = caching_config.get("history_step_turns", 5) if self.layout == "stable_prefix" else 1
+            if self.max_turns:
+                self.step_turns = max(1, min(self.step_turns, self.max_turns))
+            summary_config = history_config.get("summary", {})
+            self.summary_enabled = summary_config.get("enabled", False) and azureopenai is not None
+            self.summary_model = config["model"]["deployments"][summary_config.get("deployment", "gpt-4o-mini")]["name"]
+            self.summary_max_tokens = summary_config.get("max_tokens", 300)
+            self.summary_prompt = summary_config.get("prompt", "history_summary.prompt")
+            self.azureopenai = azureopenai
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+
+    @staticmethod
+    def split_turns(messages):
+        """Groups the flat message list into turns, each starting with a user message."""
+        turns = []
+        for message in messages or []:
+            if message.get("role") == "user" or not turns:
+                turns.append([message])
+            else:
+                turns[-1].append(message)
+        return turns
+
+    def align(self, turn):
+        """Rounds a window start up to the next step boundary."""
+        return -(-turn // self.step_turns) * self.step_turns
+
+    @staticmethod
+    def summary_message(summary):
+        return {"role": "system", "content": f"SUMMARY_OF_EARLIER_CONVERSATION:\n{summary['text']}"}
+
+    def apply(self, messages, summary=None, offset=0):
+        """Returns the messages to send, the number of turns left out, and token statistics.
+
+        `messages` holds the session turns after the first `offset` ones. `summary` is the
+        stored {"text", "turns"} summary covering the first `turns` turns; it is included
+        only if it covers every turn left out of the window.
+        """
+        full_tokens = count_message_tokens(messages, self.tokenizer_model) if messages else 0
+        turns = self.split_turns(messages)
+        if not self.enabled or not messages:
+            return messages or [], offset, {
+                "turns_full": offset + len(turns),
+                "turns_sent": len(turns),
+                "summarized": False,
+                "tokens_full": full_tokens,
+                "tokens_sent": full_tokens,
+                "tokens_saved": 0,
+            }
+
+        total = offset + len(turns)
+        older_count = self.align(max(total - self.max_turns, offset) if self.max_turns else offset)
+        kept = turns[older_count - offset:]
+
+        prefix = []
+        if summary and summary.get("text") and older_count and summary.get("turns", 0) >= older_count:
+            prefix = [self.summary_message(summary)]
+        budget = self.max_tokens - count_message_tokens(prefix, self.tokenizer_model) if prefix else self.max_tokens
+
+        # Drop the oldest kept turns, a step at a time, until the window fits the budget
+        kept_tokens = [count_message_tokens(turn, self.tokenizer_model) for turn in kept]
+        while kept and sum(kept_tokens) > budget:
+            dropped = self.align(older_count + 1) - older_count
+            del kept[:dropped]
+            del kept_tokens[:dropped]
+            older_count = min(older_count + dropped, total)
+            if prefix and summary.get("turns", 0) < older_count:
+                prefix = []
+                budget = self.max_tokens
+
+        window = prefix + [message for turn in kept for message in turn]
+        sent_tokens = count_message_tokens(window, self.tokenizer_model)
+        info = {
+            "turns_full": offset + len(turns),
+            "turns_sent": len(kept),
+            "summarized": bool(prefix),
+            "tokens_full": full_tokens,
+            "tokens_sent": sent_tokens,
+            "tokens_saved": max(full_tokens - sent_tokens, 0),
+        }
+        return window, older_count, info
+
+    def needs_summary(self, summary, older_count):
+        """Tells whether turns left out of the window are missing from the stored summary."""
+        if not self.summary_enabled or not older_count:
+            return False
+        return (summary or {}).get("turns", 0) < older_count
+
+    async def summarize(self, messages, summary, older_count, offset=0):
+        """Folds the turns left out of the window into the rolling summary and returns it."""
+        turns = self.split_turns(messages)
+        covered = (summary or {}).get("turns", 0)
+        if covered < offset:
+            logger.warning(f"Turns {covered + 1} to {offset} were not read and are left out of the summary.")
+        new_turns = turns[max(covered - offset, 0):older_count - offset]
+        if not new_turns:
+            return summary
+        system_prompt = get_settings().prompt(self.summary_prompt)
+        transcript = "\n".join(
+            f"{message['role'].upper()}: {message['content']}"
+            for turn in new_turns for message in turn
+        )
+        previous = (summary or {}).get("text", "")
+        user_input = f"PREVIOUS_SUMMARY:\n{previous}\n\nNEW_TURNS:\n{transcript}"
+        result = await self.azureopenai.complete_text_async(
+            self.summary_model,
+            [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_input}],
+            self.summary_max_tokens,
+        )
+        logger.info(f"Chat history summary updated to cover {older_count} turns.")
+        return {"text": result["response"], "turns": older_count, "model": result["model"]}
@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import numpy as np
+from config.config import Config
+from services.localsearch import DOCUMENTS_FILE, EMBEDDINGS_FILE, LocalSearchIndex
+from services.tokens import count_tokens, get_encoding
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def read_document(path):
+    """Returns the text of a .txt/.md file, or of a .pdf file when pdfplumber is installed."""
+    if path.lower().endswith(".pdf"):
+        try:
+            import pdfplumber
+        except ImportError as e:
+            logger.error("Ingesting PDF files requires the 'pdfplumber' package.")
+            raise ValueError("Ingesting PDF files requires the 'pdfplumber' package.") from e
+        with pdfplumber.open(path) as pdf:
+            return "\n".join(page.extract_text() or "" for page in pdf.pages)
+    with open(path, encoding="utf-8", errors="replace") as file:
+        return file.read()
+
+def iter_documents(directory, extensions):
+    """Yields (relative path, absolute path) of the files to ingest, in a stable order."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in extensions:
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, directory), path
+
+def chunk_text(text, chunk_size, overlap, model="gpt-4o"):
+    """Splits text into chunks of about `chunk_size` tokens, consecutive chunks sharing `overlap`."""
+    step = max(chunk_size - overlap, 1)
+    encoding = get_encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        return [encoding.decode(tokens[start:start + chunk_size]).strip() for start in range(0, max(len(tokens) - overlap, 1), step)]
+    # Without a tokenizer, cut on word boundaries at about four characters per token
+    words = text.split()
+    words_per_chunk = max(chunk_size * 3 // 4, 1)
+    words_step = max(step * 3 // 4, 1)
+    return [" ".join(words[start:start + words_per_chunk]) for start in range(0, max(len(words) - (words_per_chunk - words_step), 1), words_step)]
+
+def chunk_id(source, index):
+    """Builds a search document key (letters, digits, '_', '-' and '=' only) for a chunk."""
+    return f"{hashlib.sha1(source.encode('utf-8')).hexdigest()}_{index}"
+
+def content_hash(text, embedding_model):
+    """Hashes a chunk with the model that embeds it, so changing the model re-embeds every chunk."""
+    return hashlib.sha256(f"{embedding_model}:{text}".encode("utf-8")).hexdigest()
+
+class AzureSearchIndexWriter:
+    """Uploads and deletes chunks in the Azure AI Search index in batches."""
+
+    def __init__(self, azureaisearch, key_field, batch_size):
+        self.azureaisearch = azureaisearch
+        self.key_field = key_field
+        self.batch_size = batch_size
+
+    async def upload(self, documents):
+        client = await self.azureaisearch.get_async_client()
+        for start in range(0, len(documents), self.batch_size):
+            results = await client.upload_documents(documents=documents[start:start + self.batch_size])
+            failed = [result.key for result in results if not result.succeeded]
+            if failed:
+                raise RuntimeError(f"Failed to upload {len(failed)} chunks, first: {failed[0]}")
+
+    async def delete(self, keys):
+        client = await self.azureaisearch.get_async_client()
+        for start in range(0, len(keys), self.batch_size):
+            await client.delete_documents(documents=[{self.key_field: key} for key in keys[start:start + self.batch_size]])
+
+    async def close(self):
+        pass
+
+class LocalSearchIndexWriter:
+    """Merges uploaded and deleted chunks into a local search index, rewritten on close."""
+
+    def __init__(self, path, key_field, vector_field):
+        self.path = path
+        self.key_field = key_field
+        self.vector_field = vector_field
+        self.documents = {}
+        if os.path.exists(os.path.join(path, DOCUMENTS_FILE)):
+            matrix = np.load(os.path.join(path, EMBEDDINGS_FILE))
+            with open(os.path.join(path, DOCUMENTS_FILE)) as file:
+                for line, vector in zip(file, matrix):
+                    document = json.loads(line)
+                    self.documents[document[key_field]] = (document, vector)
+
+    async def upload(self, documents):
+        for document in documents:
+            document = dict(document)
+            vector = document.pop(self.vector_field)
+            self.documents[document[self.key_field]] = (document, vector)
+
+    async def delete(self, keys):
+        for key in keys:
+            self.documents.pop(key, None)
+
+    async def close(self):
+        documents = [document for document, _ in self.documents.values()]
+        vectors = [vector for _, vector in self.documents.values()]
+        await asyncio.to_thread(LocalSearchIndex.write, self.path, documents, vectors, {"key_field": self.key_field})
+
+class IngestionPipeline:
+    """Builds the search index from a directory of documents.
+
+    Documents are streamed file by file and chunked. Chunks whose content hash is in
+    the ingestion state are skipped. The rest are embedded in request-sized batches
+    by a bounded pool of workers and uploaded in groups of `upload_batch_size`. Chunks
+    of removed or shortened documents are deleted from the index, also on full runs.
+    """
+
+    def __init__(self, embedder, writer):
+        try:
+            # Set parameters
+            config = Config().config
+            ingestion_config = config.get("ingestion", {})
+            self.chunk_size = ingestion_config.get("chunk_size", 512)
+            self.chunk_overlap = ingestion_config.get("chunk_overlap", 64)
+            self.extensions = tuple(ingestion_config.get("extensions", [".txt", ".md", ".pdf"]))
+            self.max_batch_tokens = ingestion_config.get("max_batch_tokens", 100000)
+            self.workers = ingestion_config.get("workers", 4)
+            self.upload_batch_size = ingestion_config.get("upload_batch_size", 500)
+            self.state_path = ingestion_config.get("state_path", "data/ingestion_state.json")
+            self.key_field = ingestion_config.get("key_field", "chunk_id")
+            self.vector_field = config["ai_search"]["fields"]
+            self.batch_size = config["model"]["embedding"].get("batch_size", 16)
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.embedder = embedder
+        self.writer = writer
+        # One embedding request per batch: the embedder's own batch size is the request limit
+        self.batch_size = getattr(embedder, "batch_size", self.batch_size)
+        self.embedding_model = f"{getattr(embedder, 'deployment', type(embedder).__name__)}:{getattr(embedder, 'dimensions', None)}"
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as file:
+            return json.load(file)
+
+    def save_state(self, state):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        temporary = f"{self.state_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary, self.state_path)
+
+    async def embed(self, texts):
+        """Returns the vectors and the tokens this call used; None when the embedder does not report usage."""
+        if hasattr(self.embedder, "embed_with_usage_async"):
+            return await self.embedder.embed_with_usage_async(texts)
+        return await self.embedder.embed_async(texts), None
+
+    async def embed_and_upload(self, batch, state, stats):
+        vectors, tokens = await self.embed([chunk["chunk"] for chunk, _, _ in batch])
+        stats["embedding_tokens"] += sum(tokens for _, _, tokens in batch) if tokens is None else tokens
+        stats["embedding_requests"] += 1
+        stats["chunks_embedded"] += len(batch)
+        self.pending.extend((dict(chunk, **{self.vector_field: list(vector)}), digest) for (chunk, digest, _), vector in zip(batch, vectors))
+        if len(self.pending) >= self.upload_batch_size:
+            await self.upload(state)
+
+    async def upload(self, state, everything=False):
+        """Uploads the embedded chunks in groups of `upload_batch_size`; with `everything`, the last partial group too."""
+        async with self.upload_lock:
+            while self.pending and (everything or len(self.pending) >= self.upload_batch_size):
+                group = self.pending[:self.upload_batch_size]
+                del self.pending[:self.upload_batch_size]
+                await self.writer.upload([document for document, _ in group])
+                # Only uploaded chunks are recorded, so a failed group is embedded again next run
+                for document, digest in group:
+                    state[document[self.key_field]] = digest
+
+    async def run(self, directory, full=False):
+        """Ingests every document under `directory`; returns the throughput and cost report."""
+        started = time.perf_counter()
+        # A full run re-embeds everything but still needs the previous keys to delete stale chunks
+        previous = self.load_state()
+        state = {} if full else dict(previous)
+        seen = set()
+        self.pending = []
+        self.upload_lock = asyncio.Lock()
+        stats = {
+            "documents": 0, "chunks": 0, "chunks_embedded": 0, "chunks_skipped": 0, "chunks_deleted": 0,
+            "embedding_requests": 0, "embedding_tokens": 0,
+        }
+        workers = asyncio.Semaphore(self.workers)
+        tasks = set()
+        errors = []
+
+        async def submit(batch):
+            # Waiting for a free worker keeps at most `workers` batches in memory
+            await workers.acquire()
+
+            async def work():
+                try:
+                    await self.embed_and_upload(batch, state, stats)
+                except Exception as e:
+                    errors.append(e)
+                    logger.error(f"Error embedding or uploading {len(batch)} chunks: {e}")
+                finally:
+                    workers.release()
+
+            task = asyncio.create_task(work())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        try:
+            batch, batch_tokens = [], 0
+            for source, path in iter_documents(directory, self.extensions):
+                text = await asyncio.to_thread(read_document, path)
+                stats["documents"] += 1
+                title = os.path.splitext(os.path.basename(source))[0]
+                for index, chunk in enumerate(chunk_text(text, self.chunk_size, self.chunk_overlap)):
+                    if not chunk:
+                        continue
+                    key = chunk_id(source, index)
+                    seen.add(key)
+                    stats["chunks"] += 1
+                    digest = content_hash(chunk, self.embedding_model)
+                    if state.get(key) == digest:
+                        stats["chunks_skipped"] += 1
+                        continue
+                    tokens = count_tokens(chunk)
+                    if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                        await submit(batch)
+                        batch, batch_tokens = [], 0
+                    batch.append(({self.key_field: key, "parent_id": source, "title": title, "chunk": chunk}, digest, tokens))
+                    batch_tokens += tokens
+            if batch:
+                await submit(batch)
+            await asyncio.gather(*tasks)
+            try:
+                await self.upload(state, everything=True)
+            except Exception as e:
+                errors.append(e)
+                logger.error(f"Error uploading chunks: {e}")
+
+            stale = sorted((set(previous) | set(state)) - seen)
+            if stale and not errors:
+                await self.writer.delete(stale)
+                for key in stale:
+                    state.pop(key, None)
+                stats["chunks_deleted"] = len(stale)
+            await self.writer.close()
+        finally:
+            # Chunks uploaded before a failure are not embedded again on the next run
+            self.save_state(state)
+
+        elapsed = time.perf_counter() - started
+        stats.update({
+            "failed_batches": len(errors),
+            "elapsed_s": round(elapsed, 3),
+            "documents_per_s": round(stats["documents"] / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_s": round(stats["chunks"] / elapsed, 2) if elapsed else 0.0,
+        })
+        logger.info(f"Ingestion finished: {stats}")
+        return stats
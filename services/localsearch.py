@@ -0,0 +1,310 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter, defaultdict
+import numpy as np
+from config.config import Config, get_settings
+from services.cache import LRUCache, SingleFlight, normalize_query
+from services.metrics import get_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+DOCUMENTS_FILE = "documents.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+def tokenize(text):
+    return _TOKEN_PATTERN.findall(text.lower())
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses ranked lists of document ids; returns (id, score) pairs sorted by fused score."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+class BM25Index:
+    """Inverted index scoring documents with Okapi BM25."""
+
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        postings = defaultdict(list)
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc_id] = sum(counts.values())
+            for term, count in counts.items():
+                postings[term].append((doc_id, count))
+        self.count = len(texts)
+        average = float(lengths.mean()) if self.count else 0.0
+        # Precompute the length normalization of every document once
+        self.norms = self.k1 * (1 - self.b + self.b * lengths / average) if average else np.full(self.count, self.k1, dtype=np.float32)
+        self.postings = {
+            term: (np.array([doc_id for doc_id, _ in entries], dtype=np.int64), np.array([count for _, count in entries], dtype=np.float32))
+            for term, entries in postings.items()
+        }
+
+    def idf(self, term):
+        frequency = len(self.postings[term][0])
+        return math.log(1 + (self.count - frequency + 0.5) / (frequency + 0.5))
+
+    def search(self, query, top):
+        """Returns the ids and scores of the `top` best matching documents."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            doc_ids, counts = self.postings[term]
+            scores[doc_ids] += self.idf(term) * counts * (self.k1 + 1) / (counts + self.norms[doc_ids])
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return [], []
+        best = matched[np.argsort(-scores[matched], kind="stable")[:top]]
+        return best.tolist(), scores[best].tolist()
+
+class VectorIndex:
+    """Exact cosine top-k over a memory-mapped matrix of normalized embeddings.
+
+    With `ann="hnsw"` and at least `hnsw_min_documents` rows, an hnswlib graph is built
+    (or loaded from the index directory) for approximate search instead.
+    """
+
+    def __init__(self, matrix, ann="exact", hnsw_min_documents=50000, path=None, block_size=65536):
+        self.matrix = matrix
+        self.block_size = block_size
+        self.hnsw = None
+        if ann == "hnsw" and len(matrix) >= hnsw_min_documents:
+            self.hnsw = self.load_hnsw(matrix, path)
+
+    @staticmethod
+    def load_hnsw(matrix, path):
+        try:
+            import hnswlib
+        except ImportError as e:
+            logger.error("The hnsw local search index requires the 'hnswlib' package.")
+            raise ValueError("The hnsw local search index requires the 'hnswlib' package.") from e
+        index = hnswlib.Index(space="ip", dim=matrix.shape[1])
+        index_path = os.path.join(path, "hnsw.bin") if path else None
+        if index_path and os.path.exists(index_path):
+            index.load_index(index_path, max_elements=len(matrix))
+        else:
+            index.init_index(max_elements=len(matrix), ef_construction=200, M=16)
+            index.add_items(matrix, np.arange(len(matrix)))
+            if index_path:
+                index.save_index(index_path)
+        index.set_ef(100)
+        return index
+
+    def search(self, vectors, top):
+        """Returns, for each query vector, the ids and cosine scores of the `top` nearest rows."""
+        queries = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        top = min(top, len(self.matrix))
+        if not top:
+            return [([], []) for _ in queries]
+        if self.hnsw is not None:
+            labels, distances = self.hnsw.knn_query(queries, k=top)
+            return [(row.tolist(), (1 - distance).tolist()) for row, distance in zip(labels, distances)]
+
+        # Scan the matrix in blocks so a memory-mapped index never has to fit in memory at once
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.matrix), self.block_size):
+            scores = queries @ np.asarray(self.matrix[start:start + self.block_size]).T
+            ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            ids = np.concatenate([best_ids, ids], axis=1)
+            keep = np.argpartition(-scores, top - 1, axis=1)[:, :top] if scores.shape[1] > top else np.argsort(-scores, axis=1)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_ids = np.take_along_axis(ids, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        return [(ids.tolist(), scores.tolist()) for ids, scores in zip(best_ids, best_scores)]
+
+class LocalSearchIndex:
+    """On-disk retrieval index: normalized embeddings, the documents and a manifest."""
+
+    def __init__(self, path, ann="exact", hnsw_min_documents=50000, bm25_k1=1.2, bm25_b=0.75):
+        with open(os.path.join(path, MANIFEST_FILE)) as file:
+            self.manifest = json.load(file)
+        with open(os.path.join(path, DOCUMENTS_FILE)) as file:
+            self.documents = [json.loads(line) for line in file if line.strip()]
+        matrix = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        if len(matrix) != len(self.documents):
+            raise ValueError(f"Local search index at '{path}' has {len(matrix)} embeddings for {len(self.documents)} documents.")
+        self.vectors = VectorIndex(matrix, ann, hnsw_min_documents, path)
+        self.bm25 = BM25Index([document["chunk"] for document in self.documents], bm25_k1, bm25_b)
+        logger.info(f"Local search index loaded from '{path}': {len(self.documents)} chunks.")
+
+    @staticmethod
+    def write(path, documents, embeddings, manifest=None):
+        """Writes documents ({"chunk", ...}) and their embeddings as a local search index."""
+        os.makedirs(path, exist_ok=True)
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(documents), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.save(os.path.join(path, EMBEDDINGS_FILE), matrix / np.where(norms == 0, 1, norms))
+        with open(os.path.join(path, DOCUMENTS_FILE), "w") as file:
+            for document in documents:
+                file.write(json.dumps(document, ensure_ascii=False) + "\n")
+        manifest = dict(manifest or {}, documents=len(documents), dimensions=int(matrix.shape[1]) if len(documents) else 0)
+        with open(os.path.join(path, MANIFEST_FILE), "w") as file:
+            json.dump(manifest, file, indent=2)
+        # A stale graph would not match the new embeddings
+        if os.path.exists(os.path.join(path, "hnsw.bin")):
+            os.remove(os.path.join(path, "hnsw.bin"))
+        return manifest
+
+class LocalSearchClient:
+    """Local, offline retrieval with the same contract as AzureAISearchClient.
+
+    `vector` search ranks chunks by cosine similarity; `hybrid` and `hybrid_semantic`
+    fuse the vector and BM25 rankings with reciprocal rank fusion (there is no local
+    semantic ranker, so `hybrid_semantic` behaves as `hybrid`). `embedder` is a function
+    mapping a list of texts to their embeddings, or an object with `embed` and optionally
+    `embed_async`; it defaults to the embedder named in `ai_search.local.embedder`.
+    """
+
+    def __init__(self, embedder=None, index=None):
+        try:
+            # Set parameters
+            config = Config().config
+            self.search_type = config["ai_search"]["search_type"]
+            self.k_nearest_neighbors = config["ai_search"]["k_nearest_neighbors"]
+            self.fields = config["ai_search"]["fields"]
+            self.top = config["ai_search"]["top"]
+            cache_config = config["ai_search"].get("cache", {})
+            self.cache_enabled = cache_config.get("enabled", False)
+            self.cache = LRUCache(cache_config.get("max_entries", 1000), cache_config.get("ttl_seconds", 300))
+            self.single_flight = SingleFlight()
+            local_config = config["ai_search"].get("local", {})
+            self.path = local_config.get("path", "data/local_index")
+            self.ann = local_config.get("ann", "exact")
+            self.hnsw_min_documents = local_config.get("hnsw_min_documents", 50000)
+            self.candidates = local_config.get("candidates", 50)
+            self.rrf_k = local_config.get("rrf_k", 60)
+            self.bm25_k1 = local_config.get("bm25_k1", 1.2)
+            self.bm25_b = local_config.get("bm25_b", 0.75)
+            if embedder is None:
+                embedder = self.create_embedder(local_config)
+            self.embedder = embedder
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.index = index
+
+    @staticmethod
+    def create_embedder(local_config):
+        """Returns the embedder named by `embedder`: "azure" (the embedding deployment) or "hashing" (offline)."""
+        if local_config.get("embedder", "azure") == "hashing":
+            from services.embeddings import HashingEmbedder
+            return HashingEmbedder(local_config.get("dimensions", 256))
+        from services.embeddings import AzureEmbeddingClient
+        return AzureEmbeddingClient()
+
+    def get_client(self):
+        """Returns the loaded index, reading it from disk on first use."""
+        if self.index is None:
+            self.index = LocalSearchIndex(self.path, self.ann, self.hnsw_min_documents, self.bm25_k1, self.bm25_b)
+        return self.index
+
+    async def get_async_client(self):
+        if self.index is None:
+            await asyncio.to_thread(self.get_client)
+        return self.index
+
+    async def ping_async(self):
+        """Loads the index so the first query does not read it from disk."""
+        await self.get_async_client()
+
+    def embed(self, texts):
+        return self.embedder.embed(texts) if hasattr(self.embedder, "embed") else self.embedder(texts)
+
+    async def embed_async(self, texts):
+        if hasattr(self.embedder, "embed_async"):
+            return await self.embedder.embed_async(texts)
+        return await asyncio.to_thread(self.embed, texts)
+
+    def rank(self, index, queries, vectors):
+        """Ranks the chunks for each query with the configured search type."""
+        vector_hits = index.vectors.search(vectors, max(self.k_nearest_neighbors, self.top))
+        results = []
+        for query, (ids, scores) in zip(queries, vector_hits):
+            if self.search_type in ("hybrid", "hybrid_semantic"):
+                keyword_ids, _ = index.bm25.search(query, max(self.candidates, self.top))
+                ranked = reciprocal_rank_fusion([ids[:self.k_nearest_neighbors], keyword_ids], self.rrf_k)[:self.top]
+            else:
+                ranked = list(zip(ids, scores))[:self.top]
+            results.append([{"score": float(score), "content": index.documents[doc_id]["chunk"]} for doc_id, score in ranked])
+        return results
+
+    def retrieve_many(self, queries):
+        """Searches several queries with one embedding call and one matrix product."""
+        with get_metrics().span("search", backend="local"):
+            index = self.get_client()
+            return self.rank(index, queries, self.embed(queries))
+
+    def retrieve(self, query):
+        """Searches the local index and returns the scored chunks."""
+        return self.retrieve_many([query])[0]
+
+    async def retrieve_async(self, query):
+        """Searches the local index without blocking the event loop."""
+        with get_metrics().span("search", backend="local"):
+            index = await self.get_async_client()
+            vectors = await self.embed_async([query])
+            return (await asyncio.to_thread(self.rank, index, [query], vectors))[0]
+
+    def cache_key(self, query):
+        """Builds the retrieval cache key from the normalized query and the search settings.
+
+        The index version is read from the current settings, so a hot reload that changes
+        it stops serving the results cached for the previous index.
+        """
+        index_version = str(get_settings().config["ai_search"].get("index_version", ""))
+        return (normalize_query(query), self.search_type, self.k_nearest_neighbors, self.fields, self.top, index_version)
+
+    def run(self, query):
+        """Executes the search process and returns the results."""
+        try:
+            if not self.cache_enabled:
+                return self.retrieve(query)
+            key = self.cache_key(query)
+            response = self.cache.get(key)
+            if response is None:
+                response = self.single_flight.run(key, lambda: self.retrieve(query))
+                self.cache.set(key, response)
+            return list(response)
+        except Exception as e:
+            logger.error(f"Error running local search process: {e}")
+            return {"error": str(e)}
+
+    async def run_async(self, query):
+        """Executes the search process and returns the results without blocking the event loop."""
+        try:
+            if not self.cache_enabled:
+                return await self.retrieve_async(query)
+            key = self.cache_key(query)
+            response = self.cache.get(key)
+            if response is None:
+                response = await self.single_flight.run_async(key, lambda: self.retrieve_async(query))
+                self.cache.set(key, response)
+            return list(response)
+        except Exception as e:
+            logger.error(f"Error running local search process: {e}")
+            return {"error": str(e)}
+
+    def cache_stats(self):
+        """Returns the retrieval cache counters, including lookups deduplicated in flight."""
+        return dict(self.cache.stats(), deduplicated=self.single_flight.shared)
@@ -0,0 +1,307 @@
+import contextvars
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from config.config import Config, get_settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Metric families exposed on /metrics: name -> (type, help)
+METRICS = {
+    "rag_span_duration_seconds": ("histogram", "Duration of instrumented operations, by span name."),
+    "rag_llm_time_to_first_token_seconds": ("histogram", "Time from sending a streamed completion to its first answer token."),
+    "rag_llm_tokens_total": ("counter", "Model tokens by model and kind (input, output, or cached_input: the input tokens served from the prompt cache)."),
+    "rag_llm_cost_total": ("counter", "Model cost in configured price units, by model."),
+    "rag_embedding_tokens_total": ("counter", "Embedding tokens by deployment."),
+    "rag_chat_requests_total": ("counter", "Chat requests by mode and outcome."),
+    "rag_span_errors_total": ("counter", "Instrumented operations that raised, by span name."),
+    "rag_openai_backend_requests_total": ("counter", "Azure OpenAI calls by logical model, backend and outcome (ok, throttled, error)."),
+    "rag_openai_backend_tokens_total": ("counter", "Azure OpenAI tokens served by logical model and backend."),
+    "rag_resilience_retries_total": ("counter", "Dependency calls retried, by dependency and status."),
+    "rag_resilience_exhausted_total": ("counter", "Dependency calls that failed after every retry, by dependency."),
+    "rag_resilience_rejected_total": ("counter", "Dependency calls rejected by the circuit breaker or rate limiter."),
+    "rag_resilience_queue_seconds": ("histogram", "Time calls waited for rate limit quota, by dependency."),
+    "rag_chat_coalesced_total": ("counter", "Chat requests attached to a running or completed turn instead of starting one, by mode and source (in_flight or idempotency_key)."),
+    "rag_session_queue_seconds": ("histogram", "Time chat turns waited for the earlier turns of their session."),
+    "rag_query_rewrites_total": ("counter", "Queries sent to the query rewriting model, by outcome (rewritten, unchanged, timeout, error)."),
+    "rag_embedding_cache_requests_total": ("counter", "Query embeddings served from the embedding cache (hit) or computed (miss)."),
+    "rag_answer_cache_lookups_total": ("counter", "Answer cache lookups by result (exact, semantic or miss)."),
+    "rag_query_embedding_seconds": ("histogram", "Time to get query embeddings, cache lookups included; search latency is the search span."),
+}
+
+_current_span = contextvars.ContextVar("rag_current_span", default=None)
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+@dataclass
+class SpanRecord:
+    """A finished span kept by the in-memory exporter."""
+    name: str
+    attributes: dict
+    start: float
+    duration: float
+    parent: str = None
+    error: str = None
+
+class _NoopSpan:
+    """Span returned when metrics are disabled; entering and leaving it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class _Span:
+    def __init__(self, metrics, name, attributes):
+        self.metrics = metrics
+        self.name = name
+        self.attributes = attributes
+        self.extra = {}
+        self.otel_span = None
+
+    def set_attribute(self, key, value):
+        """Adds an attribute exported with the span (not used as a metric label)."""
+        self.extra[key] = value
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.token = _current_span.set(self.name)
+        if self.metrics.otlp is not None:
+            self.otel_span = self.metrics.otlp.start_span(self.name, self.attributes)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.started
+        _current_span.reset(self.token)
+        error = exc_type.__name__ if exc_type is not None else None
+        self.metrics.observe("rag_span_duration_seconds", duration, span=self.name, **self.attributes)
+        if error:
+            self.metrics.inc("rag_span_errors_total", span=self.name, error=error)
+        if self.otel_span is not None:
+            self.metrics.otlp.end_span(self.otel_span, self.extra, exc)
+        if self.metrics.memory is not None:
+            self.metrics.record_span(SpanRecord(self.name, dict(self.attributes, **self.extra), self.started, duration, self.parent, error))
+        return False
+
+class OtlpExporter:
+    """Exports spans and metrics over OTLP/gRPC with the OpenTelemetry SDK (optional dependency)."""
+
+    def __init__(self, endpoint, service_name, export_interval_seconds):
+        try:
+            from opentelemetry import context, trace
+            from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.metrics import MeterProvider
+            from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError as e:
+            logger.error("OTLP export requires the 'opentelemetry-sdk' and 'opentelemetry-exporter-otlp-proto-grpc' packages.")
+            raise ValueError("OTLP export requires the 'opentelemetry-sdk' and 'opentelemetry-exporter-otlp-proto-grpc' packages.") from e
+        resource = Resource.create({"service.name": service_name})
+        self.tracer_provider = TracerProvider(resource=resource)
+        self.tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        reader = PeriodicExportingMetricReader(OTLPMetricExporter(endpoint=endpoint), export_interval_millis=export_interval_seconds * 1000)
+        self.meter_provider = MeterProvider(resource=resource, metric_readers=[reader])
+        self.tracer = self.tracer_provider.get_tracer("rag-azure")
+        self.meter = self.meter_provider.get_meter("rag-azure")
+        self.context = context
+        self.trace = trace
+        self.instruments = {}
+        self._lock = threading.Lock()
+        logger.info(f"Exporting spans and metrics over OTLP to {endpoint}.")
+
+    def start_span(self, name, attributes):
+        span = self.tracer.start_span(name, attributes={key: str(value) for key, value in attributes.items()})
+        # Nested spans started while this one is current become its children
+        token = self.context.attach(self.trace.set_span_in_context(span))
+        return span, token
+
+    def end_span(self, handle, attributes, exc):
+        span, token = handle
+        for key, value in attributes.items():
+            span.set_attribute(key, value if isinstance(value, (bool, int, float, str)) else str(value))
+        if exc is not None:
+            span.record_exception(exc)
+            span.set_status(self.trace.Status(self.trace.StatusCode.ERROR))
+        span.end()
+        self.context.detach(token)
+
+    def record(self, kind, name, value, labels):
+        instrument = self.instruments.get(name)
+        if instrument is None:
+            with self._lock:
+                instrument = self.instruments.get(name)
+                if instrument is None:
+                    help_text = METRICS.get(name, (kind, ""))[1]
+                    if kind == "counter":
+                        instrument = self.meter.create_counter(name, description=help_text)
+                    else:
+                        instrument = self.meter.create_histogram(name, unit="s", description=help_text)
+                    self.instruments[name] = instrument
+        if kind == "counter":
+            instrument.add(value, labels)
+        else:
+            instrument.record(value, labels)
+
+    def shutdown(self):
+        self.tracer_provider.shutdown()
+        self.meter_provider.shutdown()
+
+class Metrics:
+    """Process-wide counters, histograms and spans for the request hot path.
+
+    Rendered in the Prometheus text format on /metrics. Spans also go to the configured
+    exporters: "memory" keeps SpanRecords in `memory` for tests and offline runs, "otlp"
+    exports spans and metrics to an OpenTelemetry collector. Span attributes become
+    metric labels, so they must have few distinct values (models, operations, stages).
+    When disabled, `span` returns a shared no-op and counters return immediately.
+    """
+
+    def __init__(self):
+        try:
+            # Set parameters
+            config = Config().config
+            metrics_config = config.get("metrics", {})
+            self.enabled = metrics_config.get("enabled", True)
+            self.buckets = tuple(metrics_config.get("buckets", DEFAULT_BUCKETS))
+            exporters = metrics_config.get("exporters", [])
+            self.memory_max_spans = metrics_config.get("memory_max_spans", 10000)
+            otlp_config = metrics_config.get("otlp", {})
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.memory = [] if self.enabled and "memory" in exporters else None
+        self.otlp = None
+        # The first settings snapshot is loaded before the registry exists
+        self.observe("rag_span_duration_seconds", get_settings().load_seconds, span="config_load")
+        if self.enabled and "otlp" in exporters:
+            self.otlp = OtlpExporter(
+                otlp_config.get("endpoint", "http://localhost:4317"),
+                otlp_config.get("service_name", "rag-azure"),
+                otlp_config.get("export_interval_seconds", 15)
+            )
+
+    def span(self, name, **attributes):
+        """Times the block as `name`: `with get_metrics().span("search", backend="azure"):`."""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, attributes)
+
+    def inc(self, name, value=1, **labels):
+        """Adds `value` to a counter."""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            family = self.counters.setdefault(name, {})
+            family[key] = family.get(key, 0) + value
+        if self.otlp is not None:
+            self.otlp.record("counter", name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """Records one observation in a histogram."""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            family = self.histograms.setdefault(name, {})
+            series = family.get(key)
+            if series is None:
+                series = family[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][position] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+        if self.otlp is not None and name != "rag_span_duration_seconds":
+            # Span durations reach the collector with the spans themselves
+            self.otlp.record("histogram", name, value, labels)
+
+    def record_span(self, record):
+        with self._lock:
+            self.memory.append(record)
+            if len(self.memory) > self.memory_max_spans:
+                del self.memory[:len(self.memory) - self.memory_max_spans]
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        with self._lock:
+            for name in sorted(set(self.counters) | set(self.histograms)):
+                kind, help_text = METRICS.get(name, ("counter" if name in self.counters else "histogram", ""))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self.counters.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+                for key, series in sorted(self.histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, series["buckets"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', str(bound))])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {series['count']}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {series['sum']}")
+                    lines.append(f"{name}_count{_format_labels(key)} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Returns the counters and histogram counts/sums keyed by name and labels, for tests and benchmarks."""
+        with self._lock:
+            return {
+                "counters": {name: {key: value for key, value in family.items()} for name, family in self.counters.items()},
+                "histograms": {
+                    name: {key: {"count": series["count"], "sum": series["sum"]} for key, series in family.items()}
+                    for name, family in self.histograms.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            if self.memory is not None:
+                self.memory.clear()
+
+    def shutdown(self):
+        if self.otlp is not None:
+            self.otlp.shutdown()
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    """Returns the process-wide metrics registry."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from config.config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PersistRecord:
+    """One turn of items waiting to be appended to a session in a Cosmos DB container."""
+    container: object
+    session_id: str
+    field: str
+    items: list
+    critical: bool
+    done: asyncio.Future = None
+    enqueued: float = field(default_factory=time.perf_counter)
+
+class PersistenceQueue:
+    """Write-behind queue persisting chat history and evals records off the response path.
+
+    Records are accepted immediately and flushed in batches by a worker on the event loop:
+    the turns of one session in a batch are appended with a single Cosmos DB write, and
+    sessions are flushed concurrently. When the queue is full, history records wait for
+    room (backpressure) while eval records, being analytics only, are dropped.
+    """
+
+    def __init__(self, azurecosmos):
+        try:
+            # Set parameters
+            config = Config().config
+            persistence_config = config.get("persistence", {})
+            self.enabled = persistence_config.get("enabled", True)
+            self.max_queue_size = persistence_config.get("max_queue_size", 10000)
+            self.batch_size = persistence_config.get("batch_size", 100)
+            self.flush_interval = persistence_config.get("flush_interval_seconds", 0.05)
+            self.max_retries = persistence_config.get("max_retries", 5)
+            self.retry_base_delay = persistence_config.get("retry_base_delay_seconds", 0.1)
+            self.retry_max_delay = persistence_config.get("retry_max_delay_seconds", 5.0)
+            self.drain_timeout = persistence_config.get("drain_timeout_seconds", 30)
+            self.azurecosmos = azurecosmos
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.queue = None
+        self.worker = None
+        self.pending = defaultdict(set)
+        self.submitted = 0
+        self.flushed = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+        self.dropped = 0
+        self.flush_latency = {"last": 0.0, "max": 0.0, "total": 0.0}
+        self.persist_lag = {"last": 0.0, "max": 0.0}
+
+    @property
+    def running(self):
+        return self.worker is not None and not self.worker.done()
+
+    def start(self):
+        """Starts the flush worker on the running event loop."""
+        if not self.enabled or self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.worker = asyncio.create_task(self.run(), name="persistence-worker")
+        logger.info("Persistence worker started.")
+
+    async def submit(self, container, session_id, items, field, critical=True):
+        """Queues one turn for `session_id`, writing it directly if the worker is not running.
+
+        Critical records wait for room in a full queue; others are dropped.
+        """
+        if not self.running:
+            await self.azurecosmos.insert_items_async(container, session_id, items, field)
+            return
+        record = PersistRecord(container, session_id, field, items, critical, asyncio.get_running_loop().create_future())
+        if critical:
+            await self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                logger.warning(f"Persistence queue full, dropping {field} record for session ID '{session_id}'.")
+                return
+        self.submitted += 1
+        key = (container.id, session_id)
+        self.pending[key].add(record.done)
+        record.done.add_done_callback(lambda done: self.discard_pending(key, done))
+
+    def discard_pending(self, key, done):
+        pending = self.pending.get(key)
+        if pending is not None:
+            pending.discard(done)
+            if not pending:
+                del self.pending[key]
+
+    async def wait_for_session(self, container, session_id):
+        """Waits until the queued records of the session are written, so reads see them."""
+        pending = list(self.pending.get((container.id, session_id), ()))
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def run(self):
+        """Collects records into batches of up to `batch_size` or `flush_interval` and flushes them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.flush(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def flush(self, batch):
+        """Writes a batch, grouping the turns of each session and container into one append."""
+        started = time.perf_counter()
+        groups = defaultdict(list)
+        for record in batch:
+            groups[(record.container.id, record.session_id, record.field)].append(record)
+        await asyncio.gather(*(self.flush_group(records) for records in groups.values()))
+
+        duration = time.perf_counter() - started
+        self.batches += 1
+        self.flush_latency["last"] = duration
+        self.flush_latency["max"] = max(self.flush_latency["max"], duration)
+        self.flush_latency["total"] += duration
+        lag = time.perf_counter() - min(record.enqueued for record in batch)
+        self.persist_lag["last"] = lag
+        self.persist_lag["max"] = max(self.persist_lag["max"], lag)
+
+    async def flush_group(self, records):
+        """Appends the turns of one session, retrying with exponential backoff and full jitter."""
+        first = records[0]
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.azurecosmos.append_many_async(first.container, first.session_id, [record.items for record in records], first.field)
+                self.flushed += len(records)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += len(records)
+                    logger.error(f"Failed to persist {len(records)} {first.field} records for session ID '{first.session_id}': {e}")
+                    break
+                self.retries += 1
+                await asyncio.sleep(random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)))
+        for record in records:
+            if not record.done.done():
+                record.done.set_result(None)
+
+    async def drain(self, timeout=None):
+        """Flushes every queued record and stops the worker; call it before shutting down."""
+        if not self.running:
+            return
+        timeout = self.drain_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+            logger.info("Persistence queue drained.")
+        except asyncio.TimeoutError:
+            logger.error(f"Persistence queue not drained after {timeout}s, {self.queue.qsize()} records lost.")
+        self.worker.cancel()
+        await asyncio.gather(self.worker, return_exceptions=True)
+        self.worker = None
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue_size": self.max_queue_size,
+            "submitted": self.submitted,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "flush_latency_ms": {
+                "last": round(self.flush_latency["last"] * 1000, 3),
+                "max": round(self.flush_latency["max"] * 1000, 3),
+                "avg": round(self.flush_latency["total"] * 1000 / self.batches, 3) if self.batches else 0.0,
+            },
+            "persist_lag_ms": {
+                "last": round(self.persist_lag["last"] * 1000, 3),
+                "max": round(self.persist_lag["max"] * 1000, 3),
+            },
+        }
@@ -0,0 +1,61 @@
+import asyncio
+import inspect
+import logging
+import time
+from services.metrics import get_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Pipeline:
+    """Dependency-aware runner that starts each stage as soon as its inputs are ready."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, func, depends_on=()):
+        """Registers a stage; `func` receives the results of `depends_on` as keyword arguments.
+
+        Coroutine functions run on the event loop, plain functions run in a worker thread.
+        """
+        missing = [dependency for dependency in depends_on if dependency not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {', '.join(missing)}")
+        self.stages[name] = (func, tuple(depends_on))
+        return self
+
+    async def run(self):
+        """Runs every stage and returns the results and timings (in seconds) by stage name."""
+        results = {}
+        timings = {}
+        tasks = {}
+        origin = time.perf_counter()
+
+        async def run_stage(name, func, depends_on):
+            inputs = {}
+            for dependency in depends_on:
+                inputs[dependency] = await tasks[dependency]
+            started = time.perf_counter()
+            with get_metrics().span("pipeline_stage", stage=name):
+                if inspect.iscoroutinefunction(func):
+                    result = await func(**inputs)
+                else:
+                    result = await asyncio.to_thread(func, **inputs)
+            finished = time.perf_counter()
+            timings[name] = {"start": round(started - origin, 6), "duration": round(finished - started, 6)}
+            results[name] = result
+            return result
+
+        for name, (func, depends_on) in self.stages.items():
+            tasks[name] = asyncio.create_task(run_stage(name, func, depends_on), name=f"pipeline:{name}")
+        try:
+            await asyncio.gather(*tasks.values())
+        except Exception:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        timings["total"] = {"start": 0.0, "duration": round(time.perf_counter() - origin, 6)}
+        logger.info(f"Pipeline timings: {timings}")
+        return results, timings
@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from config.config import Config
+from services.metrics import get_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Exceptions without a status code that mean the request never got an answer
+RETRYABLE_ERRORS = {"TimeoutError", "APITimeoutError", "APIConnectionError", "ServiceRequestError", "ServiceResponseError", "ConnectError", "ReadTimeout"}
+
+class ResilienceError(Exception):
+    """A dependency call was not attempted or gave up; `retry_after` hints when to try again."""
+
+    def __init__(self, message, dependency, retry_after=None):
+        super().__init__(message)
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+class CircuitOpenError(ResilienceError):
+    """The dependency failed repeatedly and calls are short-circuited until the breaker resets."""
+
+class RateLimitedError(ResilienceError):
+    """The local rate limiter would queue the call longer than allowed."""
+
+class RetriesExhaustedError(ResilienceError):
+    """Every attempt failed with a retryable error, or the deadline ran out."""
+
+def error_status(exc):
+    """Returns the HTTP status of an OpenAI or Azure SDK error, or None."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    return status if isinstance(status, int) else None
+
+def is_retryable(exc):
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)) or type(exc).__name__ in RETRYABLE_ERRORS
+
+def retry_after(exc):
+    """Returns the delay in seconds requested by the service (retry-after-ms or retry-after), or None."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("x-ms-retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(float(value) * scale, 0.0)
+        except (TypeError, ValueError):
+            # HTTP-date values are rare for these services; fall back to backoff
+            return None
+    return None
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets one trial call through after `reset_timeout`.
+
+    A trial call that is cancelled reopens the breaker, and a trial still unanswered after
+    `reset_timeout` is given up on, so the breaker never stays half open.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+        self.opened = 0
+
+    def before_call(self):
+        """Returns the seconds left before a trial call is allowed (0 if the call may proceed)."""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            now = time.monotonic()
+            remaining = self.opened_at + self.reset_timeout - now
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+                self.trial_started = now
+                return 0.0
+            if self.state == "half_open" and now - self.trial_started >= self.reset_timeout:
+                # The trial call never reported back; let another one through
+                self.trial_started = now
+                return 0.0
+            # Half open: a trial call is already in flight; suggest waiting a full reset period
+            return remaining if remaining > 0 else self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_abandoned(self):
+        """Records a call that ended without an outcome (cancelled); a half-open trial reopens the breaker."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+class TokenBucket:
+    """Refills `per_minute` units a minute, holding at most `burst_seconds` worth of them.
+
+    Reservations may drive the level negative; the caller then waits until it is paid
+    back, so waiting callers are served in order.
+    """
+
+    def __init__(self, per_minute, burst_seconds=10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return -self.level / self.rate if self.level < 0 else 0.0
+
+    def release(self, amount):
+        self.level += amount
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets matching a deployment quota."""
+
+    def __init__(self, rpm=None, tpm=None, burst_seconds=10.0, max_wait=30.0):
+        self.requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self.tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Reserves one request and `tokens` tokens; returns (admitted, seconds to wait before sending it)."""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            if wait > self.max_wait:
+                # Too long to queue: give the reservation back and let the caller fail fast
+                if self.requests is not None:
+                    self.requests.release(1)
+                if self.tokens is not None:
+                    self.tokens.release(tokens)
+                return False, wait
+            return True, wait
+
+class Resilience:
+    """Deadlines, retries, circuit breaking and rate limiting for one dependency.
+
+    Each attempt gets `timeout_seconds`; retryable failures (timeouts, connection errors,
+    408/429/5xx) are retried with full-jitter backoff, or after the delay the service asks
+    for in retry-after, while the overall `deadline_seconds` allows. Consecutive
+    failures other than throttling open the circuit breaker. Calls with a rate limit
+    `key` wait for quota in the local token buckets instead of drawing 429s.
+    """
+
+    def __init__(self, dependency):
+        try:
+            # Set parameters
+            config = Config().config
+            resilience_config = config.get("resilience", {})
+            dependency_config = resilience_config.get(dependency, {})
+            self.enabled = resilience_config.get("enabled", True) and dependency_config.get("enabled", True)
+            self.timeout = dependency_config.get("timeout_seconds", 30.0)
+            self.deadline = dependency_config.get("deadline_seconds", 60.0)
+            self.max_retries = dependency_config.get("max_retries", 3)
+            self.base_delay = dependency_config.get("retry_base_delay_seconds", 0.5)
+            self.max_delay = dependency_config.get("retry_max_delay_seconds", 10.0)
+            breaker_config = dependency_config.get("circuit_breaker", {})
+            self.breaker = CircuitBreaker(breaker_config.get("failure_threshold", 5), breaker_config.get("reset_timeout_seconds", 30.0))
+            rate_config = dependency_config.get("rate_limits", {})
+            self.limiters = {
+                key: RateLimiter(limits.get("rpm"), limits.get("tpm"), limits.get("burst_seconds", 10.0), limits.get("max_wait_seconds", 30.0))
+                for key, limits in rate_config.items()
+            }
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        self.dependency = dependency
+        self.retries = 0
+
+    def admit(self, key, tokens):
+        """Checks the breaker and reserves rate limit quota; returns the seconds to queue."""
+        wait = self.breaker.before_call()
+        if wait:
+            get_metrics().inc("rag_resilience_rejected_total", dependency=self.dependency, reason="circuit_open")
+            raise CircuitOpenError(f"Circuit breaker for {self.dependency} is open.", self.dependency, wait)
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            return 0.0
+        admitted, wait = limiter.reserve(tokens() if callable(tokens) else tokens)
+        if not admitted:
+            get_metrics().inc("rag_resilience_rejected_total", dependency=self.dependency, reason="rate_limit")
+            raise RateLimitedError(f"Rate limit for {self.dependency} '{key}' would queue the call {wait:.1f}s.", self.dependency, wait)
+        if wait:
+            get_metrics().observe("rag_resilience_queue_seconds", wait, dependency=self.dependency)
+        return wait
+
+    def backoff(self, attempt, exc, started):
+        """Returns the delay before the next attempt, or None if the call must give up."""
+        if attempt >= self.max_retries or not is_retryable(exc):
+            return None
+        delay = retry_after(exc)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if time.monotonic() + delay - started > self.deadline:
+            return None
+        return delay
+
+    def record_outcome(self, exc):
+        # Throttling and client errors mean the service answered; only outages open the breaker
+        if is_retryable(exc) and error_status(exc) != 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def failed(self, exc, attempt, started):
+        """Returns the delay before retrying after `exc`, or raises the error to give up with."""
+        self.record_outcome(exc)
+        delay = self.backoff(attempt, exc, started)
+        if delay is None:
+            if not is_retryable(exc):
+                raise exc
+            get_metrics().inc("rag_resilience_exhausted_total", dependency=self.dependency)
+            raise RetriesExhaustedError(f"{self.dependency} failed after {attempt + 1} attempts: {exc}", self.dependency, retry_after(exc)) from exc
+        self.retries += 1
+        get_metrics().inc("rag_resilience_retries_total", dependency=self.dependency, status=str(error_status(exc) or type(exc).__name__))
+        logger.warning(f"Retrying {self.dependency} in {delay:.2f}s after: {exc!r}")
+        return delay
+
+    async def call_async(self, func, key=None, tokens=0):
+        """Awaits `func(timeout)` under the deadline, breaker, rate limit and retry policy.
+
+        `tokens` is the quota the call draws from the `key` limiter, or a callable returning it
+        (only evaluated when that limiter exists).
+        """
+        if not self.enabled:
+            return await func(None)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self.admit(key, tokens)
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                result = await asyncio.wait_for(func(self.timeout), self.timeout)
+            except Exception as e:
+                await asyncio.sleep(self.failed(e, attempt, started))
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled by the caller (a deadline or a client that went away)
+                self.breaker.record_abandoned()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def call(self, func, key=None, tokens=0):
+        """Calls `func(timeout)` under the deadline, breaker, rate limit and retry policy.
+
+        Blocking calls cannot be interrupted, so `func` must pass `timeout` to its client.
+        """
+        if not self.enabled:
+            return func(None)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self.admit(key, tokens)
+            if wait:
+                time.sleep(wait)
+            try:
+                result = func(self.timeout)
+            except Exception as e:
+                time.sleep(self.failed(e, attempt, started))
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.record_abandoned()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        return {"state": self.breaker.state, "opened": self.breaker.opened, "retries": self.retries}
+
+_resilience = {}
+_resilience_lock = threading.Lock()
+
+def get_resilience(dependency):
+    """Returns the process-wide resilience policy of a dependency ("openai", "search")."""
+    policy = _resilience.get(dependency)
+    if policy is None:
+        with _resilience_lock:
+            policy = _resilience.get(dependency)
+            if policy is None:
+                policy = _resilience[dependency] = Resilience(dependency)
+    return policy
+
+def resilience_stats():
+    return {dependency: policy.stats() for dependency, policy in _resilience.items()}
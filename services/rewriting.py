@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from config.config import Config, get_settings
+from services.azopenai import AzureOpenAIClient
+from services.cache import normalize_query
+from services.history import ChatHistoryWindow
+from services.localsearch import reciprocal_rank_fusion
+from services.metrics import get_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class QueryRewriter:
+    """Rewrites the query against the recent history before retrieval, with a small model.
+
+    A follow-up like "and the second one?" becomes a standalone query naming what it refers
+    to; with `max_queries` above 1 the model may also split the question into sub-queries,
+    which are searched concurrently and merged with reciprocal rank fusion. The model has
+    `timeout_seconds` to answer; on timeout or error the raw query is searched.
+    """
+
+    def __init__(self, azureopenai=None):
+        try:
+            # Set parameters
+            config = Config().config
+            rewriting_config = config["model"].get("query_rewriting", {})
+            self.enabled = rewriting_config.get("enabled", False) and azureopenai is not None
+            self.model = config["model"]["deployments"][rewriting_config.get("deployment", "gpt-4o-mini")]["name"]
+            self.max_tokens = rewriting_config.get("max_tokens", 150)
+            self.max_queries = max(1, rewriting_config.get("max_queries", 3))
+            self.history_turns = rewriting_config.get("history_turns", 3)
+            self.max_message_chars = rewriting_config.get("max_message_chars", 600)
+            self.rewrite_first_turns = rewriting_config.get("rewrite_first_turns", False)
+            self.timeout_seconds = rewriting_config.get("timeout_seconds", 1.5)
+            self.rrf_k = rewriting_config.get("rrf_k", 60)
+            self.prompt = rewriting_config.get("prompt", "query_rewrite.prompt")
+            self.azureopenai = azureopenai
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+
+    def recent_turns(self, chat_history):
+        """The last `history_turns` turns as a transcript, long messages cut short."""
+        turns = ChatHistoryWindow.split_turns(chat_history)[-self.history_turns:] if self.history_turns else []
+        return "\n".join(
+            f"{message['role'].upper()}: {str(message['content'])[:self.max_message_chars]}"
+            for turn in turns for message in turn
+        )
+
+    def parse(self, response, query):
+        """Reads the queries from the model response; the raw query when there are none."""
+        data = AzureOpenAIClient.parse_content(response) if response else None
+        if isinstance(data, dict):
+            sub_queries = data.get("sub_queries") if isinstance(data.get("sub_queries"), list) else []
+            candidates = [data.get("query")] + sub_queries
+        else:
+            candidates = [data]
+        queries = []
+        seen = set()
+        for candidate in candidates:
+            if not isinstance(candidate, str) or not candidate.strip():
+                continue
+            key = normalize_query(candidate)
+            if key not in seen:
+                seen.add(key)
+                queries.append(candidate.strip())
+        return queries[:self.max_queries] or [query]
+
+    async def rewrite_async(self, query, session=None):
+        """Returns {"queries", "outcome", "duration"} and the "usage" of the model call, if any."""
+        chat_history = (session or {}).get("chat_history") or []
+        if not self.enabled:
+            return {"queries": [query], "outcome": "disabled", "duration": 0.0}
+        if not chat_history and not self.rewrite_first_turns:
+            return {"queries": [query], "outcome": "first_turn", "duration": 0.0}
+        started = time.perf_counter()
+        user_input = f"RECENT_TURNS:\n{self.recent_turns(chat_history)}\n\nQUESTION: {query}\n\nMAX_QUERIES: {self.max_queries}"
+        messages = [
+            {"role": "system", "content": get_settings().prompt(self.prompt)},
+            {"role": "user", "content": user_input},
+        ]
+        usage = None
+        try:
+            result = await asyncio.wait_for(
+                self.azureopenai.complete_text_async(self.model, messages, self.max_tokens), self.timeout_seconds
+            )
+            usage = {
+                "model": result["model"],
+                "input_tokens": result["input_tokens"],
+                "output_tokens": result["output_tokens"],
+                "cached_input_tokens": result.get("cached_input_tokens", 0),
+                "stage": "query_rewrite",
+            }
+            queries = self.parse(result["response"], query)
+            outcome = "unchanged" if [normalize_query(item) for item in queries] == [normalize_query(query)] else "rewritten"
+        except asyncio.TimeoutError:
+            logger.warning(f"Query rewriting took longer than {self.timeout_seconds}s; searching the raw query.")
+            queries, outcome = [query], "timeout"
+        except Exception as e:
+            logger.warning(f"Query rewriting failed, searching the raw query: {e}")
+            queries, outcome = [query], "error"
+        get_metrics().inc("rag_query_rewrites_total", outcome=outcome)
+        logger.info(f"Search queries ({outcome}): {queries}")
+        rewrite = {"queries": queries, "outcome": outcome, "duration": round(time.perf_counter() - started, 6)}
+        if usage is not None:
+            rewrite["usage"] = usage
+        return rewrite
+
+    async def search_async(self, search, queries):
+        """Searches the queries concurrently and fuses the rankings.
+
+        Chunks found by several queries are kept once, ranked by reciprocal rank fusion
+        and cut to the longest result list; each keeps its best search score, which the
+        router reads, and its "fused_score", which orders the packed context.
+        """
+        if len(queries) == 1:
+            return await search(queries[0])
+        responses = await asyncio.gather(*(search(query) for query in queries))
+        rankings = [response for response in responses if isinstance(response, list)]
+        if not rankings:
+            # Every search failed; pass the first error on to the context stage
+            return responses[0]
+        best = {}
+        for ranking in rankings:
+            for result in ranking:
+                content = result["content"]
+                if content not in best or (result.get("score") or 0) > (best[content].get("score") or 0):
+                    best[content] = result
+        fused = reciprocal_rank_fusion([[result["content"] for result in ranking] for ranking in rankings], self.rrf_k)
+        top = max(len(ranking) for ranking in rankings)
+        return [dict(best[content], fused_score=round(score, 6)) for content, score in fused[:top]]
@@ -0,0 +1,207 @@
+import logging
+import re
+from dataclasses import dataclass, field
+from config.config import Config, get_settings
+from services.tokens import count_tokens
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+@dataclass
+class RouteDecision:
+    """Deployment chosen for a request, with the signals that voted for the large model."""
+    model: str
+    reasons: list = field(default_factory=list)
+    escalate: bool = False
+
+    def info(self):
+        return {"model": self.model, "reasons": list(self.reasons), "escalation_enabled": self.escalate}
+
+def query_length_signal(router, query, search):
+    """Long queries tend to carry several constraints or a pasted excerpt."""
+    tokens = count_tokens(query)
+    if tokens > router.max_query_tokens:
+        return f"query_length:{tokens}"
+    return None
+
+def query_complexity_signal(router, query, search):
+    """Comparisons, explanations, multi-step requests and multiple questions need more reasoning."""
+    words = set(_WORD_PATTERN.findall(query.lower()))
+    terms = sorted(words & router.complexity_terms)
+    questions = query.count("?")
+    if len(terms) >= router.min_complexity_terms or questions > 1:
+        return f"query_complexity:{','.join(terms) or f'{questions}_questions'}"
+    return None
+
+def relevance_scores(router, search):
+    """Returns the relevance scores of the search results, or None when they only carry fused ranks.
+
+    Semantic ranking gives a "reranker_score". Hybrid search scores are reciprocal rank
+    fusion scores, which sit near 1/61 whatever the relevance, so they are not used.
+    """
+    results = search or []
+    if results and all(result.get("reranker_score") is not None for result in results):
+        return [result["reranker_score"] for result in results]
+    if router.search_type in ("hybrid", "hybrid_semantic"):
+        return None
+    return [result.get("score") or 0 for result in results]
+
+def retrieval_spread_signal(router, query, search):
+    """A flat score distribution means no chunk clearly answers the query; the answer must be synthesized."""
+    scores = relevance_scores(router, search)
+    if scores is None:
+        return None
+    scores = sorted(scores, reverse=True)
+    if len(scores) < 2 or scores[0] <= 0:
+        return None
+    margin = (scores[0] - sum(scores[1:]) / len(scores[1:])) / scores[0]
+    if margin < router.min_score_margin:
+        return f"retrieval_spread:{margin:.3f}"
+    return None
+
+SIGNALS = {
+    "query_length": query_length_signal,
+    "query_complexity": query_complexity_signal,
+    "retrieval_spread": retrieval_spread_signal,
+}
+
+def register_signal(name, signal):
+    """Registers a routing signal: a function (router, query, search) returning a reason for the large model, or None."""
+    SIGNALS[name] = signal
+
+class ModelRouter:
+    """Class to choose the chat deployment for each request.
+
+    The configured signals vote for the large deployment; if none does, the small one
+    runs. With `escalate` enabled, a small-model answer that breaks the function schema
+    or is empty is retried on the large deployment; with `escalate_on_phrases`, so is an
+    answer containing one of `low_confidence_phrases`. The "cannot find" answer the system
+    prompt asks for is not low confidence: the large model would not find it either.
+    """
+
+    def __init__(self):
+        try:
+            # Set parameters
+            config = Config().config
+            deployments = config["model"]["deployments"]
+            routing_config = config["model"].get("routing", {})
+            self.enabled = routing_config.get("enabled", False)
+            self.large_model = deployments[routing_config.get("large", "gpt-4o")]["name"]
+            self.small_model = deployments[routing_config.get("small", "gpt-4o-mini")]["name"]
+            self.signals = routing_config.get("signals", list(SIGNALS))
+            self.max_query_tokens = routing_config.get("max_query_tokens", 60)
+            self.complexity_terms = set(routing_config.get("complexity_terms", []))
+            self.min_complexity_terms = routing_config.get("min_complexity_terms", 1)
+            self.min_score_margin = routing_config.get("min_score_margin", 0.1)
+            self.search_type = config["ai_search"]["search_type"]
+            self.escalate = routing_config.get("escalate", True)
+            self.escalate_on_phrases = routing_config.get("escalate_on_phrases", False)
+            self.low_confidence_phrases = [phrase.lower() for phrase in routing_config.get("low_confidence_phrases", [])]
+            self.required_fields = self.schema_required_fields(config)
+            # Prices per token by deployment name, for the cost of the model that actually ran
+            self.prices = {deployment["name"]: deployment["price"] for deployment in deployments.values()}
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+
+    @staticmethod
+    def schema_required_fields(config):
+        """Returns the fields the function schema requires, when answers are parsed into a dict."""
+        parameters = config["model"]["parameters"]
+        if parameters.get("response_format") not in ("function_calling", "base_model"):
+            return []
+        schema = get_settings().function_schema(parameters["functions"]["file"]) or [{}]
+        return schema[0].get("parameters", {}).get("required", ["answer"])
+
+    def route(self, query, search=None):
+        """Returns the RouteDecision for a query and its search results ({"score", "content"})."""
+        if not self.enabled:
+            return RouteDecision(self.large_model)
+        reasons = []
+        for name in self.signals:
+            try:
+                reason = SIGNALS[name](self, query, search)
+            except Exception as e:
+                logger.warning(f"Routing signal '{name}' failed, voting for the large model: {e}")
+                reason = f"{name}:error"
+            if reason:
+                reasons.append(reason)
+        if reasons:
+            return RouteDecision(self.large_model, reasons)
+        return RouteDecision(self.small_model, escalate=self.escalate)
+
+    def escalation_reason(self, result):
+        """Returns why a small-model result should be retried on the large model, or None."""
+        if not result or "error" in result:
+            return "error"
+        response = result.get("response")
+        if self.required_fields:
+            if not isinstance(response, dict) or any(not response.get(name) for name in self.required_fields):
+                return "schema"
+            answer = response.get("answer", "")
+        else:
+            answer = response.get("answer", "") if isinstance(response, dict) else str(response or "")
+        if not answer.strip():
+            return "low_confidence:empty"
+        if not self.escalate_on_phrases:
+            return None
+        lowered = answer.lower()
+        for phrase in self.low_confidence_phrases:
+            if phrase in lowered:
+                return f"low_confidence:{phrase}"
+        return None
+
+    def price(self, model):
+        """Returns the {"input_tokens", "output_tokens", "cached_input_tokens"} price per token of a deployment.
+
+        Cached input tokens cost the input price unless the deployment sets a discounted one.
+        """
+        price = self.prices.get(model, {"input_tokens": 0, "output_tokens": 0})
+        return {"cached_input_tokens": price["input_tokens"], **price}
+
+    def cost(self, attempts):
+        """Returns the total cost of every attempt, each priced with the model that ran it."""
+        total = 0
+        for attempt in attempts:
+            price = self.price(attempt["model"])
+            cached = attempt.get("cached_input_tokens", 0)
+            total += (
+                (attempt["input_tokens"] - cached) * price["input_tokens"]
+                + cached * price["cached_input_tokens"]
+                + attempt["output_tokens"] * price["output_tokens"]
+            )
+        return total
+
+    async def run_async(self, decision, complete):
+        """Runs `complete(model)` for the decision, escalating once if the small model's answer is rejected.
+
+        Returns the result of the attempt kept, with "attempts" (model and tokens of every
+        attempt) and "routing" (the decision and any escalation).
+        """
+        attempts = []
+        routing = decision.info()
+
+        async def attempt(model):
+            result = await complete(model)
+            if result and "error" not in result:
+                attempts.append({
+                    "model": result["model"],
+                    "input_tokens": result["input_tokens"],
+                    "output_tokens": result["output_tokens"],
+                    "cached_input_tokens": result.get("cached_input_tokens", 0),
+                })
+            return result
+
+        result = await attempt(decision.model)
+        reason = self.escalation_reason(result) if decision.escalate and decision.model != self.large_model else None
+        if reason:
+            logger.info(f"Escalating from {decision.model} to {self.large_model}: {reason}")
+            routing["escalated"] = reason
+            result = await attempt(self.large_model)
+        if result and "error" not in result:
+            result = dict(result, attempts=attempts, routing=routing)
+        return result
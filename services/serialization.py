@@ -0,0 +1,71 @@
+import json
+import logging
+import threading
+from config.config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class JSONCodec:
+    """Compact JSON encoding and decoding on orjson, or on the standard library without it.
+
+    `serialization.json_backend` is "auto" (orjson when installed), "orjson" or "json".
+    Decoding errors are ValueError subclasses with both backends.
+    """
+
+    def __init__(self, backend=None):
+        try:
+            # Set parameters
+            config = Config().config
+            backend = backend or config.get("serialization", {}).get("json_backend", "auto")
+            logger.info("Configuration loaded successfully.")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {e}")
+            raise
+        if backend not in ("auto", "orjson", "json"):
+            raise ValueError(f"Unknown JSON backend: {backend}")
+        self.orjson = None
+        if backend != "json":
+            try:
+                import orjson
+                self.orjson = orjson
+            except ImportError as e:
+                if backend == "orjson":
+                    logger.error("The orjson JSON backend requires the 'orjson' package.")
+                    raise ValueError("The orjson JSON backend requires the 'orjson' package.") from e
+        self.backend = "orjson" if self.orjson else "json"
+        # Bound directly: decoding runs on every model response
+        self.loads = self.orjson.loads if self.orjson else json.loads
+        self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(self, obj, sort_keys=False, indent=False, default=None):
+        """Encodes `obj` as UTF-8 JSON without escaping non-ASCII characters."""
+        if self.orjson:
+            option = self.orjson.OPT_NON_STR_KEYS
+            if sort_keys:
+                option |= self.orjson.OPT_SORT_KEYS
+            if indent:
+                option |= self.orjson.OPT_INDENT_2
+            return self.orjson.dumps(obj, default=default, option=option)
+        return self.dumps(obj, sort_keys, indent, default).encode("utf-8")
+
+    def dumps(self, obj, sort_keys=False, indent=False, default=None):
+        if self.orjson:
+            return self.dumps_bytes(obj, sort_keys, indent, default).decode("utf-8")
+        if not (sort_keys or indent or default):
+            return self.encoder.encode(obj)
+        separators = None if indent else (",", ":")
+        return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, indent=2 if indent else None, separators=separators, default=default)
+
+_codec = None
+_codec_lock = threading.Lock()
+
+def get_json_codec():
+    """Returns the process-wide JSON codec."""
+    global _codec
+    if _codec is None:
+        with _codec_lock:
+            if _codec is None:
+                _codec = JSONCodec()
+    return _codec
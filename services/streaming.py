@@ -0,0 +1,74 @@
+import re
+from services.serialization import get_json_codec
+
+_PLAIN = re.compile(r'[^"\\]+')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class AnswerFieldExtractor:
+    """Incrementally decodes the string value of one field from streamed JSON arguments.
+
+    Function-call arguments arrive as JSON fragments such as '{"ans', 'wer": "Hel', 'lo\\n'.
+    `feed` returns the newly decoded characters of the field so they can be forwarded as
+    soon as they arrive.
+    """
+
+    def __init__(self, field="answer"):
+        self.field_start = re.compile(rf'"{re.escape(field)}"\s*:\s*"')
+        self.buffer = ""
+        self.inside = False
+        self.done = False
+
+    def feed(self, fragment):
+        """Consumes a JSON fragment and returns the decoded text it completed."""
+        if self.done or not fragment:
+            return ""
+        # Only the undecoded tail is kept, so long answers are not rescanned on every fragment
+        buffer = self.buffer + fragment
+        position = 0
+        if not self.inside:
+            match = self.field_start.search(buffer)
+            if not match:
+                self.buffer = buffer
+                return ""
+            self.inside = True
+            position = match.end()
+
+        output = []
+        length = len(buffer)
+        while position < length:
+            plain = _PLAIN.match(buffer, position)
+            if plain:
+                output.append(plain.group())
+                position = plain.end()
+                continue
+            if buffer[position] == '"':
+                self.done = True
+                position += 1
+                break
+            # Wait for the rest of an escape sequence split across fragments
+            if position + 1 >= length:
+                break
+            escape = buffer[position + 1]
+            if escape == 'u':
+                if position + 6 > length:
+                    break
+                code = int(buffer[position + 2:position + 6], 16)
+                if 0xD800 <= code < 0xDC00:
+                    if position + 12 > length:
+                        break
+                    if buffer[position + 6:position + 8] == '\\u':
+                        low = int(buffer[position + 8:position + 12], 16)
+                        output.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                        position += 12
+                        continue
+                output.append(chr(code))
+                position += 6
+            else:
+                output.append(_ESCAPES.get(escape, escape))
+                position += 2
+        self.buffer = "" if self.done else buffer[position:]
+        return "".join(output)
+
+def format_sse(event, data):
+    """Formats one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {get_json_codec().dumps(data)}\n\n"
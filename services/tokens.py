@@ -0,0 +1,48 @@
+import json
+import logging
+from functools import lru_cache
+import tiktoken
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tokens added by the chat format around every message
+TOKENS_PER_MESSAGE = 3
+
+@lru_cache(maxsize=None)
+def get_encoding(model="gpt-4o"):
+    """Returns the tiktoken encoding for `model`, or None when it cannot be loaded."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+        # Older tiktoken releases do not know the gpt-4o vocabulary yet
+        for name in ("o200k_base", "cl100k_base"):
+            try:
+                return tiktoken.get_encoding(name)
+            except ValueError:
+                continue
+    except Exception as e:
+        # tiktoken downloads its vocabularies on first use; fall back to an estimate offline
+        logger.warning(f"Tokenizer unavailable, estimating token counts: {e}")
+    return None
+
+def count_tokens(text, model="gpt-4o"):
+    """Counts the tokens of `text` with the tokenizer of `model`."""
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    encoding = get_encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+def count_message_tokens(messages, model="gpt-4o"):
+    """Counts the prompt tokens of a list of chat messages."""
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(message.get("content"), model)
+        for message in messages or []
+    ) + TOKENS_PER_MESSAGE
@@ -7,6 +7,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Make sessionId editable
     let sessionId = generateSessionId();
+    // The message being sent and its idempotency key; a resend of the same message reuses the key
+    let pendingMessage = null;
     
     // Initial message
     addWelcomeMessage();
@@ -46,46 +48,49 @@ document.addEventListener('DOMContentLoaded', function() {
         messageInput.disabled = true;
         messageInput.value = '';
 
+        let loadingIndicator = null;
         try {
             // Show user message
             addMessage(message, false);
 
             // Show loading indicator
-            const loadingIndicator = addLoadingIndicator();
+            loadingIndicator = addLoadingIndicator();
+            let streamingMessage = null;
 
-            // Send message to backend
-            const response = await sendMessage(sessionId, message);
-            
-            // Remove loading indicator
-            loadingIndicator.remove();
-
-            // Process backend response
-            if (response) {
-                console.log('Backend response:', response); // For debugging
-                let responseText = '';
-                
-                // Verify the specific structure of the response
-                if (response.response && response.response.answer) {
-                    responseText = response.response.answer;
-                } else if (response.response) {
-                    responseText = response.response;
-                } else if (response.answer) {
-                    responseText = response.answer;
-                } else if (typeof response === 'string') {
-                    responseText = response;
-                } else {
-                    console.log('Unrecognized response structure:', response);
-                    throw new Error('Unrecognized response format');
+            // Stream the answer from the backend, rendering tokens as they arrive. The key
+            // belongs to the message, not to the request: a retry or a resend after an error
+            // gets the turn already running or its answer instead of a new turn
+            if (!pendingMessage || pendingMessage.sessionId !== sessionId || pendingMessage.text !== message) {
+                pendingMessage = { sessionId: sessionId, text: message, key: generateSessionId() };
+            }
+            const onDelta = function(text) {
+                if (!streamingMessage) {
+                    loadingIndicator.remove();
+                    streamingMessage = addMessage('', true);
                 }
+                streamingMessage.append(text);
+            };
+            let responseText;
+            try {
+                responseText = await sendMessageStream(sessionId, message, pendingMessage.key, onDelta);
+            } catch (error) {
+                // Retry a request lost before any answer arrived once, with the same key
+                if (streamingMessage) throw error;
+                console.warn('Retrying the message after:', error);
+                responseText = await sendMessageStream(sessionId, message, pendingMessage.key, onDelta);
+            }
+            pendingMessage = null;
 
-                if (responseText) {
-                    addMessage(responseText, true);
-                    // Ensure scroll after the response
-                    scrollToBottom();
-                }
+            if (!streamingMessage) {
+                loadingIndicator.remove();
+                streamingMessage = addMessage('', true);
             }
+            // Re-render the complete answer so links are formatted
+            streamingMessage.finish(responseText);
+            scrollToBottom();
         } catch (error) {
             console.error('Error:', error);
+            if (loadingIndicator) loadingIndicator.remove();
             addMessage("Sorry, an error occurred. Please try again.", true);
         } finally {
             // Re-enable input
@@ -130,7 +135,29 @@ document.addEventListener('DOMContentLoaded', function() {
 
         const contentDiv = document.createElement('div');
         contentDiv.className = 'message-content';
-        
+        renderContent(contentDiv, text);
+
+        messageDiv.appendChild(contentDiv);
+        chatBox.appendChild(messageDiv);
+        scrollToBottom();
+
+        // Handle to update the message while its answer is streamed
+        let streamedText = text;
+        return {
+            append: function(delta) {
+                streamedText += delta;
+                contentDiv.textContent = streamedText;
+                scrollToBottom();
+            },
+            finish: function(finalText) {
+                contentDiv.innerHTML = '';
+                renderContent(contentDiv, finalText || streamedText);
+            }
+        };
+    }
+
+    // Function to render message text, converting <link> tags and line breaks
+    function renderContent(contentDiv, text) {
         // Process the text to convert <link> tags into hyperlinks
         const processLinks = (text) => {
             const linkRegex = /<link>(.*?)<\/link>/g;
@@ -172,10 +199,6 @@ document.addEventListener('DOMContentLoaded', function() {
                 contentDiv.appendChild(document.createElement('br'));
             }
         });
-
-        messageDiv.appendChild(contentDiv);
-        chatBox.appendChild(messageDiv);
-        scrollToBottom();
     }
 
     function addLoadingIndicator() {
@@ -222,12 +245,13 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    async function sendMessage(sessionId, message) {
+    async function sendMessage(sessionId, message, idempotencyKey) {
         const response = await fetch('/chat', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-                'Accept': 'application/json'
+                'Accept': 'application/json',
+                'Idempotency-Key': idempotencyKey
             },
             body: JSON.stringify({
                 sessionID: sessionId,
@@ -241,4 +265,73 @@ document.addEventListener('DOMContentLoaded', function() {
 
         return await response.json();
     }
+
+    // Streams the answer over Server-Sent Events; calls onDelta with each text fragment
+    // and resolves with the complete answer
+    async function sendMessageStream(sessionId, message, idempotencyKey, onDelta) {
+        // Browsers without streamed fetch bodies get the whole answer at once
+        if (!window.ReadableStream || !window.TextDecoder) {
+            const result = await sendMessage(sessionId, message, idempotencyKey);
+            const text = (result.response && result.response.answer) || result.response || result.answer || '';
+            onDelta(text);
+            return text;
+        }
+
+        const response = await fetch('/chat/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+                'Idempotency-Key': idempotencyKey
+            },
+            body: JSON.stringify({
+                sessionID: sessionId,
+                query: message || ''
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        eventName = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                });
+                if (!data) continue;
+
+                const payload = JSON.parse(data);
+                if (eventName === 'delta') {
+                    answer += payload.text;
+                    onDelta(payload.text);
+                } else if (eventName === 'done') {
+                    return typeof payload.response === 'string' ? payload.response : answer;
+                } else if (eventName === 'error') {
+                    throw new Error(payload.error);
+                }
+            }
+        }
+        return answer;
+    }
 });
\ No newline at end of file